@@ -0,0 +1,4 @@
+use hydradb;
+alter table tNetwork add column version INT NOT NULL DEFAULT 0;
+update tNetwork set version = (select coalesce(max(c.version), 0) from tNetworkChange c
+                               where c.network_id = tNetwork.network_id);
@@ -0,0 +1,2 @@
+use hydradb;
+create index idx_node_network_xy on tNode (network_id, node_x, node_y);
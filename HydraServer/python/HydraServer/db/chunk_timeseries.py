@@ -0,0 +1,88 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Split the large timeseries in tDataset into the chunks in tDatasetChunk.
+
+    Timeseries are split as they are added or updated, if they have at least
+    timeseries_chunk_rows rows ([db] in hydra.ini). Those added before then,
+    or before the setting was changed, are read whole until this has been
+    run. Run HydraServer.db.migrate_timeseries first, as only timeseries in
+    the binary format are split. It splits every timeseries again, so it can
+    be run again if it is interrupted.
+
+    Usage: python -m HydraServer.db.chunk_timeseries
+"""
+import logging
+
+from sqlalchemy import create_engine, select, and_
+
+from HydraLib import config
+from HydraServer.db.model import Dataset, DatasetChunk
+from HydraServer.util.dataformat import split_timeseries
+
+log = logging.getLogger(__name__)
+
+def chunk_timeseries(engine, batch_size=100):
+    """
+        Split the timeseries in the database, batch_size at a time,
+        each batch in its own transaction.
+        Returns the number of timeseries split.
+    """
+    dataset_tbl = Dataset.__table__
+    chunk_tbl = DatasetChunk.__table__
+
+    num_split = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select([dataset_tbl.c.dataset_id,
+                                        dataset_tbl.c.value]).where(
+                                            and_(dataset_tbl.c.data_type=='timeseries',
+                                                 dataset_tbl.c.dataset_id > last_id)).order_by(
+                                            dataset_tbl.c.dataset_id).limit(batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            last_id = rows[-1].dataset_id
+
+            chunks = []
+            for r in rows:
+                try:
+                    dataset_chunks = split_timeseries(r.value)
+                except Exception as e:
+                    log.warn("Unable to split timeseries %s: %s", r.dataset_id, e)
+                    continue
+
+                if len(dataset_chunks) > 0:
+                    num_split = num_split + 1
+                for chunk in dataset_chunks:
+                    chunk['dataset_id'] = r.dataset_id
+                    chunks.append(chunk)
+
+            conn.execute(chunk_tbl.delete().where(
+                            chunk_tbl.c.dataset_id.in_([r.dataset_id for r in rows])))
+            if len(chunks) > 0:
+                conn.execute(chunk_tbl.insert(), chunks)
+
+        log.info("%s timeseries split, up to dataset %s", num_split, last_id)
+
+    return num_split
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO')
+    engine = create_engine(config.get('mysqld', 'url'))
+    DatasetChunk.__table__.create(engine, checkfirst=True)
+    chunk_timeseries(engine)
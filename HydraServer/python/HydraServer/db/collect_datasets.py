@@ -0,0 +1,305 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Delete the datasets in tDataset which are no longer used, and
+    optionally merge datasets which are duplicates of each other.
+
+    A dataset is used if a resource scenario, a dataset collection or
+    a type attribute (as its default) refers to it. When scenarios or
+    networks are deleted, their datasets are left behind, along with their
+    metadata, owners and search index entries. This deletes them. Datasets
+    added recently are left alone, however, as a request which has added a
+    dataset may not yet have committed whatever uses it.
+
+    Duplicates are datasets whose name, units, dimension, type, value and
+    metadata are identical, but which have different hashes because they
+    were hashed with Python's built-in hash(). rehash_datasets leaves them
+    with their old hashes. Merging moves everything which refers to a
+    duplicate onto the dataset which has its correct hash, gives that
+    dataset the duplicate's owners, then deletes the duplicate. It also
+    changes the version of the datasets in tCacheVersion, so the server
+    stops using the copies of networks it has cached.
+
+    Both work through tDataset in batches, each in its own transaction, so
+    this can be run again if it is interrupted.
+
+    Usage: python -m HydraServer.db.collect_datasets [--merge-duplicates]
+"""
+import logging
+import argparse
+import datetime
+
+from sqlalchemy import create_engine, select, union, and_
+from sqlalchemy.sql.expression import bindparam
+
+from HydraLib import config
+from HydraServer.db.model import Dataset, Metadata, DatasetOwner, DatasetTrigram,\
+        DatasetChunk, DatasetCollectionItem, ResourceScenario, TypeAttr, CacheVersion
+from HydraServer.util.hdb import get_dataset_metadata
+from HydraServer.util import generate_data_hash
+
+log = logging.getLogger(__name__)
+
+def _get_used_ids(conn, dataset_ids):
+    """
+        Of the given datasets, get the IDs of those referred to by a resource
+        scenario, a dataset collection or a type attribute.
+    """
+    rs_tbl   = ResourceScenario.__table__
+    item_tbl = DatasetCollectionItem.__table__
+    ta_tbl   = TypeAttr.__table__
+
+    used_qry = union(select([rs_tbl.c.dataset_id]).where(rs_tbl.c.dataset_id.in_(dataset_ids)),
+                     select([item_tbl.c.dataset_id]).where(item_tbl.c.dataset_id.in_(dataset_ids)),
+                     select([ta_tbl.c.default_dataset_id]).where(
+                                            ta_tbl.c.default_dataset_id.in_(dataset_ids)))
+
+    return set([r[0] for r in conn.execute(used_qry).fetchall()])
+
+def _delete_datasets(conn, dataset_ids):
+    """
+        Delete datasets, along with their metadata, owners, search index
+        entries, chunks and collection entries.
+    """
+    for tbl in (Metadata.__table__, DatasetTrigram.__table__, DatasetChunk.__table__,
+                DatasetOwner.__table__, DatasetCollectionItem.__table__, Dataset.__table__):
+        conn.execute(tbl.delete().where(tbl.c.dataset_id.in_(dataset_ids)))
+
+def delete_orphan_datasets(engine, batch_size=500, min_age_hours=24):
+    """
+        Delete the datasets which are no longer used, and were added more
+        than min_age_hours ago, batch_size at a time, each batch in its own
+        transaction.
+        Returns the number of datasets deleted.
+    """
+    dataset_tbl = Dataset.__table__
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=min_age_hours)
+
+    num_deleted = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            dataset_ids = [r.dataset_id for r in conn.execute(
+                                select([dataset_tbl.c.dataset_id]).where(
+                                    and_(dataset_tbl.c.dataset_id > last_id,
+                                         dataset_tbl.c.cr_date < cutoff)).order_by(
+                                    dataset_tbl.c.dataset_id).limit(batch_size)).fetchall()]
+            if len(dataset_ids) == 0:
+                break
+
+            last_id = dataset_ids[-1]
+
+            used_ids = _get_used_ids(conn, dataset_ids)
+            orphan_ids = [dataset_id for dataset_id in dataset_ids if dataset_id not in used_ids]
+            if len(orphan_ids) == 0:
+                continue
+
+            _delete_datasets(conn, orphan_ids)
+            num_deleted = num_deleted + len(orphan_ids)
+
+        log.info("%s orphaned datasets deleted, up to dataset %s", num_deleted, last_id)
+
+    return num_deleted
+
+def _get_datasets(conn, dataset_ids):
+    """
+        Get the rows, including the values, of the given datasets,
+        keyed on dataset ID.
+    """
+    dataset_tbl = Dataset.__table__
+    rows = conn.execute(select([dataset_tbl.c.dataset_id,
+                                dataset_tbl.c.data_name,
+                                dataset_tbl.c.data_units,
+                                dataset_tbl.c.data_dimen,
+                                dataset_tbl.c.data_type,
+                                dataset_tbl.c.data_hash,
+                                dataset_tbl.c.hidden,
+                                dataset_tbl.c.value]).where(
+                                    dataset_tbl.c.dataset_id.in_(dataset_ids))).fetchall()
+    return dict([(r.dataset_id, r) for r in rows])
+
+def _is_duplicate(duplicate, dataset, metadata):
+    """
+        Check that two datasets are identical in everything which is
+        hashed, and in visibility, rather than relying on their hashes.
+    """
+    for field in ('data_name', 'data_units', 'data_dimen', 'data_type', 'value', 'hidden'):
+        if duplicate[field] != dataset[field]:
+            return False
+    return metadata.get(duplicate.dataset_id, {}) == metadata.get(dataset.dataset_id, {})
+
+def _repoint_datasets(conn, merges):
+    """
+        Move everything which refers to a duplicate dataset onto the dataset
+        it is a duplicate of. 'merges' is a dict of duplicate ID to dataset ID.
+    """
+    rs_tbl    = ResourceScenario.__table__
+    ta_tbl    = TypeAttr.__table__
+    item_tbl  = DatasetCollectionItem.__table__
+    owner_tbl = DatasetOwner.__table__
+
+    repoints = [{'b_old_id':old_id, 'b_new_id':new_id} for old_id, new_id in merges.items()]
+
+    conn.execute(rs_tbl.update().where(
+                    rs_tbl.c.dataset_id==bindparam('b_old_id')).values(
+                    dataset_id=bindparam('b_new_id')), repoints)
+
+    conn.execute(ta_tbl.update().where(
+                    ta_tbl.c.default_dataset_id==bindparam('b_old_id')).values(
+                    default_dataset_id=bindparam('b_new_id')), repoints)
+
+    all_ids = list(set(merges.keys() + merges.values()))
+
+    #A collection can contain a duplicate and the dataset it duplicates,
+    #or several duplicates of it, but the dataset can only be in it once.
+    items = conn.execute(select([item_tbl.c.collection_id, item_tbl.c.dataset_id]).where(
+                                item_tbl.c.dataset_id.in_(all_ids))).fetchall()
+    collection_items = set([(i.collection_id, i.dataset_id) for i in items])
+    for i in items:
+        new_id = merges.get(i.dataset_id)
+        if new_id is None:
+            continue
+        if (i.collection_id, new_id) not in collection_items:
+            conn.execute(item_tbl.update().where(
+                            (item_tbl.c.collection_id==i.collection_id) &
+                            (item_tbl.c.dataset_id==i.dataset_id)).values(dataset_id=new_id))
+            collection_items.add((i.collection_id, new_id))
+
+    #Anyone who could see a duplicate can see the dataset it duplicates.
+    owners = conn.execute(select([owner_tbl.c.user_id,
+                                  owner_tbl.c.dataset_id,
+                                  owner_tbl.c.view,
+                                  owner_tbl.c.edit,
+                                  owner_tbl.c.share]).where(
+                                owner_tbl.c.dataset_id.in_(all_ids))).fetchall()
+    dataset_owners = set([(o.user_id, o.dataset_id) for o in owners])
+    new_owners = []
+    for o in owners:
+        new_id = merges.get(o.dataset_id)
+        if new_id is None or (o.user_id, new_id) in dataset_owners:
+            continue
+        new_owners.append(dict(user_id    = o.user_id,
+                               dataset_id = new_id,
+                               view       = o.view,
+                               edit       = o.edit,
+                               share      = o.share))
+        dataset_owners.add((o.user_id, new_id))
+
+    if len(new_owners) > 0:
+        conn.execute(owner_tbl.insert(), new_owners)
+
+def _bump_data_version(conn):
+    """
+        Change the version of the datasets, as the networks using
+        the merged datasets now refer to different ones.
+    """
+    version_tbl = CacheVersion.__table__
+    res = conn.execute(version_tbl.update().where(
+                            version_tbl.c.version_key=='DATA').values(
+                            version=version_tbl.c.version + 1))
+    if res.rowcount == 0:
+        conn.execute(version_tbl.insert(), version_key='DATA', version=1)
+
+def merge_duplicate_datasets(engine, batch_size=500):
+    """
+        Merge each dataset which is a duplicate of another into that other
+        dataset, batch_size at a time, each batch in its own transaction.
+        Returns the number of duplicates merged.
+    """
+    dataset_tbl = Dataset.__table__
+
+    num_merged = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            dataset_ids = [r.dataset_id for r in conn.execute(
+                                select([dataset_tbl.c.dataset_id]).where(
+                                    dataset_tbl.c.dataset_id > last_id).order_by(
+                                    dataset_tbl.c.dataset_id).limit(batch_size)).fetchall()]
+            if len(dataset_ids) == 0:
+                break
+
+            last_id = dataset_ids[-1]
+
+            datasets = _get_datasets(conn, dataset_ids)
+
+            metadata = get_dataset_metadata(conn, datasets.keys())
+
+            new_hashes = {}
+            for r in datasets.values():
+                new_hash = generate_data_hash(dict(data_name  = r.data_name,
+                                                   data_units = r.data_units,
+                                                   data_dimen = r.data_dimen,
+                                                   data_type  = r.data_type,
+                                                   value      = r.value,
+                                                   metadata   = metadata.get(r.dataset_id, {})))
+                if new_hash != r.data_hash:
+                    new_hashes[r.dataset_id] = new_hash
+
+            if len(new_hashes) == 0:
+                continue
+
+            #The datasets already using the correct hashes of the others.
+            hash_owners = dict(conn.execute(select([dataset_tbl.c.data_hash,
+                                                    dataset_tbl.c.dataset_id]).where(
+                                dataset_tbl.c.data_hash.in_(new_hashes.values()))).fetchall())
+            if len(hash_owners) == 0:
+                continue
+
+            originals = _get_datasets(conn, hash_owners.values())
+            metadata.update(get_dataset_metadata(conn, originals.keys()))
+
+            merges = {}
+            for dataset_id, new_hash in new_hashes.items():
+                original_id = hash_owners.get(new_hash)
+                if original_id is None or original_id == dataset_id:
+                    continue
+                if not _is_duplicate(datasets[dataset_id], originals[original_id], metadata):
+                    log.warn("Dataset %s has the same hash as dataset %s but is not identical"
+                             " to it, or differs in visibility. It is not merged.",
+                             dataset_id, original_id)
+                    continue
+                merges[dataset_id] = original_id
+
+            if len(merges) == 0:
+                continue
+
+            _repoint_datasets(conn, merges)
+            _delete_datasets(conn, merges.keys())
+            _bump_data_version(conn)
+            num_merged = num_merged + len(merges)
+
+        log.info("%s duplicate datasets merged, up to dataset %s", num_merged, last_id)
+
+    return num_merged
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete datasets which are no longer used.')
+    parser.add_argument('--merge-duplicates', action='store_true',
+                        help='Merge duplicate datasets before deleting unused ones.')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='The number of datasets processed in each transaction.')
+    parser.add_argument('--min-age-hours', type=int, default=24,
+                        help='Only delete datasets added more than this many hours ago.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level='INFO')
+    engine = create_engine(config.get('mysqld', 'url'))
+    CacheVersion.__table__.create(engine, checkfirst=True)
+    if args.merge_duplicates:
+        merge_duplicate_datasets(engine, args.batch_size)
+    delete_orphan_datasets(engine, args.batch_size, args.min_age_hours)
@@ -0,0 +1,102 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Build the search index, tDatasetTrigram, for the datasets in tDataset.
+
+    Datasets are indexed as they are added or updated, but those added
+    before the index existed are not in it until this has been run, so
+    searches on name or metadata do not use the index until it has finished
+    and marked the index as populated. It rebuilds the index of every
+    dataset, so it can be run again if it is interrupted.
+
+    Usage: python -m HydraServer.db.index_datasets
+"""
+import logging
+
+from sqlalchemy import create_engine, select
+
+from HydraLib import config
+from HydraServer.db.model import Dataset, DatasetTrigram, CacheVersion
+from HydraServer.util.hdb import get_dataset_metadata
+from HydraServer.util import get_dataset_trigrams
+
+log = logging.getLogger(__name__)
+
+def index_datasets(engine, batch_size=500):
+    """
+        Rebuild the search index of all datasets, batch_size at a time,
+        each batch in its own transaction.
+        Returns the number of datasets indexed.
+    """
+    dataset_tbl = Dataset.__table__
+    trigram_tbl = DatasetTrigram.__table__
+
+    num_indexed = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select([dataset_tbl.c.dataset_id,
+                                        dataset_tbl.c.data_name]).where(
+                                            dataset_tbl.c.dataset_id > last_id).order_by(
+                                            dataset_tbl.c.dataset_id).limit(batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            last_id = rows[-1].dataset_id
+
+            dataset_ids = [r.dataset_id for r in rows]
+            metadata = get_dataset_metadata(conn, dataset_ids)
+
+            trigrams = []
+            for r in rows:
+                for field, trigram in get_dataset_trigrams(r.data_name,
+                                                           metadata.get(r.dataset_id, {})):
+                    trigrams.append(dict(dataset_id = r.dataset_id,
+                                         field      = field,
+                                         trigram    = trigram))
+
+            conn.execute(trigram_tbl.delete().where(trigram_tbl.c.dataset_id.in_(dataset_ids)))
+            if len(trigrams) > 0:
+                conn.execute(trigram_tbl.insert(), trigrams)
+
+            num_indexed = num_indexed + len(rows)
+
+        log.info("%s datasets indexed, up to dataset %s", num_indexed, last_id)
+
+    _mark_populated(engine)
+
+    return num_indexed
+
+def _mark_populated(engine):
+    """
+        Mark the index as holding every dataset, so that search_datasets
+        starts using it.
+    """
+    version_tbl = CacheVersion.__table__
+    with engine.begin() as conn:
+        res = conn.execute(version_tbl.update().where(
+                                version_tbl.c.version_key=='TRIGRAM_INDEX').values(
+                                version=1))
+        if res.rowcount == 0:
+            conn.execute(version_tbl.insert(), {'version_key':'TRIGRAM_INDEX', 'version':1})
+    log.info("Search index marked as populated")
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO')
+    engine = create_engine(config.get('mysqld', 'url'))
+    DatasetTrigram.__table__.create(engine, checkfirst=True)
+    CacheVersion.__table__.create(engine, checkfirst=True)
+    index_datasets(engine)
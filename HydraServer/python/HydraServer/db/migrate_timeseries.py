@@ -0,0 +1,118 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Convert the timeseries in tDataset which are stored as JSON into the
+    binary format described in HydraServer.util.dataformat.
+
+    The server reads both formats, so this can be run at any time, and
+    run again if it is interrupted. Timeseries which cannot be stored in
+    the binary format, such as seasonal ones, are left as they are.
+
+    The hash of each converted dataset is recalculated, as it depends on
+    the stored value. A dataset whose new hash is already in use (because
+    the same data has been added again since the upgrade) is left as it is.
+
+    Usage: python -m HydraServer.db.migrate_timeseries
+"""
+import logging
+
+import pandas as pd
+from sqlalchemy import create_engine, select, and_
+
+from HydraLib import config
+from HydraServer.db.model import Dataset
+from HydraServer.util import generate_data_hash
+from HydraServer.util.hdb import get_dataset_metadata
+from HydraServer.util.dataformat import is_binary, decode_value, encode_timeseries
+
+log = logging.getLogger(__name__)
+
+def migrate_timeseries(engine, batch_size=500):
+    """
+        Convert the JSON timeseries in the database, batch_size at a time,
+        each batch in its own transaction.
+        Returns the number of timeseries converted.
+    """
+    dataset_tbl = Dataset.__table__
+
+    num_converted = 0
+    num_skipped   = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select([dataset_tbl.c.dataset_id,
+                                        dataset_tbl.c.data_name,
+                                        dataset_tbl.c.data_units,
+                                        dataset_tbl.c.data_dimen,
+                                        dataset_tbl.c.data_type,
+                                        dataset_tbl.c.value]).where(
+                                            and_(dataset_tbl.c.data_type=='timeseries',
+                                                 dataset_tbl.c.dataset_id > last_id)).order_by(
+                                            dataset_tbl.c.dataset_id).limit(batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            last_id = rows[-1].dataset_id
+
+            to_convert = [r for r in rows if r.value is not None and not is_binary(r.value)]
+            if len(to_convert) == 0:
+                continue
+
+            metadata = get_dataset_metadata(conn, [r.dataset_id for r in to_convert])
+
+            for r in to_convert:
+                try:
+                    #The seasonal key is deliberately left in place, so
+                    #seasonal timeseries stay as JSON.
+                    new_value = encode_timeseries(pd.read_json(decode_value(r.value)))
+                except Exception as e:
+                    log.warn("Unable to read timeseries %s: %s", r.dataset_id, e)
+                    num_skipped = num_skipped + 1
+                    continue
+
+                if not is_binary(new_value):
+                    num_skipped = num_skipped + 1
+                    continue
+
+                new_hash = generate_data_hash(dict(data_name  = r.data_name,
+                                                   data_units = r.data_units,
+                                                   data_dimen = r.data_dimen,
+                                                   data_type  = r.data_type,
+                                                   value      = new_value,
+                                                   metadata   = metadata.get(r.dataset_id, {})))
+
+                existing = conn.execute(select([dataset_tbl.c.dataset_id]).where(
+                                            dataset_tbl.c.data_hash==new_hash)).first()
+                if existing is not None:
+                    log.warn("Not converting timeseries %s. Its data is already in dataset %s",
+                             r.dataset_id, existing.dataset_id)
+                    num_skipped = num_skipped + 1
+                    continue
+
+                conn.execute(dataset_tbl.update().where(
+                                dataset_tbl.c.dataset_id==r.dataset_id).values(
+                                    value=new_value, data_hash=new_hash))
+                num_converted = num_converted + 1
+
+        log.info("%s timeseries converted, %s left as JSON, up to dataset %s",
+                 num_converted, num_skipped, last_id)
+
+    return num_converted
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO')
+    engine = create_engine(config.get('mysqld', 'url'))
+    migrate_timeseries(engine)
@@ -29,16 +29,17 @@ from sqlalchemy import inspect
 
 from HydraLib.HydraException import HydraError, PermissionError
 
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, deferred
 
 from HydraLib.hydra_dateutil import ordinal_to_timestamp, get_datetime
 
 from HydraServer.db import DeclarativeBase as Base, DBSession
 
-from HydraServer.util import generate_data_hash, get_val
+from HydraServer.util import generate_data_hash, get_val, get_dataset_trigrams
+from HydraServer.util.dataformat import encode_timeseries, split_timeseries
 
 from sqlalchemy.sql.expression import case
-from sqlalchemy import UniqueConstraint, and_
+from sqlalchemy import UniqueConstraint, Index, and_
 
 import pandas as pd
 
@@ -86,7 +87,9 @@ class Dataset(Base, Inspect):
 
     start_time = Column(String(60),  nullable=True)
     frequency = Column(String(10),  nullable=True)
-    value = Column('value', LargeBinary(),  nullable=True)
+    #The value can be large, so it is only read when it is first used,
+    #unless a query undefers it.
+    value = deferred(Column('value', LargeBinary(),  nullable=True))
 
     user = relationship('User', backref=backref("datasets", order_by=dataset_id))
 
@@ -155,13 +158,7 @@ class Dataset(Base, Inspect):
                     test_vals.append(v)
 
                 timeseries_pd = pd.DataFrame(test_vals, index=pd.Series(test_val_keys))
-                #Epoch doesn't work here because dates before 1970 are not supported
-                #in read_json. Ridiculous.
-                json_value =  timeseries_pd.to_json(date_format='iso', date_unit='ns')
-                if len(json_value) > config.get('db', 'compression_threshold', 5000):
-                    self.value = zlib.compress(json_value)
-                else:
-                    self.value = json_value
+                self.value = encode_timeseries(timeseries_pd)
             else:
                 self.value = val
         else:
@@ -186,6 +183,27 @@ class Dataset(Base, Inspect):
 
         return data_hash
 
+    def set_trigrams(self, metadata=None):
+        """
+            Rebuild the search index entries of the dataset, in
+            tDatasetTrigram, when it is added or its name or metadata change.
+        """
+        if metadata is None:
+            metadata = self.get_metadata_as_dict()
+
+        self.trigrams = [DatasetTrigram(field=field, trigram=trigram) for field, trigram
+                         in get_dataset_trigrams(self.data_name, metadata)]
+
+    def set_chunks(self):
+        """
+            Split the value of a timeseries again into the chunks in
+            tDatasetChunk, when it is added or its value changes.
+        """
+        chunks = []
+        if self.data_type == 'timeseries':
+            chunks = split_timeseries(self.value)
+        self.chunks = [DatasetChunk(**chunk) for chunk in chunks]
+
     def get_metadata_as_dict(self):
         metadata = {}
         for r in self.metadata:
@@ -321,6 +339,46 @@ class Metadata(Base, Inspect):
 
     dataset = relationship('Dataset', backref=backref("metadata", order_by=dataset_id, cascade="all, delete-orphan"))
 
+class DatasetTrigram(Base, Inspect):
+    """
+        The three-character substrings of each dataset's name and metadata.
+        search_datasets uses these to narrow substring searches using an
+        index, rather than scanning every dataset.
+    """
+
+    __tablename__='tDatasetTrigram'
+    __table_args__ = (
+        Index('idx_dataset_trigram', 'field', 'trigram'),
+    )
+
+    dataset_id = Column(Integer(), ForeignKey('tDataset.dataset_id'), primary_key=True, nullable=False)
+    field = Column(String(20), primary_key=True, nullable=False)
+    trigram = Column(BIGINT(), primary_key=True, nullable=False)
+
+    dataset = relationship('Dataset', backref=backref("trigrams", order_by=dataset_id, cascade="all, delete-orphan"))
+
+class DatasetChunk(Base, Inspect):
+    """
+        A large timeseries, split into windows of time, with the range and
+        number of values in each. The whole timeseries is still stored in
+        tDataset. This lets a range of times be read by fetching and decoding
+        only the windows which cover it.
+    """
+
+    __tablename__='tDatasetChunk'
+
+    dataset_id = Column(Integer(), ForeignKey('tDataset.dataset_id'), primary_key=True, nullable=False)
+    #Times are nanoseconds since the epoch, as in the timeseries' binary format.
+    chunk_start = Column(BIGINT(), primary_key=True, nullable=False)
+    first_time = Column(BIGINT(), nullable=False)
+    last_time = Column(BIGINT(), nullable=False)
+    num_rows = Column(Integer(), nullable=False)
+    min_val = Column(Float(precision=53), nullable=True)
+    max_val = Column(Float(precision=53), nullable=True)
+    value = deferred(Column('value', LargeBinary(), nullable=False))
+
+    dataset = relationship('Dataset', backref=backref("chunks", order_by=chunk_start, cascade="all, delete-orphan"))
+
 
 
 #********************************************************
@@ -558,7 +616,7 @@ class ResourceAttr(Base, Inspect):
         elif ref_key == 'LINK':
             return self.link.network
         elif ref_key == 'GROUP':
-            return self.group.network
+            return self.resourcegroup.network
         elif ref_key == 'PROJECT':
             return None
 
@@ -803,6 +861,8 @@ class Network(Base, Inspect):
     cr_date = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
     projection = Column(String(1000))
     created_by = Column(Integer(), ForeignKey('tUser.user_id'))
+    #Incremented by each change to the network. See HydraServer.util.changelog
+    version = Column(Integer(), nullable=False, server_default=text(u'0'))
 
     project = relationship('Project', backref=backref("networks", order_by=network_id, cascade="all, delete-orphan"))
 
@@ -1028,6 +1088,8 @@ class Node(Base, Inspect):
     __tablename__='tNode'
     __table_args__ = (
         UniqueConstraint('network_id', 'node_name', name="unique node name"),
+        #For the extents of a network, and the nodes within an area of it.
+        Index('idx_node_network_xy', 'network_id', 'node_x', 'node_y'),
     )
     ref_key = 'NODE'
 
@@ -1262,6 +1324,60 @@ class Scenario(Base, Inspect):
             group_item_i.link     = resource
         self.resourcegroupitems.append(group_item_i)
 
+class NetworkChange(Base, Inspect):
+    """
+        An entry in the log of changes made to a network.
+        See HydraServer.util.changelog
+    """
+
+    __tablename__='tNetworkChange'
+
+    __table_args__ = (
+        Index('idx_network_change_version', 'network_id', 'version'),
+    )
+
+    change_id   = Column(Integer(), primary_key=True, nullable=False)
+    network_id  = Column(Integer(), ForeignKey('tNetwork.network_id'), nullable=False)
+    version     = Column(Integer(), nullable=False)
+    ref_key     = Column(String(60),  nullable=False)
+    ref_id      = Column(Integer(), nullable=False)
+    scenario_id = Column(Integer())
+    change_type = Column(String(60),  nullable=False)
+    cr_date = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
+
+class CacheVersion(Base, Inspect):
+    """
+        The version of something, other than a network, which affects what
+        the server caches, such as the templates as a whole. The version of
+        TRIGRAM_INDEX is instead 1 once every dataset is in tDatasetTrigram.
+        See HydraServer.util.changelog
+    """
+
+    __tablename__='tCacheVersion'
+
+    version_key = Column(String(60), primary_key=True, nullable=False)
+    version     = Column(Integer(), nullable=False, server_default=text(u'0'))
+
+class Job(Base, Inspect):
+    """
+        A long-running request, such as adding a large network, which is
+        run by the job workers rather than by the server thread which
+        received it. See HydraServer.lib.jobs
+    """
+
+    __tablename__='tJob'
+
+    job_id     = Column(Integer(), primary_key=True, nullable=False)
+    job_type   = Column(String(60),  nullable=False)
+    user_id    = Column(Integer(), ForeignKey('tUser.user_id'), nullable=False, index=True)
+    status     = Column(String(10),  nullable=False, server_default=text(u"'QUEUED'"))
+    progress   = Column(Integer(), nullable=False, server_default=text(u'0'))
+    message    = Column(Text(1000))
+    result     = Column(LargeBinary())
+    start_time = Column(TIMESTAMP())
+    end_time   = Column(TIMESTAMP())
+    cr_date = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
+
 class Rule(Base, Inspect):
     """
         A rule is an arbitrary piece of text applied to resources
@@ -1566,11 +1682,11 @@ def create_resourcedata_view():
             self.name = name
 
     @compiler.compiles(CreateView)
-    def compile(element, compiler, **kw):
+    def compile_create_view(element, compiler, **kw):
         return "CREATE VIEW %s AS %s" % (element.name, compiler.sql_compiler.process(element.selectable))
 
     @compiler.compiles(DropView)
-    def compile(element, compiler, **kw):
+    def compile_drop_view(element, compiler, **kw):
         return "DROP VIEW %s" % (element.name)
 
     def view(name, metadata, selectable):
@@ -0,0 +1,81 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Remove the old entries from the log of network changes in tNetworkChange,
+    which otherwise grows with every change made to every network.
+
+    For each network, the entries up to the latest version made before the
+    cutoff are removed, and replaced by a single NETWORK entry holding that
+    version. A client asking for the changes since an earlier version is told
+    to retrieve the whole network again. Each network is pruned in its own
+    transaction, so this can be run again if it is interrupted.
+
+    Usage: python -m HydraServer.db.prune_changes [--days 90]
+"""
+import logging
+import argparse
+import datetime
+
+from sqlalchemy import create_engine, select, func, and_
+
+from HydraLib import config
+from HydraServer.db.model import NetworkChange
+
+log = logging.getLogger(__name__)
+
+def prune_changes(engine, days):
+    """
+        Remove the entries made more than the given number of days ago.
+        Returns the number of entries removed.
+    """
+    change_tbl = NetworkChange.__table__
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+
+    with engine.begin() as conn:
+        pruned = conn.execute(select([change_tbl.c.network_id,
+                                      func.max(change_tbl.c.version)]).where(
+                                          change_tbl.c.cr_date < cutoff).group_by(
+                                          change_tbl.c.network_id)).fetchall()
+
+    num_deleted = 0
+    for network_id, version in pruned:
+        with engine.begin() as conn:
+            res = conn.execute(change_tbl.delete().where(
+                                and_(change_tbl.c.network_id==network_id,
+                                     change_tbl.c.version <= version)))
+            conn.execute(change_tbl.insert(), network_id=network_id,
+                                              version=version,
+                                              ref_key='NETWORK',
+                                              ref_id=network_id,
+                                              change_type='PRUNE')
+        #The marker replaces one of the entries.
+        num_deleted = num_deleted + res.rowcount - 1
+
+        log.info("Changes to network %s up to version %s removed", network_id, version)
+
+    return num_deleted
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove old entries from the network change log.')
+    parser.add_argument('--days', type=int, default=90,
+                        help='Remove the entries made more than this many days ago.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level='INFO')
+    engine = create_engine(config.get('mysqld', 'url'))
+    num_deleted = prune_changes(engine, args.days)
+    log.info("%s entries removed", num_deleted)
@@ -0,0 +1,119 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Recalculate the hash of every dataset in tDataset.
+
+    Data hashes used to be made with Python's built-in hash(), which gives
+    different results on different platforms, so data added since the
+    upgrade would not be recognised as identical to data added before it.
+    Hashes were then made from values as stored, which are compressed or
+    not depending on compression_threshold, rather than from the values
+    uncompressed. This replaces each stored hash with one from
+    generate_data_hash.
+
+    It can be run again if it is interrupted. A dataset whose new hash is
+    already used by another dataset is a duplicate of it. It is left with
+    its old hash, and reported.
+
+    Usage: python -m HydraServer.db.rehash_datasets
+"""
+import logging
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.sql.expression import bindparam
+
+from HydraLib import config
+from HydraServer.db.model import Dataset
+from HydraServer.util.hdb import get_dataset_metadata
+from HydraServer.util import generate_data_hash
+
+log = logging.getLogger(__name__)
+
+def rehash_datasets(engine, batch_size=500):
+    """
+        Recalculate the hashes of all datasets, batch_size at a time,
+        each batch in its own transaction.
+        Returns the number of hashes changed.
+    """
+    dataset_tbl = Dataset.__table__
+
+    update_stmt = dataset_tbl.update().where(
+                    dataset_tbl.c.dataset_id==bindparam('b_dataset_id')).values(
+                    data_hash=bindparam('b_data_hash'))
+
+    num_changed    = 0
+    num_duplicates = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select([dataset_tbl.c.dataset_id,
+                                        dataset_tbl.c.data_name,
+                                        dataset_tbl.c.data_units,
+                                        dataset_tbl.c.data_dimen,
+                                        dataset_tbl.c.data_type,
+                                        dataset_tbl.c.data_hash,
+                                        dataset_tbl.c.value]).where(
+                                            dataset_tbl.c.dataset_id > last_id).order_by(
+                                            dataset_tbl.c.dataset_id).limit(batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            last_id = rows[-1].dataset_id
+
+            metadata = get_dataset_metadata(conn, [r.dataset_id for r in rows])
+
+            new_hashes = {}
+            for r in rows:
+                new_hash = generate_data_hash(dict(data_name  = r.data_name,
+                                                   data_units = r.data_units,
+                                                   data_dimen = r.data_dimen,
+                                                   data_type  = r.data_type,
+                                                   value      = r.value,
+                                                   metadata   = metadata.get(r.dataset_id, {})))
+                if new_hash != r.data_hash:
+                    new_hashes[r.dataset_id] = new_hash
+
+            if len(new_hashes) == 0:
+                continue
+
+            #The datasets already using any of the new hashes.
+            hash_owners = dict(conn.execute(select([dataset_tbl.c.data_hash,
+                                                    dataset_tbl.c.dataset_id]).where(
+                                dataset_tbl.c.data_hash.in_(new_hashes.values()))).fetchall())
+
+            updates = []
+            for dataset_id, new_hash in sorted(new_hashes.items()):
+                if hash_owners.get(new_hash, dataset_id) != dataset_id:
+                    log.warn("Dataset %s is a duplicate of dataset %s. Its hash is not changed.",
+                             dataset_id, hash_owners[new_hash])
+                    num_duplicates = num_duplicates + 1
+                    continue
+                hash_owners[new_hash] = dataset_id
+                updates.append({'b_dataset_id':dataset_id, 'b_data_hash':new_hash})
+
+            if len(updates) > 0:
+                conn.execute(update_stmt, updates)
+                num_changed = num_changed + len(updates)
+
+        log.info("%s hashes changed, %s duplicates found, up to dataset %s",
+                 num_changed, num_duplicates, last_id)
+
+    return num_changed
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO')
+    engine = create_engine(config.get('mysqld', 'url'))
+    rehash_datasets(engine)
@@ -31,6 +31,7 @@ from HydraServer.db.model import Attr,\
         ResourceScenario,\
         Dataset
 from HydraServer.db import DBSession
+from HydraServer.util.changelog import record_changes, bump_template_version
 from sqlalchemy.orm.exc import NoResultFound
 from HydraLib.HydraException import HydraError, ResourceNotFoundError
 from sqlalchemy import or_, and_
@@ -149,6 +150,10 @@ def update_attribute(attr,**kwargs):
     attr_i.attr_dimen = attr.dimension
     attr_i.attr_description = attr.description
 
+    #Attribute names are shown on the resources of every network which
+    #uses them, in the same way as template types.
+    bump_template_version()
+
     #Make sure an update hasn't caused an inconsistency.
     check_attr_dimension(attr_i.attr_id)
 
@@ -230,6 +235,14 @@ def _get_templatetype(type_id):
     except NoResultFound:
         raise ResourceNotFoundError("Template Type with ID %s not found"%(type_id,))
 
+def _get_network_id(resource_attr):
+    """
+        Get the ID of the network containing a resource attribute.
+        Project attributes are not in a network, so this is None for them.
+    """
+    network = resource_attr.get_network()
+    return network.network_id if network is not None else None
+
 def update_resource_attribute(resource_attr_id, is_var, unit, data_type, description, properties, **kwargs):
     """
         Deletes a resource attribute and all associated data.
@@ -241,6 +254,7 @@ def update_resource_attribute(resource_attr_id, is_var, unit, data_type, descrip
         raise ResourceNotFoundError("Resource Attribute %s not found"%(resource_attr_id))
 
     ra.check_write_permission(user_id)
+    record_changes(_get_network_id(ra), 'RESOURCEATTR', resource_attr_id)
 
     ra.attr_is_var = is_var
     ra.unit = unit
@@ -263,6 +277,7 @@ def delete_resource_attribute(resource_attr_id, **kwargs):
         raise ResourceNotFoundError("Resource Attribute %s not found"%(resource_attr_id))
 
     ra.check_write_permission(user_id)
+    record_changes(_get_network_id(ra), 'RESOURCEATTR', resource_attr_id, 'DELETE')
     DBSession.delete(ra)
     DBSession.flush()
     return 'OK'
@@ -293,6 +308,9 @@ def add_resource_attribute(resource_type, resource_id, attr_id, is_var,**kwargs)
     new_ra = resource_i.add_attribute(attr_id, attr_is_var)
     DBSession.flush()
 
+    record_changes(getattr(resource_i, 'network_id', None), 'RESOURCEATTR',
+                   new_ra.resource_attr_id, 'INSERT')
+
     return new_ra
 
 def add_resource_attrs_from_type(type_id, resource_type, resource_id,**kwargs):
@@ -315,6 +333,9 @@ def add_resource_attrs_from_type(type_id, resource_type, resource_id,**kwargs):
 
     DBSession.flush()
 
+    record_changes(getattr(resource_i, 'network_id', None), 'RESOURCEATTR',
+                   [new_ra.resource_attr_id for new_ra in new_resource_attrs], 'INSERT')
+
     return new_resource_attrs
 
 def get_all_resource_attributes(ref_key, network_id, template_id=None, **kwargs):
@@ -18,20 +18,28 @@ import sys
 from HydraLib.hydra_dateutil import get_datetime
 import logging
 from HydraServer.db.model import Dataset, Metadata, DatasetOwner, DatasetCollection,\
-        DatasetCollectionItem, ResourceScenario, ResourceAttr, TypeAttr
-from HydraServer.util import generate_data_hash
+        DatasetCollectionItem, ResourceScenario, ResourceAttr, TypeAttr, DatasetTrigram, DatasetChunk
+from HydraServer.util import generate_data_hash, value_cache, get_val,\
+        get_vals_at_times, get_seasonal_times, get_trigrams, get_dataset_trigrams
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import aliased, make_transient, joinedload_all
+from sqlalchemy.orm import aliased, make_transient, joinedload_all, undefer
 from sqlalchemy.sql.expression import case
 from sqlalchemy import func
 from sqlalchemy import null
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from HydraServer.db import DBSession
+from HydraServer import db
+from HydraServer.db import collect_datasets as collect
+from HydraServer.util.permissions import check_perm
+from HydraServer.util.changelog import bump_data_version, get_version
+from HydraServer.util.dataformat import parse_value, split_timeseries, decode_timeseries
 from HydraLib import config
 
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 from HydraLib.HydraException import HydraError, PermissionError, ResourceNotFoundError
 from sqlalchemy import and_, or_
-from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql.expression import literal_column
 from sqlalchemy import distinct
 
@@ -41,8 +49,12 @@ from decimal import Decimal
 import copy
 
 import json
+import re
+import threading
+from multiprocessing import Pool
 
 import units as hydra_units
+import objects
 
 global FORMAT
 FORMAT = "%Y-%m-%d %H:%M:%S.%f"
@@ -55,6 +67,13 @@ NS = "soap_server.hydra_complexmodels"
 
 log = logging.getLogger(__name__)
 
+#Processes which parse, encode and hash the datasets in large uploads.
+#Started with the server, by init_ingest_pool.
+_ingest_pool_size = int(config.get('hydra_server', 'ingest_processes', 0))
+_ingest_batch_size = int(config.get('hydra_server', 'ingest_batch_size', 1000))
+_ingest_pool = None
+_ingest_pool_lock = threading.Lock()
+
 def get_dataset(dataset_id,**kwargs):
     """
         Get a single dataset, by ID
@@ -73,6 +92,7 @@ def get_dataset(dataset_id,**kwargs):
                 Dataset.hidden,
                 Dataset.cr_date,
                 Dataset.created_by,
+                Dataset.data_hash,
                 DatasetOwner.user_id,
                 null().label('metadata'),
                 case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
@@ -116,7 +136,8 @@ def clone_dataset(dataset_id,**kwargs):
         return None
 
     dataset = DBSession.query(Dataset).filter(
-            Dataset.dataset_id==dataset_id).options(joinedload_all('metadata')).first()
+            Dataset.dataset_id==dataset_id).options(joinedload_all('metadata')).options(
+            undefer('value')).first()
 
     if dataset is None:
         raise HydraError("Dataset %s does not exist."%(dataset_id))
@@ -151,6 +172,8 @@ def clone_dataset(dataset_id,**kwargs):
     dataset.metadata.append(cloned_meta)
 
     dataset.set_hash()
+    dataset.set_trigrams()
+    dataset.set_chunks()
     DBSession.add(dataset)
     DBSession.flush()
 
@@ -177,6 +200,7 @@ def get_datasets(dataset_ids,**kwargs):
                 Dataset.hidden,
                 Dataset.cr_date,
                 Dataset.created_by,
+                Dataset.data_hash,
                 DatasetOwner.user_id,
                 null().label('metadata'),
                 case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
@@ -228,12 +252,18 @@ def search_datasets(dataset_id=None,
                 inc_val = 'N',
                 page_start = 0,
                 page_size   = 2000,
+                last_dataset_id = None,
                 **kwargs):
     """
         Get multiple datasets, based on several
         filters. If all filters are set to None, all
         datasets in the DB (that the user is allowe to see)
         will be returned.
+
+        Datasets are returned in order of ID. To get the next page of a
+        large search, pass the ID of the last dataset of the previous page
+        as last_dataset_id, which, unlike page_start, costs no more the
+        further through the results it is.
     """
 
 
@@ -252,7 +282,8 @@ def search_datasets(dataset_id=None,
                                   "inc_metadata: %s,\n"
                                   "inc_val: %s,\n"
                                   "page_start: %s,\n"
-                                  "page_size: %s" % (dataset_id,
+                                  "page_size: %s,\n"
+                                  "last_dataset_id: %s" % (dataset_id,
                 dataset_name,
                 collection_name,
                 data_type,
@@ -267,13 +298,20 @@ def search_datasets(dataset_id=None,
                 inc_metadata,
                 inc_val,
                 page_start,
-                page_size))
+                page_size,
+                last_dataset_id))
 
     if page_size is None:
-        page_size = config.get('SEARCH', 'page_size', 2000)
+        page_size = int(config.get('SEARCH', 'page_size', 2000))
 
     user_id = int(kwargs.get('user_id'))
 
+    #Only read the value, which may be large, if it has been asked for.
+    if inc_val == 'Y':
+        value_col = Dataset.value
+    else:
+        value_col = null().label('value')
+
     dataset_qry = DBSession.query(Dataset.dataset_id,
             Dataset.data_type,
             Dataset.data_units,
@@ -286,7 +324,7 @@ def search_datasets(dataset_id=None,
             null().label('metadata'),
             Dataset.start_time,
             Dataset.frequency,
-            Dataset.value
+            value_col
     )
 
     #Dataset ID is unique, so there's no point using the other filters.
@@ -297,6 +335,7 @@ def search_datasets(dataset_id=None,
 
     else:
         if dataset_name is not None:
+            dataset_qry = _filter_by_trigrams(dataset_qry, 'name', dataset_name)
             dataset_qry = dataset_qry.filter(
                 func.lower(Dataset.data_name).like("%%%s%%"%dataset_name.lower())
             )
@@ -370,6 +409,11 @@ def search_datasets(dataset_id=None,
                                 literal_column("0").label('col')).subquery()
             dataset_qry = dataset_qry.join(
                 stmt, stmt.c.dataset_id == Dataset.dataset_id)
+        if metadata_name is not None:
+            dataset_qry = _filter_by_trigrams(dataset_qry, 'metadata_name', metadata_name)
+        if metadata_val is not None:
+            dataset_qry = _filter_by_trigrams(dataset_qry, 'metadata_val', metadata_val)
+
         if metadata_name is not None and metadata_val is not None:
             dataset_qry = dataset_qry.join(Metadata,
                                 and_(Metadata.dataset_id == Dataset.dataset_id,
@@ -392,41 +436,35 @@ def search_datasets(dataset_id=None,
 
     dataset_qry = dataset_qry.filter(or_(Dataset.hidden=='N', and_(DatasetOwner.user_id is not None, Dataset.hidden=='Y')))
 
-    log.info(str(dataset_qry))
+    if last_dataset_id is not None:
+        dataset_qry = dataset_qry.filter(Dataset.dataset_id > last_dataset_id)
 
-    datasets = dataset_qry.all()
+    dataset_qry = dataset_qry.order_by(Dataset.dataset_id)
 
-    log.info("Retrieved %s datasets", len(datasets))
+    if page_start:
+        dataset_qry = dataset_qry.offset(page_start)
+    dataset_qry = dataset_qry.limit(page_size)
 
-    #page the datasets:
-    if page_start + page_size > len(datasets):
-        page_end = None
-    else:
-        page_end = page_start + page_size
+    log.info(str(dataset_qry))
+
+    datasets = dataset_qry.all()
 
-    datasets = datasets[page_start:page_end]
+    log.info("Retrieved %s datasets from result %s", len(datasets), page_start)
 
-    log.info("Datasets paged from result %s to %s", page_start, page_end)
+    metadata = {}
+    if inc_metadata == 'Y':
+        metadata = _get_metadata_by_dataset([d.dataset_id for d in datasets])
 
     datasets_to_return = []
     for dataset_row in datasets:
 
         dataset_dict = dataset_row._asdict()
 
-        
-
-        if inc_val == 'N':
-            dataset_dict['value'] = None
-        else:
-            #convert the value row into a string as it is returned as a binary
-            if dataset_row.value is not None:
-                dataset_dict['value'] = str(dataset_row.value)
+        #convert the value row into a string as it is returned as a binary
+        if dataset_row.value is not None:
+            dataset_dict['value'] = str(dataset_row.value)
 
-        if inc_metadata=='Y':
-            metadata = DBSession.query(Metadata).filter(Metadata.dataset_id==dataset_row.dataset_id).all()
-            dataset_dict['metadata'] = metadata
-        else:
-            dataset_dict['metadata'] = []
+        dataset_dict['metadata'] = metadata.get(dataset_row.dataset_id, [])
 
         dataset = namedtuple('Dataset', dataset_dict.keys())(**dataset_dict)
 
@@ -434,6 +472,61 @@ def search_datasets(dataset_id=None,
 
     return datasets_to_return
 
+#Set once the search index is known to hold every dataset, as it then always will.
+_trigram_index_populated = False
+
+def _is_trigram_index_populated():
+    """
+        Check whether every dataset is in the search index, tDatasetTrigram.
+        Datasets added before the index existed are only in it once
+        HydraServer.db.index_datasets has been run, which marks it populated.
+    """
+    global _trigram_index_populated
+    if not _trigram_index_populated:
+        _trigram_index_populated = get_version('TRIGRAM_INDEX') > 0
+    return _trigram_index_populated
+
+def _filter_by_trigrams(dataset_qry, field, text):
+    """
+        Restrict a dataset query to those datasets where the given field
+        (name, metadata_name or metadata_val) contains every trigram of the
+        text. This uses the index on tDatasetTrigram. The caller must still
+        apply the exact match, as the trigrams can be in a different order.
+        Text with fewer than three characters has no trigrams, so the
+        query is unchanged, as it is until the index is populated.
+    """
+    trigrams = set()
+    #Don't use trigrams which span a 'like' wildcard.
+    for part in re.split('[%_]', text):
+        trigrams.update(get_trigrams(part))
+
+    if len(trigrams) == 0 or not _is_trigram_index_populated():
+        return dataset_qry
+
+    matching = DBSession.query(DatasetTrigram.dataset_id).filter(
+                                DatasetTrigram.field==field,
+                                DatasetTrigram.trigram.in_(trigrams)).group_by(
+                                DatasetTrigram.dataset_id).having(
+                                func.count(DatasetTrigram.trigram)==len(trigrams)).subquery()
+
+    return dataset_qry.join(matching, matching.c.dataset_id == Dataset.dataset_id)
+
+def _get_metadata_by_dataset(dataset_ids):
+    """
+        Get the metadata of a list of datasets, in chunks of 999 for sqlite,
+        as a dictionary of metadata lists keyed on dataset ID.
+    """
+    dataset_ids = list(set(dataset_ids))
+
+    metadata = {}
+    for idx in range(0, len(dataset_ids), qry_in_threshold):
+        chunk = dataset_ids[idx:idx+qry_in_threshold]
+        rs = DBSession.query(Metadata).filter(Metadata.dataset_id.in_(chunk)).all()
+        for m in rs:
+            metadata.setdefault(m.dataset_id, []).append(m)
+
+    return metadata
+
 def update_dataset(dataset_id, name, data_type, val, units, dimension, metadata={}, **kwargs):
     """
         Update an existing dataset
@@ -445,6 +538,9 @@ def update_dataset(dataset_id, name, data_type, val, units, dimension, metadata=
     user_id = kwargs.get('user_id')
 
     dataset = DBSession.query(Dataset).filter(Dataset.dataset_id==dataset_id).one()
+
+    #The dataset may be used by any number of networks.
+    bump_data_version()
     #This dataset been seen before, so it may be attached
     #to other scenarios, which may be locked. If they are locked, we must
     #not change their data, so new data must be created for the unlocked scenarios
@@ -470,6 +566,9 @@ def update_dataset(dataset_id, name, data_type, val, units, dimension, metadata=
             unlocked_rs.dataset = dataset
 
     else:
+        #The index and chunks are only rebuilt if what they are built from changes.
+        old_value = (dataset.data_type, dataset.value)
+        old_indexed = (dataset.data_name, dataset.get_metadata_as_dict())
 
         dataset.set_val(data_type, val)
 
@@ -490,6 +589,11 @@ def update_dataset(dataset_id, name, data_type, val, units, dimension, metadata=
                      existing_dataset.dataset_id, dataset.dataset_id, existing_dataset.dataset_id)
             DBSession.delete(dataset)
             dataset = existing_dataset
+        else:
+            if (dataset.data_name, dataset.get_metadata_as_dict()) != old_indexed:
+                dataset.set_trigrams()
+            if (dataset.data_type, dataset.value) != old_value:
+                dataset.set_chunks()
 
     return dataset
 
@@ -526,8 +630,12 @@ def add_dataset(data_type, val, units, dimension, metadata={}, name="", user_id=
         else:
             d.set_metadata({'created_at': datetime.datetime.now()})
             d.set_hash()
+            d.set_trigrams()
+            d.set_chunks()
             DBSession.add(d)
     except NoResultFound:
+        d.set_trigrams()
+        d.set_chunks()
         DBSession.add(d)
 
     if flush == True:
@@ -578,7 +686,6 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
     metadata         = {}
     #This is what gets returned.
     for d in bulk_data:
-        log.info(d.data_hash)
         dataset_dict = new_data[d.data_hash]
         current_hash = d.data_hash
 
@@ -609,38 +716,43 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
     new_data_for_insert = []
     #keep track of the datasets that are to be inserted to avoid duplicate
     #inserts
-    new_data_hashes = []
+    new_data_hashes = set()
     for d in new_datasets:
         if d['data_hash'] not in new_data_hashes:
             new_data_for_insert.append(d)
-            new_data_hashes.append(d['data_hash'])
+            new_data_hashes.add(d['data_hash'])
 
     if len(new_data_for_insert) > 0:
-    	#If we're working with mysql, we have to lock the table..
-    	#For sqlite, this is not possible. Hence the try: except
-        try:
-            DBSession.execute("LOCK TABLES tDataset WRITE, tMetadata WRITE")
-        except OperationalError:
-            pass
-
-        log.debug("Inserting new data", get_timing(start_time))
-        DBSession.execute(Dataset.__table__.insert(), new_data_for_insert)
-        log.debug("New data Inserted", get_timing(start_time))
-
-        try:
-            DBSession.execute("UNLOCK TABLES")
-        except OperationalError:
-            pass
-
-
-        new_data = _get_existing_data(new_data_hashes)
-        log.debug("New data retrieved", get_timing(start_time))
+        #Another request may add some of the same data while this one runs.
+        #Rather than lock the tables, rows whose hash is already there are
+        #skipped, and the IDs of all the hashes then read back. The hashes
+        #are unique, so the datasets are inserted directly, keyed on them,
+        #rather than through a staging table.
+        log.debug("Inserting new data %s", get_timing(start_time))
+        _insert_ignoring_duplicates(Dataset.__table__, new_data_for_insert)
+        log.debug("New data Inserted %s", get_timing(start_time))
+
+        #A skipped row may have been added by a transaction which committed
+        #after this one started, so is only seen by a locking read.
+        new_data = _get_existing_data(new_data_hashes, lock=True)
+        log.debug("New data retrieved %s", get_timing(start_time))
+
+        missing_hashes = new_data_hashes - set(new_data.keys())
+        if len(missing_hashes) > 0:
+            raise HydraError("Unable to add %s datasets. Their hashes were not "
+                             "found after they were inserted."%len(missing_hashes))
 
         for k, v in new_data.items():
             hash_id_map[k] = v
 
         _insert_metadata(metadata, hash_id_map)
-        log.debug("Metadata inserted", get_timing(start_time))
+        log.debug("Metadata inserted %s", get_timing(start_time))
+
+        _insert_trigrams(new_data_for_insert, metadata, hash_id_map)
+        log.debug("Search index updated %s", get_timing(start_time))
+
+        _insert_chunks(new_data_for_insert, hash_id_map)
+        log.debug("Large timeseries split %s", get_timing(start_time))
 
     returned_ids = []
     for d in bulk_data:
@@ -650,6 +762,26 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
 
     return returned_ids
 
+def _insert_ignoring_duplicates(table, rows):
+    """
+        Insert rows into a table, skipping any which would duplicate an
+        existing primary or unique key, such as the hash of a dataset
+        added by another request since this one looked for it.
+    """
+    dialect = DBSession.bind.dialect.name
+    if dialect == 'mysql':
+        #INSERT IGNORE would also turn every other error, such as a value
+        #too long for its column, into a warning. Setting a key column to
+        #its own value leaves a duplicate unchanged, and ignores only that.
+        key_col = list(table.primary_key.columns)[0]
+        insert_stmt = mysql_insert(table).on_duplicate_key_update(**{key_col.name: key_col})
+    elif dialect == 'sqlite':
+        insert_stmt = table.insert().prefix_with('OR IGNORE')
+    else:
+        insert_stmt = table.insert()
+
+    DBSession.execute(insert_stmt, rows)
+
 def _insert_metadata(metadata_hash_dict, dataset_id_hash_dict):
     if metadata_hash_dict is None or len(metadata_hash_dict) == 0:
         return
@@ -663,46 +795,109 @@ def _insert_metadata(metadata_hash_dict, dataset_id_hash_dict):
             metadata['dataset_id']      = dataset_id_hash_dict[_hash].dataset_id
             metadata_list.append(metadata)
 
-    DBSession.execute(Metadata.__table__.insert(), metadata_list)
+    _insert_ignoring_duplicates(Metadata.__table__, metadata_list)
 
-def _process_incoming_data(data, user_id=None, source=None):
+def _insert_trigrams(new_datasets, metadata_hash_dict, dataset_id_hash_dict):
+    """
+        Add newly inserted datasets to the search index, tDatasetTrigram.
+    """
+    trigram_list = []
+    for d in new_datasets:
+        dataset_id = dataset_id_hash_dict[d['data_hash']].dataset_id
+        metadata = metadata_hash_dict.get(d['data_hash'], {})
+        for field, trigram in get_dataset_trigrams(d['data_name'], metadata):
+            trigram_list.append(dict(dataset_id = dataset_id,
+                                     field      = field,
+                                     trigram    = trigram))
 
-    datasets = {}
+    if len(trigram_list) > 0:
+        _insert_ignoring_duplicates(DatasetTrigram.__table__, trigram_list)
 
-    for d in data:
-        val = d.parse_value()
+def _insert_chunks(new_datasets, dataset_id_hash_dict):
+    """
+        Split the large timeseries among newly inserted datasets into chunks,
+        in tDatasetChunk.
+    """
+    chunk_list = []
+    for d in new_datasets:
+        if d['data_type'] != 'timeseries':
+            continue
+        dataset_id = dataset_id_hash_dict[d['data_hash']].dataset_id
+        for chunk in split_timeseries(d['value']):
+            chunk['dataset_id'] = dataset_id
+            chunk_list.append(chunk)
+
+    if len(chunk_list) > 0:
+        _insert_ignoring_duplicates(DatasetChunk.__table__, chunk_list)
+
+def init_ingest_pool():
+    """
+        Start the ingest processes, if ingest_processes is set and they have
+        not been started already. Like the job workers, they are best started
+        before the server starts its threads, so they are not forked from a
+        process in which other threads are running.
+    """
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None and _ingest_pool_size > 1:
+            log.info("Starting %s ingest processes", _ingest_pool_size)
+            _ingest_pool = Pool(_ingest_pool_size)
+    return _ingest_pool
+
+def _get_ingest_pool():
+    #Never started here, as this can be running in a request thread,
+    #or in a job worker, which can't have processes of its own. Without
+    #the pool, uploads are processed in the current process.
+    with _ingest_pool_lock:
+        return _ingest_pool
+
+def _parse_value(data_type, value, metadata):
+    return parse_value(data_type, value)
+
+def _process_payloads(payloads, user_id=None, source=None):
+    """
+        Parse, encode and hash the values of incoming datasets, given as
+        plain dictionaries, and find their dimensions. Returns a row, ready
+        for insert into tDataset, for each one, or None if it has no value.
+    """
+    rows = []
+    for d in payloads:
+        if d['metadata'] is not None:
+            if isinstance(d['metadata'], str) or isinstance(d['metadata'], unicode):
+                metadata_dict = json.loads(d['metadata'])
+            else:
+                metadata_dict=d['metadata']
+        else:
+            metadata_dict={}
+
+        try:
+            val = d['parser'](d['type'], d['value'], metadata_dict)
+        except Exception as e:
+            log.exception(e)
+            raise HydraError("Error parsing value %s: %s" % (d['value'], e))
 
         if val is None:
-            log.info("Cannot parse data (dataset_id=%s). "
-                         "Value not available.",d)
+            rows.append(None)
             continue
 
         data_dict = {
-            'data_type':d.type,
-             'data_name':d.name,
-            'data_units': d.unit,
+            'data_type':d['type'],
+             'data_name':d['name'],
+            'data_units': d['unit'],
             'created_by' : user_id,
             'frequency' : None,
             'start_time': None,
         }
 
         # Assign dimension if necessary
-        if d.unit is not None and d.dimension in (None, 'dimensionless'):
-            data_dict['data_dimen'] = hydra_units.get_unit_dimension(d.unit)
+        if d['unit'] is not None and d['dimension'] in (None, 'dimensionless'):
+            data_dict['data_dimen'] = hydra_units.get_unit_dimension(d['unit'])
         else:
-            data_dict['data_dimen'] = d.dimension
+            data_dict['data_dimen'] = d['dimension']
 
-        db_val = _get_db_val(d.type, val)
+        db_val = _get_db_val(d['type'], val)
         data_dict['value'] = db_val
 
-        if d.metadata is not None:
-            if isinstance(d.metadata, str) or isinstance(d.metadata, unicode):
-                metadata_dict = json.loads(d.metadata)
-            else:
-                metadata_dict=d.metadata
-        else:
-            metadata_dict={}
-
         metadata_keys = [k.lower() for k in metadata_dict]
         if user_id is not None and 'user_id' not in metadata_keys:
             metadata_dict[u'user_id'] = unicode(user_id)
@@ -711,9 +906,72 @@ def _process_incoming_data(data, user_id=None, source=None):
 
         data_dict['metadata'] = metadata_dict
 
-        d.data_hash = generate_data_hash(data_dict)
+        data_dict['data_hash'] = generate_data_hash(data_dict)
+
+        rows.append(data_dict)
+
+    return rows
+
+def _process_payload_batch(args):
+    """
+        Run _process_payloads in an ingest process. Errors are returned as
+        text, as not every exception can be sent back to the server process.
+    """
+    try:
+        return _process_payloads(*args), None
+    except Exception as e:
+        return None, str(e)
+
+def _process_incoming_data(data, user_id=None, source=None):
+    """
+        Turn incoming datasets into rows for tDataset, keyed on hash.
+        Large uploads are split into batches, which are processed
+        in parallel if ingest_processes is set.
+    """
+    payloads = []
+    for d in data:
+        metadata = d.metadata
+        if metadata is not None and not isinstance(metadata, (str, unicode)):
+            metadata = dict(metadata)
+
+        #Datasets from JSON clients are parsed slightly differently.
+        #The parser is passed by name, so it can be sent to another process.
+        if isinstance(d, objects.Dataset):
+            parser = objects.parse_dataset_value
+        else:
+            parser = _parse_value
+
+        payloads.append(dict(type      = d.type,
+                             name      = d.name,
+                             unit      = d.unit,
+                             dimension = d.dimension,
+                             value     = d.value,
+                             metadata  = metadata,
+                             parser    = parser))
+
+    pool = _get_ingest_pool()
+    if pool is None or len(payloads) <= _ingest_batch_size:
+        rows = _process_payloads(payloads, user_id, source)
+    else:
+        batches = []
+        for idx in range(0, len(payloads), _ingest_batch_size):
+            batches.append((payloads[idx:idx+_ingest_batch_size], user_id, source))
+
+        rows = []
+        for batch_rows, error in pool.map(_process_payload_batch, batches):
+            if error is not None:
+                raise HydraError(error)
+            rows.extend(batch_rows)
+
+    datasets = {}
+
+    for d, data_dict in zip(data, rows):
+        if data_dict is None:
+            log.info("Cannot parse data (dataset_id=%s). "
+                         "Value not available.",d)
+            continue
 
-        data_dict['data_hash'] = d.data_hash
+        d.data_hash = data_dict['data_hash']
         datasets[d.data_hash] = data_dict
 
     return datasets
@@ -756,32 +1014,32 @@ def _get_metadata(dataset_ids):
 
     return metadata
 
-def _get_existing_data(hashes):
-
-    str_hashes = [str(h) for h in hashes]
+def _get_existing_data(hashes, lock=False):
+    """
+        Get the datasets with the given hashes, as a dictionary keyed on hash.
+        The hashes are the same in every process, so a match means the
+        data is identical. The values are not read, as they are not needed
+        to decide whether a dataset can be reused.
+
+        With lock, the datasets are read with a shared lock, so that those
+        committed by other transactions since this one started are found,
+        and cannot be deleted until this one ends.
+    """
+    #The hashes must be compared as integers. Compared with strings,
+    #MySQL converts both sides to floating point, which cannot tell
+    #large hashes apart and cannot use the index on data_hash.
+    hashes = [long(h) for h in set(hashes)]
 
     hash_dict = {}
 
-    datasets = []
-    if len(str_hashes) > qry_in_threshold:
-        idx = 0
-        extent =qry_in_threshold
-        while idx < len(str_hashes):
-            log.info("Querying %s datasets", len(str_hashes[idx:extent]))
-            rs = DBSession.query(Dataset).filter(Dataset.data_hash.in_(str_hashes[idx:extent])).all()
-            datasets.extend(rs)
-            idx = idx + qry_in_threshold
-
-            if idx + qry_in_threshold > len(str_hashes):
-                extent = len(str_hashes)
-            else:
-                extent = extent + qry_in_threshold
-    else:
-        datasets = DBSession.query(Dataset).filter(Dataset.data_hash.in_(str_hashes))
-
-
-    for r in datasets:
-        hash_dict[r.data_hash] = r
+    for idx in range(0, len(hashes), qry_in_threshold):
+        chunk = hashes[idx:idx+qry_in_threshold]
+        log.debug("Querying %s datasets", len(chunk))
+        qry = DBSession.query(Dataset).filter(Dataset.data_hash.in_(chunk))
+        if lock:
+            qry = qry.with_for_update(read=True)
+        for r in qry.all():
+            hash_dict[r.data_hash] = r
 
     log.info("Retrieved %s datasets", len(hash_dict))
 
@@ -973,9 +1231,128 @@ def get_collection_datasets(collection_id,**kwargs):
     """
     collection_datasets = DBSession.query(Dataset).filter(Dataset.dataset_id==DatasetCollectionItem.dataset_id,
                                         DatasetCollectionItem.collection_id==DatasetCollection.collection_id,
-                                        DatasetCollection.collection_id==collection_id).all()
+                                        DatasetCollection.collection_id==collection_id).options(
+                                        undefer('value')).all()
     return collection_datasets
 
+def get_value_cache_stats(**kwargs):
+    """
+        Get the number of entries, size and hit rate of the cache of
+        decoded timeseries.
+    """
+    return value_cache.get_stats()
+
+def _get_dataset_values(dataset_ids):
+    """
+        Get each dataset in a list of dataset IDs, with its value, unless it
+        is a timeseries which is already decoded in value_cache, in which
+        case the value is left deferred, as it is not needed.
+        This must be done in chunks of 999, as sqlite can only handle 'in' with
+        < 1000 elements.
+    """
+    qry = DBSession.query(Dataset)
+
+    datasets = []
+    for idx in range(0, len(dataset_ids), qry_in_threshold):
+        chunk = dataset_ids[idx:idx+qry_in_threshold]
+        datasets.extend(qry.filter(Dataset.dataset_id.in_(chunk)).all())
+
+    #Loading the datasets again with the value undeferred fills in
+    #the value of those already loaded.
+    uncached_ids = [d.dataset_id for d in datasets
+                    if d.data_type != 'timeseries' or (d.dataset_id, d.data_hash) not in value_cache]
+    for idx in range(0, len(uncached_ids), qry_in_threshold):
+        chunk = uncached_ids[idx:idx+qry_in_threshold]
+        qry.options(undefer('value')).filter(Dataset.dataset_id.in_(chunk)).all()
+
+    log.info("Retrieved %s datasets, %s with values", len(datasets), len(uncached_ids))
+
+    return datasets
+
+def _get_timeseries_range(dataset_id, times):
+    """
+        Get the part of a timeseries which has been split into chunks that is
+        needed to look up an array of times: the chunks covering the times,
+        starting with the one holding the value at the first of them.
+        Returns None if the timeseries has not been split.
+    """
+    chunks = DBSession.query(DatasetChunk.chunk_start,
+                             DatasetChunk.first_time).filter(
+                                DatasetChunk.dataset_id==dataset_id).order_by(
+                                DatasetChunk.chunk_start).all()
+    if len(chunks) == 0:
+        return None
+
+    first_times = np.array([c.first_time for c in chunks], dtype='int64')
+    ns_times = times.astype('datetime64[ns]').astype('int64')
+    first = max(first_times.searchsorted(ns_times.min(), side='right') - 1, 0)
+    last  = max(first_times.searchsorted(ns_times.max(), side='right') - 1, first)
+
+    values = DBSession.query(DatasetChunk.value).filter(
+                                DatasetChunk.dataset_id==dataset_id,
+                                DatasetChunk.chunk_start >= chunks[first].chunk_start,
+                                DatasetChunk.chunk_start <= chunks[last].chunk_start).order_by(
+                                DatasetChunk.chunk_start).all()
+
+    log.debug("Read %s of %s chunks of dataset %s", len(values), len(chunks), dataset_id)
+
+    return pd.concat([decode_timeseries(v.value) for v in values])
+
+def get_dataset_chunks(dataset_id, **kwargs):
+    """
+        Get the windows of time into which a timeseries has been split,
+        with the number of rows and the range of values in each, but not
+        the values themselves. There are none if it has not been split.
+    """
+    user_id = int(kwargs.get('user_id'))
+
+    try:
+        dataset_i = DBSession.query(Dataset).filter(Dataset.dataset_id==dataset_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Dataset %s not found"%(dataset_id,))
+
+    if dataset_id in _get_unreadable_dataset_ids([dataset_i], user_id):
+        raise PermissionError("Dataset %s is hidden from user %s"%(dataset_id, user_id))
+
+    chunks = DBSession.query(DatasetChunk.chunk_start,
+                             DatasetChunk.first_time,
+                             DatasetChunk.last_time,
+                             DatasetChunk.num_rows,
+                             DatasetChunk.min_val,
+                             DatasetChunk.max_val).filter(
+                                DatasetChunk.dataset_id==dataset_id).order_by(
+                                DatasetChunk.chunk_start).all()
+
+    return [dict(start_time = pd.Timestamp(c.chunk_start).isoformat(),
+                 first_time = pd.Timestamp(c.first_time).isoformat(),
+                 last_time  = pd.Timestamp(c.last_time).isoformat(),
+                 num_rows   = c.num_rows,
+                 min_val    = c.min_val,
+                 max_val    = c.max_val) for c in chunks]
+
+def _get_timeseries_vals(dataset, times, seasonal_times, use_chunks=False):
+    """
+        Look up an array of times in a timeseries dataset.
+        See HydraServer.util.get_vals_at_times
+        With use_chunks, a timeseries which has been split into chunks is
+        read only from the chunks covering the times.
+    """
+    try:
+        timeseries = None
+        if use_chunks:
+            timeseries = _get_timeseries_range(dataset.dataset_id, times)
+        if timeseries is None:
+            timeseries = get_val(dataset)
+        if timeseries is None:
+            #The value is hidden from the user.
+            return None
+        return get_vals_at_times(timeseries, times, seasonal_times)
+    except Exception as e:
+        log.critical("Unable to retrive data from dataset %s. Check timestamps.",
+                     dataset.dataset_id)
+        log.critical(e)
+        return None
+
 def get_val_at_time(dataset_id, timestamps,**kwargs):
     """
     Given a timestamp (or list of timestamps) and some timeseries data,
@@ -987,11 +1364,17 @@ def get_val_at_time(dataset_id, timestamps,**kwargs):
     t = []
     for time in timestamps:
         t.append(get_datetime(time))
+    #The value is only read if the timeseries has not been split into chunks.
     dataset_i = DBSession.query(Dataset).filter(Dataset.dataset_id==dataset_id).one()
-    #for time in t:
-    #    data.append(td.get_val(timestamp=time))
 
-    data = dataset_i.get_val(timestamp=t)
+    if dataset_i.data_type == 'timeseries':
+        times = np.array(t, dtype='datetime64[ns]')
+        data = _get_timeseries_vals(dataset_i, times, get_seasonal_times(times), use_chunks=True)
+        if data is not None and len(t) == 1:
+            data = data[0]
+    else:
+        data = dataset_i.get_val(timestamp=t)
+
     if data is not None:
         dataset = {'data': json.dumps(data)}
     else:
@@ -1006,16 +1389,26 @@ def get_multiple_vals_at_time(dataset_ids, timestamps,**kwargs):
 
     If the timestamp is before the start of the timeseries data, return
     None If the timestamp is after the end of the timeseries data, return
-    the last value.  """
+    the last value.
+
+    The requested times are parsed once and shared by all the datasets,
+    each of which is then searched for all of them at once.
+    """
 
-    datasets = _get_datasets(dataset_ids)
+    datasets = _get_dataset_values(dataset_ids)
     datetimes = []
     for time in timestamps:
         datetimes.append(get_datetime(time))
 
+    times = np.array(datetimes, dtype='datetime64[ns]')
+    seasonal_times = get_seasonal_times(times)
+
     return_vals = {}
-    for dataset_i in datasets.values():
-        data = dataset_i.get_val(timestamp=datetimes)
+    for dataset_i in datasets:
+        if dataset_i.data_type == 'timeseries':
+            data = _get_timeseries_vals(dataset_i, times, seasonal_times)
+        else:
+            data = get_val(dataset_i, timestamp=datetimes)
         ret_data = {}
         if type(data) is list:
             for i, t in enumerate(timestamps):
@@ -1044,14 +1437,17 @@ def get_vals_between_times(dataset_id, start_time, end_time, timestep,increment,
     try:
         server_start_time = get_datetime(start_time)
         server_end_time   = get_datetime(end_time)
-        times = [server_start_time]
-
-        next_time = server_start_time
-        while next_time < server_end_time:
-            if int(increment) == 0:
-                raise HydraError("%s is not a valid increment for this search."%increment)
-            next_time = next_time  + datetime.timedelta(**{timestep:int(increment)})
-            times.append(next_time)
+
+        if int(increment) == 0:
+            raise HydraError("%s is not a valid increment for this search."%increment)
+
+        #The times run from the start time up to the first one at or after the end time.
+        step = np.timedelta64(datetime.timedelta(**{timestep:int(increment)})).astype('timedelta64[ns]')
+        start = np.datetime64(server_start_time, 'ns')
+        span = np.datetime64(server_end_time, 'ns') - start
+        num_steps = max(0, -(-span.astype('int64') // step.astype('int64')))
+
+        times = start + np.arange(num_steps + 1) * step
     except ValueError:
         try:
             server_start_time = Decimal(start_time)
@@ -1067,7 +1463,10 @@ def get_vals_between_times(dataset_id, start_time, end_time, timestep,increment,
 
     td = DBSession.query(Dataset).filter(Dataset.dataset_id==dataset_id).one()
     log.debug("Number of times to fetch: %s", len(times))
-    data = td.get_val(timestamp=times)
+    if isinstance(times, np.ndarray) and td.data_type == 'timeseries':
+        data = _get_timeseries_vals(td, times, get_seasonal_times(times), use_chunks=True)
+    else:
+        data = td.get_val(timestamp=list(times))
 
     data_to_return = []
     if type(data) is list:
@@ -1083,6 +1482,74 @@ def get_vals_between_times(dataset_id, start_time, end_time, timestep,increment,
 
     return dataset
 
+def _get_unreadable_dataset_ids(datasets, user_id):
+    """
+        Get the IDs of those datasets which are hidden from the user.
+    """
+    hidden_ids = [d.dataset_id for d in datasets
+                  if d.hidden == 'Y' and d.created_by != user_id]
+
+    readable_ids = set()
+    for idx in range(0, len(hidden_ids), qry_in_threshold):
+        chunk = hidden_ids[idx:idx+qry_in_threshold]
+        rs = DBSession.query(DatasetOwner.dataset_id).filter(
+                                    DatasetOwner.user_id==user_id,
+                                    DatasetOwner.view=='Y',
+                                    DatasetOwner.dataset_id.in_(chunk)).all()
+        readable_ids.update([r.dataset_id for r in rs])
+
+    return set(hidden_ids) - readable_ids
+
+resample_methods = ('sum', 'mean', 'min', 'max', 'last')
+
+def resample_datasets(dataset_ids, freq, how, **kwargs):
+    """
+        Resample timeseries datasets to a new frequency on the server, so
+        that only the result, not each full timeseries, is sent to the client.
+
+        freq is a pandas offset alias, such as 'D', 'W', 'M' or 'A'.
+        how is the aggregation used for each period: one of
+        sum, mean, min, max or last.
+
+        Returns a dictionary, keyed on 'dataset_<id>', of the resampled
+        timeseries in the same JSON format as a dataset value. The entry is
+        None for datasets which are not timeseries, cannot be resampled,
+        or are hidden from the user.
+    """
+    user_id = int(kwargs.get('user_id'))
+
+    if how not in resample_methods:
+        raise HydraError("Unknown resample method %s. Use one of %s"%
+                         (how, ", ".join(resample_methods)))
+    try:
+        to_offset(freq)
+    except ValueError:
+        raise HydraError("%s is not a valid resample frequency."%(freq,))
+
+    datasets = _get_dataset_values(dataset_ids)
+    unreadable_ids = _get_unreadable_dataset_ids(datasets, user_id)
+
+    return_vals = {}
+    for dataset_i in datasets:
+        key = 'dataset_%s'%dataset_i.dataset_id
+        return_vals[key] = None
+
+        if dataset_i.data_type != 'timeseries' or dataset_i.dataset_id in unreadable_ids:
+            continue
+
+        try:
+            timeseries = get_val(dataset_i)
+            if type(timeseries.index) != pd.DatetimeIndex:
+                continue
+            resampled = getattr(timeseries.resample(freq), how)()
+        except Exception as e:
+            log.warn("Unable to resample dataset %s: %s", dataset_i.dataset_id, e)
+            continue
+
+        return_vals[key] = resampled.to_json(date_format='iso', date_unit='ns')
+
+    return return_vals
+
 def delete_dataset(dataset_id,**kwargs):
     """
         Removes a piece of data from the DB.
@@ -1097,9 +1564,66 @@ def delete_dataset(dataset_id,**kwargs):
     if len(dataset_rs) > 0:
         raise HydraError("Cannot delete %s. Dataset is used by resource scenarios."%dataset_id)
 
+    bump_data_version()
     DBSession.delete(d)
     DBSession.flush()
 
+def _delete_orphan_datasets(dataset_ids):
+    """
+        Of the given datasets, delete those which are no longer used by any
+        resource scenario or dataset collection, or as the default of any
+        type attribute, along with their metadata and owners.
+        Returns the number of datasets deleted.
+    """
+    dataset_ids = list(dataset_ids)
+    num_deleted = 0
+    for i in range(0, len(dataset_ids), qry_in_threshold):
+        chunk = dataset_ids[i:i+qry_in_threshold]
+
+        used_qry = DBSession.query(ResourceScenario.dataset_id).filter(
+                                ResourceScenario.dataset_id.in_(chunk)).union(
+                   DBSession.query(DatasetCollectionItem.dataset_id).filter(
+                                DatasetCollectionItem.dataset_id.in_(chunk)),
+                   DBSession.query(TypeAttr.default_dataset_id).filter(
+                                TypeAttr.default_dataset_id.in_(chunk)))
+        used_ids = set([r[0] for r in DBSession.execute(used_qry.statement).fetchall()])
+
+        orphan_ids = [dataset_id for dataset_id in chunk if dataset_id not in used_ids]
+        if len(orphan_ids) == 0:
+            continue
+
+        for tbl in (Metadata.__table__, DatasetTrigram.__table__, DatasetChunk.__table__,
+                    DatasetOwner.__table__, Dataset.__table__):
+            DBSession.execute(tbl.delete().where(tbl.c.dataset_id.in_(orphan_ids)))
+
+        num_deleted = num_deleted + len(orphan_ids)
+
+    if num_deleted > 0:
+        bump_data_version()
+
+    log.info("%s orphaned datasets deleted", num_deleted)
+
+    return num_deleted
+
+def collect_datasets(merge_duplicates='N', min_age_hours=24, **kwargs):
+    """
+        Delete the datasets which are no longer used by any resource scenario,
+        dataset collection or type attribute, and which were added more than
+        min_age_hours ago. If merge_duplicates is 'Y', datasets which are
+        identical to another dataset are first merged into it. This works
+        in batches, each committed as it is done, so is run as a job.
+        Returns the number of datasets deleted and merged.
+    """
+    check_perm(kwargs.get('user_id'), 'collect_data')
+
+    num_merged = 0
+    if merge_duplicates == 'Y':
+        num_merged = collect.merge_duplicate_datasets(db.engine)
+
+    num_deleted = collect.delete_orphan_datasets(db.engine, min_age_hours=min_age_hours)
+
+    return dict(deleted=num_deleted, merged=num_merged)
+
 def read_json(json_string):
     pd.read_json(json_string)
 
@@ -0,0 +1,223 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Jobs: long-running requests which are run by a pool of worker processes,
+    so that they do not hold up one of the server's threads while they run.
+
+    A job is submitted with queue_job, which returns its ID straight away.
+    The state of each job is kept in tJob, so it can be read by any server
+    thread using get_job_status and, once it has finished, get_job_result.
+
+    Each worker process has its own DB connections and runs each job in its
+    own transaction, as a server thread does for a request. The state of a
+    job is written on a separate connection, which commits immediately, so
+    that progress can be seen while the job's own transaction is still open.
+"""
+import logging
+import datetime
+import json
+import threading
+import multiprocessing
+import cPickle
+import transaction
+
+from HydraLib import config
+from HydraLib.HydraException import HydraError, ResourceNotFoundError, PermissionError
+
+import HydraServer.db
+from HydraServer.db import DBSession, rollback_transaction, close_session
+from HydraServer.db.model import Job
+
+import network
+import scenario
+import template
+import data
+
+log = logging.getLogger(__name__)
+
+_job_pool = None
+_job_pool_lock = threading.Lock()
+
+def _add_network(net, **kwargs):
+    net_i = network.add_network(net, **kwargs)
+    return {'network_id':net_i.network_id}
+
+def _clone_scenario(scenario_id, **kwargs):
+    cloned_scen = scenario.clone_scenario(scenario_id, **kwargs)
+    return {'scenario_id':cloned_scen.scenario_id}
+
+def _validate_network(network_id, template_id, scenario_id=None, **kwargs):
+    return template.validate_network(network_id, template_id, scenario_id)
+
+def _apply_template_to_network(template_id, network_id, **kwargs):
+    template.apply_template_to_network(template_id, network_id, **kwargs)
+    return 'OK'
+
+def _purge_network(network_id, purge_data, **kwargs):
+    network.purge_network(network_id, purge_data, **kwargs)
+    return 'OK'
+
+def _collect_datasets(merge_duplicates, min_age_hours, **kwargs):
+    return data.collect_datasets(merge_duplicates, min_age_hours, **kwargs)
+
+#The functions which can be run as jobs. Each returns its result, which
+#must be JSON serialisable. The version of any network a job changes is
+#incremented in the job's own transaction, so the server stops using its
+#cached copy of the network before the job is seen to have finished.
+job_types = {
+    'add_network'               : _add_network,
+    'clone_scenario'            : _clone_scenario,
+    'validate_network'          : _validate_network,
+    'apply_template_to_network' : _apply_template_to_network,
+    'purge_network'             : _purge_network,
+    'collect_datasets'          : _collect_datasets,
+}
+
+def _set_job(job_id, **values):
+    """
+        Update the state of a job on a connection of its own, so the
+        change is committed immediately.
+    """
+    try:
+        with HydraServer.db.engine.begin() as conn:
+            conn.execute(Job.__table__.update().where(
+                            Job.__table__.c.job_id==job_id).values(**values))
+    except Exception as e:
+        log.critical("Unable to update job %s: %s", job_id, e)
+
+def _init_worker():
+    """
+        Run in each worker process when it starts. The connections in the
+        pool inherited from the server cannot be shared with it, so are
+        discarded, as is the get_network thread pool, whose threads do not
+        exist in this process. A worker can't start processes of its own,
+        so it processes uploads itself, rather than using an ingest pool.
+    """
+    HydraServer.db.engine.dispose()
+    DBSession.remove()
+    network._query_pool = None
+    data._ingest_pool = None
+
+def _run_job(job_id, job_type, job_args):
+    """
+        Run a job in a worker process.
+    """
+    args, kwargs = cPickle.loads(job_args)
+
+    _set_job(job_id, status='RUNNING', start_time=datetime.datetime.now())
+
+    def _progress(progress, message=None):
+        _set_job(job_id, progress=int(progress), message=message)
+
+    kwargs['progress'] = _progress
+
+    try:
+        result = job_types[job_type](*args, **kwargs)
+        transaction.commit()
+        _set_job(job_id,
+                 status='FINISHED',
+                 progress=100,
+                 result=json.dumps(result),
+                 end_time=datetime.datetime.now())
+    except Exception as e:
+        log.exception(e)
+        rollback_transaction()
+        _set_job(job_id,
+                 status='FAILED',
+                 message=unicode(getattr(e, 'message', None) or e),
+                 end_time=datetime.datetime.now())
+    finally:
+        close_session()
+
+def init_job_pool():
+    """
+        Start the job worker processes, if they have not been started already.
+        Best called before the server starts its threads, so the workers are
+        not forked from a process in which other threads are running.
+    """
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            num_processes = max(int(config.get('hydra_server', 'job_processes', 2)), 1)
+            log.info("Starting %s job processes", num_processes)
+            _job_pool = multiprocessing.Pool(num_processes, initializer=_init_worker)
+    return _job_pool
+
+def queue_job(job_type, *args, **kwargs):
+    """
+        Submit a job to be run by the job workers.
+        args and kwargs are passed to the function for that type of job,
+        so must be picklable.
+
+        Returns the job, whose ID can be used to get its status and result.
+    """
+    if job_type not in job_types:
+        raise HydraError("Unknown job type: %s"%(job_type,))
+
+    #Pickle the arguments here, rather than leaving it to the pool, so that
+    #any problem with them is reported now instead of lost in the pool.
+    try:
+        job_args = cPickle.dumps((args, kwargs), cPickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        raise HydraError("Unable to queue %s job: %s"%(job_type, e))
+
+    user_id = kwargs.get('user_id')
+
+    #The job must exist before a worker starts on it, so is added on a
+    #connection of its own rather than in the request's transaction.
+    with HydraServer.db.engine.begin() as conn:
+        res = conn.execute(Job.__table__.insert(), job_type=job_type, user_id=user_id)
+        job_id = res.inserted_primary_key[0]
+
+    try:
+        init_job_pool().apply_async(_run_job, (job_id, job_type, job_args))
+    except Exception as e:
+        _set_job(job_id, status='FAILED', message=unicode(e), end_time=datetime.datetime.now())
+        raise HydraError("Unable to queue %s job: %s"%(job_type, e))
+
+    log.info("Job %s (%s) queued for user %s", job_id, job_type, user_id)
+
+    return get_job_status(job_id, user_id=user_id)
+
+def get_job_status(job_id, **kwargs):
+    """
+        Get a job, with its status and progress, but without its result.
+    """
+    user_id = kwargs.get('user_id')
+
+    #The workers update jobs on their own connections, so make sure
+    #the latest state is read, not an earlier copy in the session.
+    job_i = DBSession.query(Job).filter(Job.job_id==job_id).populate_existing().first()
+    if job_i is None:
+        raise ResourceNotFoundError("Job %s not found"%(job_id,))
+
+    if job_i.user_id != int(user_id):
+        raise PermissionError("Permission denied. User %s did not submit job %s"%(user_id, job_id))
+
+    return job_i
+
+def get_job_result(job_id, **kwargs):
+    """
+        Get the result of a finished job, as a JSON string.
+    """
+    job_i = get_job_status(job_id, **kwargs)
+
+    if job_i.status == 'FAILED':
+        raise HydraError("Job %s failed: %s"%(job_id, job_i.message))
+    elif job_i.status != 'FINISHED':
+        raise HydraError("Job %s has not finished. Its status is %s"%(job_id, job_i.status))
+
+    return job_i.result
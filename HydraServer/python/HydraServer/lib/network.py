@@ -14,19 +14,21 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 import logging
-from HydraLib.HydraException import HydraError, ResourceNotFoundError
+from HydraLib.HydraException import HydraError, ResourceNotFoundError, PermissionError
 import scenario
 import datetime
 import data
+import objects
 import time
 
 from HydraServer.util.permissions import check_perm
 import template
 from HydraServer.db.model import Project, Network, Scenario, Node, Link, ResourceGroup,\
         ResourceAttr, Attr, ResourceType, ResourceGroupItem, Dataset, Metadata, DatasetOwner,\
-        ResourceScenario, TemplateType, TypeAttr, Template
-from sqlalchemy.orm import noload, joinedload, joinedload_all
-from HydraServer.db import DBSession
+        ResourceScenario, TemplateType, TypeAttr, Template, ResourceAttrMap, Rule, Note,\
+        NetworkOwner
+from sqlalchemy.orm import noload, joinedload, joinedload_all, undefer
+from HydraServer.db import DBSession, rollback_transaction, close_session
 from sqlalchemy import func, and_, or_, distinct
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import aliased
@@ -34,14 +36,36 @@ from HydraLib.hydra_dateutil import timestamp_to_ordinal
 from HydraServer.util.hdb import add_attributes, add_resource_types
 
 from sqlalchemy import case
-from sqlalchemy.sql import null
+from sqlalchemy.sql import null, literal
+from sqlalchemy.sql.expression import bindparam
 
 from collections import namedtuple
+from itertools import izip
 
-import zlib
+from HydraServer.util.dataformat import decode_value
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+from decimal import Decimal
+
+from HydraLib import config
+from HydraLib.hydra_dateutil import ordinal_to_timestamp
+
+from HydraServer.util.cache import LRUCache
+from HydraServer.util.changelog import record_changes, get_change_version, get_change_versions,\
+        get_changes, get_pruned_version, delete_changes, bump_network_version,\
+        is_network_changed, is_changed, get_data_version, get_template_version
 
 log = logging.getLogger(__name__)
 
+#Cache of assembled networks, as returned by get_network.
+network_cache = LRUCache(int(config.get('cache', 'network_cache_size', 256)) * 0x100000)
+
+#Threads used to run the get_network queries concurrently. Created on first use.
+_query_pool_size = int(config.get('hydra_server', 'network_query_threads', 0))
+_query_pool = None
+_query_pool_lock = threading.Lock()
+
 class dictobj(dict):
     def __init__(self, obj_dict, extras={}):
         for k, v in extras.items():
@@ -58,6 +82,106 @@ class dictobj(dict):
     def __setattr__(self, name, value):
         self[name] = value
 
+class _Record(object):
+    """
+        The base of the objects which make up the nodes, links, groups,
+        attributes, types, scenarios and data of a network returned by
+        get_network. There can be hundreds of thousands of these, so unlike a
+        dictobj, each has a fixed set of fields held in __slots__ rather than
+        its own dictionary. A field which has not been set reads as its
+        default, or None.
+    """
+    __slots__ = ()
+    _defaults = {}
+
+    def __init__(self, *values, **kwargs):
+        for name, value in izip(self.__slots__, values):
+            setattr(self, name, value)
+        for name, value in kwargs.iteritems():
+            setattr(self, name, value)
+
+    def __getattr__(self, name):
+        #Only called when the field has not been set.
+        if name in self.__slots__:
+            return self._defaults.get(name)
+        raise AttributeError("%s has no field %s" % (self.__class__.__name__, name))
+
+    def _asdict(self):
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+    def __repr__(self):
+        return repr(self._asdict())
+
+def _record_type(name, fields, defaults={}):
+    return type(name, (_Record,), {'__slots__' : tuple(fields), '_defaults' : defaults})
+
+def _rows_to_records(record_type, rows):
+    """
+        Turn the rows of a query into records. The columns are matched to
+        the fields by name, so the record must have a field for each column.
+    """
+    if len(rows) == 0:
+        return []
+
+    keys = tuple(rows[0].keys())
+    if keys == record_type.__slots__[:len(keys)]:
+        return [record_type(*row) for row in rows]
+    else:
+        return [record_type(**dict(izip(keys, row))) for row in rows]
+
+_resource_defaults = {'types' : (), 'attributes' : ()}
+
+NodeRecord = _record_type('NodeRecord',
+                          Node.__table__.columns.keys() + ['types', 'attributes'],
+                          _resource_defaults)
+
+LinkRecord = _record_type('LinkRecord',
+                          Link.__table__.columns.keys() + ['types', 'attributes'],
+                          _resource_defaults)
+
+GroupRecord = _record_type('GroupRecord',
+                           ResourceGroup.__table__.columns.keys() + ['types', 'attributes'],
+                           _resource_defaults)
+
+ScenarioRecord = _record_type('ScenarioRecord',
+                              Scenario.__table__.columns.keys() + ['resourcescenarios', 'resourcegroupitems'],
+                              {'resourcescenarios' : (), 'resourcegroupitems' : ()})
+
+ResourceAttrRecord = _record_type('ResourceAttrRecord',
+                                  ['resource_attr_id', 'ref_key', 'cr_date', 'attr_is_var',
+                                   'node_id', 'link_id', 'group_id', 'network_id', 'attr_id',
+                                   'unit', 'data_type', 'description', 'properties',
+                                   'attr_name', 'attr_dimen'])
+
+DatasetRecord = _record_type('DatasetRecord',
+                             ['dataset_id', 'data_type', 'data_units', 'data_dimen',
+                              'data_name', 'data_hash', 'cr_date', 'created_by', 'hidden',
+                              'start_date', 'frequency', 'value', 'metadata'])
+
+class ResourceTypeRecord(_Record):
+    """
+        The type of a node, link, group or network, along with the name of
+        its template. This is a single object, rather than the ResourceType,
+        TemplateType and Template of the DB model, so templatetype and
+        template are the record itself.
+    """
+    __slots__ = ('ref_key', 'node_id', 'link_id', 'group_id', 'network_id',
+                 'template_name', 'template_id', 'type_id', 'layout', 'type_name')
+
+    templatetype = property(lambda self: self)
+    template     = property(lambda self: self)
+
+class ResourceScenarioRecord(_Record):
+    """
+        A resource scenario and its dataset. The attr_id of the resource
+        attribute is held on the record itself, so resourceattr is the
+        record itself.
+    """
+    __slots__ = ('resource_attr_id', 'scenario_id', 'dataset_id', 'source',
+                 'cr_date', 'attr_id', 'dataset')
+
+    resourceattr = property(lambda self: self)
+
 def _update_attributes(resource_i, attributes):
     if attributes is None:
         return dict()
@@ -103,7 +227,12 @@ def _get_all_attributes(network):
 
     return attrs
 
-def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map):
+def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map, ref_ids=None):
+    """
+        Add the attributes of some new resources, and those of their types.
+        ref_ids limits the attributes retrieved afterwards to those of the
+        specified resources, rather than all those of that kind in the network.
+    """
 
     start_time = datetime.datetime.now()
 
@@ -132,10 +261,17 @@ def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map):
 
     #Now get all the attributes supposed to be on the resources based on the types.
     t0 = time.time()
-    all_types = DBSession.query(TemplateType).options(joinedload('typeattrs')).all()
+    type_ids = set()
+    for resource in resources:
+        if resource.types is not None:
+            for resource_type in resource.types:
+                type_ids.add(resource_type.id)
     type_dict = {}
-    for t in all_types:
-        type_dict[t.type_id] = t.typeattrs
+    if len(type_ids) > 0:
+        all_types = DBSession.query(TemplateType).filter(
+            TemplateType.type_id.in_(type_ids)).options(joinedload('typeattrs')).all()
+        for t in all_types:
+            type_dict[t.type_id] = t.typeattrs
     #Holds all the attributes supposed to be on a resource based on its specified
     #type
     resource_resource_types = []
@@ -207,17 +343,28 @@ def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map):
     #Now that the attributes are in, we need to map the attributes in the DB
     #to the attributes in the incoming data so that the resource scenarios
     #know what to refer to.
-    res_qry = DBSession.query(ResourceAttr)
-    if ref_key == 'NODE':
-        res_qry = res_qry.join(Node).filter(Node.network_id==network_id)
-    elif ref_key == 'GROUP':
-        res_qry = res_qry.join(ResourceGroup).filter(ResourceGroup.network_id==network_id)
-    elif ref_key == 'LINK':
-        res_qry = res_qry.join(Link).filter(Link.network_id==network_id)
-    elif ref_key == 'NETWORK':
-        res_qry = res_qry.join(Network).filter(Network.network_id==network_id)
-
-    real_resource_attrs = res_qry.all()
+    if ref_ids is None:
+        res_qry = DBSession.query(ResourceAttr)
+        if ref_key == 'NODE':
+            res_qry = res_qry.join(Node).filter(Node.network_id==network_id)
+        elif ref_key == 'GROUP':
+            res_qry = res_qry.join(ResourceGroup).filter(ResourceGroup.network_id==network_id)
+        elif ref_key == 'LINK':
+            res_qry = res_qry.join(Link).filter(Link.network_id==network_id)
+        elif ref_key == 'NETWORK':
+            res_qry = res_qry.join(Network).filter(Network.network_id==network_id)
+
+        real_resource_attrs = res_qry.all()
+    else:
+        ref_id_col = {'NODE'    : ResourceAttr.node_id,
+                      'LINK'    : ResourceAttr.link_id,
+                      'GROUP'   : ResourceAttr.group_id,
+                      'NETWORK' : ResourceAttr.network_id}[ref_key]
+        real_resource_attrs = []
+        ref_ids = list(ref_ids)
+        for i in range(0, len(ref_ids), data.qry_in_threshold):
+            real_resource_attrs.extend(DBSession.query(ResourceAttr).filter(
+                ref_id_col.in_(ref_ids[i:i+data.qry_in_threshold])).all())
     logging.info("retrieved %s entries in %s"%(len(real_resource_attrs), datetime.datetime.now() - start_time))
 
     resource_attr_dict = {}
@@ -367,18 +514,7 @@ def _add_links(net_i, links, node_id_map):
 
     return link_id_map, link_attrs, defaults
 
-def _add_resource_groups(net_i, resourcegroups):
-    start_time = datetime.datetime.now()
-    #List of resource attributes
-    group_attrs = {}
-    #Map negative IDS to their new, positive, counterparts.
-    group_id_map = dict()
-
-    grp_datasets = []
-
-    if resourcegroups is None or len(resourcegroups)==0:
-        return group_id_map, group_attrs, {}
-    #Then add all the groups.
+def _add_groups_to_database(net_i, resourcegroups):
     log.info("Adding groups to network")
     group_dicts = []
     if resourcegroups:
@@ -391,6 +527,22 @@ def _add_resource_groups(net_i, resourcegroups):
 
     if len(group_dicts) > 0:
         DBSession.execute(ResourceGroup.__table__.insert(), group_dicts)
+
+    return len(group_dicts)
+
+def _add_resource_groups(net_i, resourcegroups):
+    start_time = datetime.datetime.now()
+    #List of resource attributes
+    group_attrs = {}
+    #Map negative IDS to their new, positive, counterparts.
+    group_id_map = dict()
+
+    grp_datasets = []
+
+    if resourcegroups is None or len(resourcegroups)==0:
+        return group_id_map, group_attrs, {}
+    #Then add all the groups.
+    if _add_groups_to_database(net_i, resourcegroups):
         log.info("Resource Groups added in %s", get_timing(start_time))
 
         iface_groups = {}
@@ -422,6 +574,120 @@ def _add_resource_groups(net_i, resourcegroups):
     return group_id_map, group_attrs, defaults
 
 
+def _report_progress(progress, percent, message):
+    """
+        Report how far through a long operation has got, when it
+        is being run as a job. See HydraServer.lib.jobs
+    """
+    if progress is not None:
+        progress(percent, message)
+
+def _add_scenarios(net_i, scenarios, all_resource_attrs, defaults, node_id_map,
+                   link_id_map, grp_id_map, user_id, app_name, progress=None):
+    """
+        Add the scenarios of a new network, with their data and group items.
+
+        The datasets of all the scenarios are inserted together, so each
+        distinct value is hashed and inserted once however many scenarios use
+        it. The resource scenarios and group items are then each inserted
+        in a single executemany, rather than through the ORM.
+    """
+    log.info("Adding scenarios to network")
+
+    scenario_rows = []
+    for s in scenarios:
+        scenario_rows.append({
+            'network_id'           : net_i.network_id,
+            'scenario_name'        : s.name,
+            'scenario_description' : s.description,
+            'layout'               : s.get_layout(),
+            'start_time'           : str(timestamp_to_ordinal(s.start_time)) if s.start_time else None,
+            'end_time'             : str(timestamp_to_ordinal(s.end_time)) if s.end_time else None,
+            'time_step'            : s.time_step,
+            'created_by'           : user_id,
+        })
+
+    scenario_names = [row['scenario_name'] for row in scenario_rows]
+    if len(set(scenario_names)) != len(scenario_names):
+        seen = set()
+        for name in scenario_names:
+            if name in seen:
+                raise HydraError("Duplicate scenario name: %s"%(name))
+            seen.add(name)
+
+    if len(scenario_rows) == 0:
+        return
+
+    DBSession.execute(Scenario.__table__.insert(), scenario_rows)
+
+    scenario_ids = dict(DBSession.query(Scenario.scenario_name, Scenario.scenario_id).filter(
+                                        Scenario.network_id==net_i.network_id).all())
+
+    #Gather the data from every scenario, so it is all inserted at once.
+    incoming_datasets = []
+    dataset_targets = []
+    for s in scenarios:
+        scenario_id = scenario_ids[s.name]
+        if s.resourcescenarios is not None:
+            for r_scen in s.resourcescenarios:
+                ra = all_resource_attrs[r_scen.resource_attr_id]
+                incoming_datasets.append(r_scen.value)
+                dataset_targets.append((scenario_id, ra.resource_attr_id))
+
+    data_start_time = datetime.datetime.now()
+    datasets = []
+    if len(incoming_datasets) > 0:
+        datasets = data._bulk_insert_data(incoming_datasets, user_id, app_name)
+    log.info("Data bulk insert took %s", get_timing(data_start_time))
+    _report_progress(progress, 80, "Data added")
+
+    #Keyed on scenario and resource attribute, so that incoming data
+    #replaces the default from a type, rather than clashing with it.
+    rs_rows = {}
+    for scenario_id in scenario_ids.values():
+        for default in defaults:
+            rs_rows[(scenario_id, default['resource_attr_id'])] = default['dataset_id']
+
+    for (scenario_id, resource_attr_id), dataset in izip(dataset_targets, datasets):
+        rs_rows[(scenario_id, resource_attr_id)] = dataset.dataset_id
+
+    rs_start_time = datetime.datetime.now()
+    if len(rs_rows) > 0:
+        DBSession.execute(ResourceScenario.__table__.insert(),
+                          [{'scenario_id'      : scenario_id,
+                            'resource_attr_id' : resource_attr_id,
+                            'dataset_id'       : dataset_id,
+                            'source'           : app_name}
+                           for (scenario_id, resource_attr_id), dataset_id in rs_rows.items()])
+    log.info("%s resource scenarios added in %s", len(rs_rows), get_timing(rs_start_time))
+
+    item_start_time = datetime.datetime.now()
+    group_items = []
+    for s in scenarios:
+        if s.resourcegroupitems is None:
+            continue
+        for group_item in s.resourcegroupitems:
+            item = {'scenario_id' : scenario_ids[s.name],
+                    'group_id'    : grp_id_map[group_item.group_id].group_id,
+                    'ref_key'     : group_item.ref_key,
+                    'node_id'     : None,
+                    'link_id'     : None,
+                    'subgroup_id' : None}
+            if group_item.ref_key == 'NODE':
+                item['node_id'] = node_id_map[group_item.ref_id].node_id
+            elif group_item.ref_key == 'LINK':
+                item['link_id'] = link_id_map[group_item.ref_id].link_id
+            elif group_item.ref_key == 'GROUP':
+                item['subgroup_id'] = grp_id_map[group_item.ref_id].group_id
+            else:
+                raise HydraError("A ref key of %s is not valid for a "
+                                 "resource group item."%(group_item.ref_key,))
+            group_items.append(item)
+
+    if len(group_items) > 0:
+        DBSession.execute(ResourceGroupItem.__table__.insert(), group_items)
+    log.info("%s group items added in %s", len(group_items), get_timing(item_start_time))
+
 def add_network(network,**kwargs):
     """
     Takes an entire network complex model and saves it to the DB.  This
@@ -440,6 +706,7 @@ def add_network(network,**kwargs):
     """
     DBSession.autoflush = False
     user_id = kwargs.get('user_id')
+    progress = kwargs.get('progress')
 
     #check_perm('add_network')
 
@@ -489,11 +756,14 @@ def add_network(network,**kwargs):
     log.info("Network attributes added in %s", get_timing(start_time))
     node_id_map, node_attrs, node_datasets = _add_nodes(net_i, network.nodes)
     all_resource_attrs.update(node_attrs)
+    _report_progress(progress, 20, "Nodes added")
 
     link_id_map, link_attrs, link_datasets = _add_links(net_i, network.links, node_id_map)
     all_resource_attrs.update(link_attrs)
+    _report_progress(progress, 40, "Links added")
 
     grp_id_map, grp_attrs, grp_datasets = _add_resource_groups(net_i, network.resourcegroups)
+    _report_progress(progress, 50, "Groups added")
 
     defaults = grp_datasets.values() + link_datasets.values() + node_datasets.values()
 
@@ -501,73 +771,17 @@ def add_network(network,**kwargs):
 
     start_time = datetime.datetime.now()
 
-    scenario_names = []
     if network.scenarios is not None:
-        log.info("Adding scenarios to network")
-        for s in network.scenarios:
-
-            if s.name in scenario_names:
-                raise HydraError("Duplicate scenario name: %s"%(s.name))
-
-            scen = Scenario()
-            scen.scenario_name        = s.name
-            scen.scenario_description = s.description
-            scen.layout               = s.get_layout()
-            scen.start_time           = str(timestamp_to_ordinal(s.start_time)) if s.start_time else None
-            scen.end_time             = str(timestamp_to_ordinal(s.end_time)) if s.end_time else None
-            scen.time_step            = s.time_step
-            scen.created_by           = user_id
-
-            scenario_names.append(s.name)
-
-            #extract the data from each resourcescenario
-            incoming_datasets = []
-            scenario_resource_attrs = []
-            for r_scen in s.resourcescenarios:
-                ra = all_resource_attrs[r_scen.resource_attr_id]
-                incoming_datasets.append(r_scen.value)
-                scenario_resource_attrs.append(ra)
-
-            data_start_time = datetime.datetime.now()
-
-            for default in defaults:
-                scen.add_resource_scenario(dictobj(default),
-                                           dictobj({'dataset_id':default['dataset_id']}),
-                                           source=kwargs.get('app_name'))
-
-            datasets = data._bulk_insert_data(
-                                              incoming_datasets,
-                                              user_id,
-                                              kwargs.get('app_name')
-                                             )
-
-            log.info("Data bulk insert took %s", get_timing(data_start_time))
-            ra_start_time = datetime.datetime.now()
-            for i, ra in enumerate(scenario_resource_attrs):
-                scen.add_resource_scenario(ra, datasets[i], source=kwargs.get('app_name'))
-
-            log.info("Resource scenarios added in  %s", get_timing(ra_start_time))
-
-            item_start_time = datetime.datetime.now()
-            if s.resourcegroupitems is not None:
-                for group_item in s.resourcegroupitems:
-                    group_item_i = ResourceGroupItem()
-                    group_item_i.group = grp_id_map[group_item.group_id]
-                    group_item_i.ref_key  = group_item.ref_key
-                    if group_item.ref_key == 'NODE':
-                        group_item_i.node = node_id_map[group_item.ref_id]
-                    elif group_item.ref_key == 'LINK':
-                        group_item_i.link = link_id_map[group_item.ref_id]
-                    elif group_item.ref_key == 'GROUP':
-                        group_item_i.subgroup = grp_id_map[group_item.ref_id]
-                    else:
-                        raise HydraError("A ref key of %s is not valid for a "
-                                         "resource group item.",\
-                                         group_item.ref_key)
-
-                    scen.resourcegroupitems.append(group_item_i)
-            log.info("Group items insert took %s", get_timing(item_start_time))
-            net_i.scenarios.append(scen)
+        _add_scenarios(net_i,
+                       network.scenarios,
+                       all_resource_attrs,
+                       defaults,
+                       node_id_map,
+                       link_id_map,
+                       grp_id_map,
+                       user_id,
+                       kwargs.get('app_name'),
+                       progress)
 
     log.info("Scenarios added in %s", get_timing(start_time))
     net_i.set_owner(user_id)
@@ -577,6 +791,350 @@ def add_network(network,**kwargs):
 
     return net_i
 
+def _get_resources_by_name(network_id, name_col, id_col, names):
+    """
+        Get the IDs of some of the nodes, links or groups in a network,
+        keyed on their names. Each row has the ID column as an attribute.
+    """
+    table = name_col.class_
+    name_map = {}
+    for i in range(0, len(names), data.qry_in_threshold):
+        qry = DBSession.query(name_col, id_col).filter(
+            table.network_id==network_id,
+            name_col.in_(names[i:i+data.qry_in_threshold]))
+        for row in qry.all():
+            name_map[getattr(row, name_col.key)] = row
+    return name_map
+
+class _ImportItem(dictobj):
+    """
+        The network, or a node, link, group or scenario, as read from a chunk
+        of a network being imported. Gives the same access to it as the
+        complex models do.
+    """
+    def __init__(self, obj_dict):
+        items = {}
+        for k, v in obj_dict.items():
+            if k in ('attributes', 'types') and v is not None:
+                v = [dictobj(i) for i in v]
+            items[str(k)] = v
+        dictobj.__init__(self, items)
+
+    def get_layout(self):
+        if self.layout in (None, '', {}):
+            return None
+        return str(self.layout)
+
+def _import_dataset(value):
+    """
+        Turn the value of an imported resource scenario into a dataset
+        which can be passed to data._bulk_insert_data
+    """
+    if value is None or value.get('value') is None:
+        raise HydraError("A resource scenario has no value.")
+
+    value = dict(value)
+    if not isinstance(value['value'], basestring):
+        value['value'] = json.dumps(value['value'])
+
+    return objects.Dataset(value)
+
+class _NetworkImport(object):
+    """
+        The state of a network import which is kept between chunks: the maps
+        from the temporary IDs used in the incoming network to the real IDs,
+        and the default datasets to be given to each scenario. Everything
+        else in a chunk is discarded once the chunk has been added.
+    """
+    def __init__(self, user_id, app_name):
+        self.user_id  = user_id
+        self.app_name = app_name
+        self.net_i    = None
+
+        self.node_ids          = {}
+        self.link_ids          = {}
+        self.group_ids         = {}
+        self.resource_attr_ids = {}
+        self.scenario_ids      = {}
+
+        #(resource_attr_id, dataset_id) of the default data from the types
+        self.defaults = []
+
+        self.counts = {'nodes':0, 'links':0, 'resourcegroups':0,
+                       'scenarios':0, 'resourcescenarios':0, 'resourcegroupitems':0}
+
+    def add_chunk(self, chunk):
+        if not isinstance(chunk, dict) or len(chunk) != 1:
+            raise HydraError("Each chunk of a network must contain one item.")
+
+        key, value = chunk.items()[0]
+
+        if key == 'network':
+            self.add_network(_ImportItem(value))
+            return
+
+        if self.net_i is None:
+            raise HydraError("The network must be imported before its %s."%(key,))
+
+        if key == 'nodes':
+            self.add_nodes([_ImportItem(n) for n in value])
+        elif key == 'links':
+            self.add_links([_ImportItem(l) for l in value])
+        elif key == 'resourcegroups':
+            self.add_groups([_ImportItem(g) for g in value])
+        elif key == 'scenario':
+            self.add_scenario(_ImportItem(value))
+        elif key == 'resourcescenarios':
+            self.add_resourcescenarios(value.get('scenario_id'), value.get('resourcescenarios', []))
+        elif key == 'resourcegroupitems':
+            self.add_group_items(value.get('scenario_id'), value.get('resourcegroupitems', []))
+        else:
+            raise HydraError("Unrecognised chunk: %s"%(key,))
+
+    def add_network(self, network):
+        if self.net_i is not None:
+            raise HydraError("Only one network can be imported at a time.")
+
+        proj_i = DBSession.query(Project).filter(Project.project_id == network.project_id).first()
+        if proj_i is None:
+            raise HydraError("Project ID is none. A project ID must be specified on the Network")
+
+        existing_net = DBSession.query(Network.network_id).filter(Network.project_id == network.project_id, Network.network_name==network.name).first()
+        if existing_net is not None:
+            raise HydraError("A network with the name %s is already in project %s"%(network.name, network.project_id))
+
+        proj_i.check_write_permission(self.user_id)
+
+        net_i = Network()
+        net_i.project_id          = network.project_id
+        net_i.network_name        = network.name
+        net_i.network_description = network.description
+        net_i.created_by          = self.user_id
+        net_i.projection          = network.projection
+        net_i.layout              = network.get_layout()
+
+        DBSession.add(net_i)
+        DBSession.flush()
+        self.net_i = net_i
+
+        network_attrs, defaults = _bulk_add_resource_attrs(net_i.network_id, 'NETWORK', [network],
+                                                           {network.name:net_i},
+                                                           ref_ids=[net_i.network_id])
+        add_resource_types(net_i, network.types)
+
+        self._add_resource_attrs(network_attrs, defaults)
+
+        net_i.set_owner(self.user_id)
+        DBSession.flush()
+
+    def _get_by_name(self, name_col, id_col, names):
+        """
+            Get the ID columns of the newly added resources of a chunk,
+            keyed on their names.
+        """
+        if len(set(names)) != len(names):
+            raise HydraError("Duplicate %s name in %s"%(name_col.key.split('_')[0], self.net_i.network_name))
+
+        return _get_resources_by_name(self.net_i.network_id, name_col, id_col, names)
+
+    def _add_resource_attrs(self, resource_attrs, defaults):
+        for temp_id, ra in resource_attrs.items():
+            self.resource_attr_ids[temp_id] = ra.resource_attr_id
+
+        new_defaults = [(d['resource_attr_id'], d['dataset_id']) for d in defaults.values()]
+        self.defaults.extend(new_defaults)
+        for scenario_id in self.scenario_ids.values():
+            self._insert_resourcescenarios(scenario_id, new_defaults)
+
+    def add_nodes(self, nodes):
+        _add_nodes_to_database(self.net_i, nodes)
+
+        name_map = self._get_by_name(Node.node_name, Node.node_id, [n.name for n in nodes])
+        for node in nodes:
+            self.node_ids[node.id] = name_map[node.name].node_id
+
+        node_attrs, defaults = _bulk_add_resource_attrs(self.net_i.network_id, 'NODE', nodes, name_map,
+                                                        ref_ids=[n.node_id for n in name_map.values()])
+        self._add_resource_attrs(node_attrs, defaults)
+        self.counts['nodes'] += len(nodes)
+
+    def add_links(self, links):
+        NodeRef = namedtuple('NodeRef', ['node_id'])
+        node_refs = {}
+        for link in links:
+            for temp_id in (link.node_1_id, link.node_2_id):
+                if temp_id in self.node_ids:
+                    node_refs[temp_id] = NodeRef(self.node_ids[temp_id])
+
+        _add_links_to_database(self.net_i, links, node_refs)
+
+        name_map = self._get_by_name(Link.link_name, Link.link_id, [l.name for l in links])
+        for link in links:
+            self.link_ids[link.id] = name_map[link.name].link_id
+
+        link_attrs, defaults = _bulk_add_resource_attrs(self.net_i.network_id, 'LINK', links, name_map,
+                                                        ref_ids=[l.link_id for l in name_map.values()])
+        self._add_resource_attrs(link_attrs, defaults)
+        self.counts['links'] += len(links)
+
+    def add_groups(self, groups):
+        _add_groups_to_database(self.net_i, groups)
+
+        name_map = self._get_by_name(ResourceGroup.group_name, ResourceGroup.group_id, [g.name for g in groups])
+        for group in groups:
+            self.group_ids[group.id] = name_map[group.name].group_id
+
+        group_attrs, defaults = _bulk_add_resource_attrs(self.net_i.network_id, 'GROUP', groups, name_map,
+                                                         ref_ids=[g.group_id for g in name_map.values()])
+        self._add_resource_attrs(group_attrs, defaults)
+        self.counts['resourcegroups'] += len(groups)
+
+    def add_scenario(self, s):
+        if s.id is None:
+            raise HydraError("Scenario %s has no ID, so its data cannot refer to it."%(s.name,))
+        if s.id in self.scenario_ids:
+            raise HydraError("Duplicate scenario ID: %s"%(s.id,))
+
+        scen = Scenario()
+        scen.network_id           = self.net_i.network_id
+        scen.scenario_name        = s.name
+        scen.scenario_description = s.description
+        scen.layout               = s.get_layout()
+        scen.start_time           = str(timestamp_to_ordinal(s.start_time)) if s.start_time else None
+        scen.end_time             = str(timestamp_to_ordinal(s.end_time)) if s.end_time else None
+        scen.time_step            = s.time_step
+        scen.created_by           = self.user_id
+
+        DBSession.add(scen)
+        DBSession.flush()
+
+        self.scenario_ids[s.id] = scen.scenario_id
+        DBSession.expunge(scen)
+
+        self._insert_resourcescenarios(self.scenario_ids[s.id], self.defaults)
+        self.counts['scenarios'] += 1
+
+    def _get_scenario_id(self, temp_id):
+        scenario_id = self.scenario_ids.get(temp_id)
+        if scenario_id is None:
+            raise HydraError("Scenario %s has not been imported."%(temp_id,))
+        return scenario_id
+
+    def _insert_resourcescenarios(self, scenario_id, ra_datasets):
+        rs_list = [{'scenario_id'      : scenario_id,
+                    'resource_attr_id' : ra_id,
+                    'dataset_id'       : dataset_id,
+                    'source'           : self.app_name} for ra_id, dataset_id in ra_datasets]
+        if len(rs_list) > 0:
+            DBSession.execute(ResourceScenario.__table__.insert(), rs_list)
+
+    def add_resourcescenarios(self, temp_scenario_id, resourcescenarios):
+        scenario_id = self._get_scenario_id(temp_scenario_id)
+
+        ra_ids = []
+        datasets = []
+        for rs in resourcescenarios:
+            ra_id = self.resource_attr_ids.get(rs.get('resource_attr_id'))
+            if ra_id is None:
+                raise HydraError("Resource attribute %s has not been imported."%(rs.get('resource_attr_id'),))
+            ra_ids.append(ra_id)
+            datasets.append(_import_dataset(rs.get('value')))
+
+        if len(datasets) == 0:
+            return
+
+        datasets = data._bulk_insert_data(datasets, self.user_id, self.app_name)
+
+        self._insert_resourcescenarios(scenario_id,
+                                       zip(ra_ids, [d.dataset_id for d in datasets]))
+        self.counts['resourcescenarios'] += len(ra_ids)
+
+    def add_group_items(self, temp_scenario_id, group_items):
+        scenario_id = self._get_scenario_id(temp_scenario_id)
+
+        id_maps = {'NODE':self.node_ids, 'LINK':self.link_ids, 'GROUP':self.group_ids}
+        ref_cols = {'NODE':'node_id', 'LINK':'link_id', 'GROUP':'subgroup_id'}
+
+        item_list = []
+        for item in group_items:
+            ref_key = item.get('ref_key')
+            if ref_key not in id_maps:
+                raise HydraError("A ref key of %s is not valid for a "
+                                 "resource group item."%(ref_key,))
+
+            group_id = self.group_ids.get(item.get('group_id'))
+            ref_id = id_maps[ref_key].get(item.get('ref_id'))
+            if group_id is None or ref_id is None:
+                raise HydraError("Group item (group %s, %s %s) refers to a resource which "
+                                 "has not been imported."%(item.get('group_id'), ref_key, item.get('ref_id')))
+
+            item_dict = {'scenario_id' : scenario_id,
+                         'group_id'    : group_id,
+                         'ref_key'     : ref_key,
+                         'node_id'     : None,
+                         'link_id'     : None,
+                         'subgroup_id' : None}
+            item_dict[ref_cols[ref_key]] = ref_id
+            item_list.append(item_dict)
+
+        if len(item_list) > 0:
+            DBSession.execute(ResourceGroupItem.__table__.insert(), item_list)
+        self.counts['resourcegroupitems'] += len(item_list)
+
+def import_network(chunks, **kwargs):
+    """
+        Add a network which arrives in chunks, such as the lines of a
+        JSON upload, so that neither the incoming network nor the one being
+        added is ever held in memory in its entirety.
+
+        chunks is an iterable of dictionaries, each with a single key:
+            network:            The network itself, as in add_network, but without
+                                its resources or scenarios. This must come first.
+            nodes, links,
+            resourcegroups:     A list of resources, as in add_network. Links must
+                                come after the nodes they connect.
+            scenario:           A scenario without its data. Its ID is the
+                                temporary ID used by the data which follows.
+            resourcescenarios:  {'scenario_id': .., 'resourcescenarios': [...]}
+                                Data for a scenario. Each resource scenario has
+                                a resource_attr_id and a value, as in add_network.
+            resourcegroupitems: {'scenario_id': .., 'resourcegroupitems': [...]}
+
+        As with add_network, new items are referred to using temporary IDs.
+        Only the maps from these to the real IDs are kept between chunks.
+
+        Returns the ID of the new network and the number of each kind of
+        item added.
+    """
+    DBSession.autoflush = False
+
+    start_time = datetime.datetime.now()
+
+    importer = _NetworkImport(kwargs.get('user_id'), kwargs.get('app_name'))
+
+    for chunk in chunks:
+        importer.add_chunk(chunk)
+
+    if importer.net_i is None:
+        raise HydraError("No network was found in the import.")
+
+    DBSession.flush()
+
+    log.info("Import of network %s took %s", importer.net_i.network_id, get_timing(start_time))
+
+    result = dict(importer.counts)
+    result['network_id'] = importer.net_i.network_id
+    return result
+
+def _filter_networks(network_id_col, network_id):
+    """
+        Filter a query to one network, or to several if network_id
+        is a list, so the networks of a project can be read together.
+    """
+    if isinstance(network_id, (list, tuple, set)):
+        return network_id_col.in_(network_id)
+    return network_id_col == network_id
+
 def _get_all_resource_attributes(network_id, template_id=None):
     """
         Get all the attributes for the nodes, links and groups of a network.
@@ -601,12 +1159,12 @@ def _get_all_resource_attributes(network_id, template_id=None):
                               ).filter(Attr.attr_id==ResourceAttr.attr_id)
 
 
-    all_node_attribute_qry = base_qry.join(Node).filter(Node.network_id==network_id)
+    all_node_attribute_qry = base_qry.join(Node).filter(_filter_networks(Node.network_id, network_id))
 
-    all_link_attribute_qry = base_qry.join(Link).filter(Link.network_id==network_id)
+    all_link_attribute_qry = base_qry.join(Link).filter(_filter_networks(Link.network_id, network_id))
 
-    all_group_attribute_qry = base_qry.join(ResourceGroup).filter(ResourceGroup.network_id==network_id)
-    network_attribute_qry = base_qry.filter(ResourceAttr.network_id==network_id)
+    all_group_attribute_qry = base_qry.join(ResourceGroup).filter(_filter_networks(ResourceGroup.network_id, network_id))
+    network_attribute_qry = base_qry.filter(_filter_networks(ResourceAttr.network_id, network_id))
 
 
     #Filter the group attributes by template
@@ -629,7 +1187,7 @@ def _get_all_resource_attributes(network_id, template_id=None):
     group_attr_dict = dict()
     network_attr_dict = dict()
 
-    for attr in all_attributes:
+    for attr in _rows_to_records(ResourceAttrRecord, all_attributes):
         if attr.ref_key == 'NODE':
             nodeattr = node_attr_dict.get(attr.node_id, [])
             nodeattr.append(attr)
@@ -679,15 +1237,15 @@ def _get_all_templates(network_id, template_id):
 
 
     all_node_type_qry = base_qry.filter(Node.node_id==ResourceType.node_id,
-                                        Node.network_id==network_id)
+                                        _filter_networks(Node.network_id, network_id))
 
     all_link_type_qry = base_qry.filter(Link.link_id==ResourceType.link_id,
-                                        Link.network_id==network_id)
+                                        _filter_networks(Link.network_id, network_id))
 
     all_group_type_qry = base_qry.filter(ResourceGroup.group_id==ResourceType.group_id,
-                                         ResourceGroup.network_id==network_id)
+                                         _filter_networks(ResourceGroup.network_id, network_id))
 
-    network_type_qry = base_qry.filter(ResourceType.network_id==network_id)
+    network_type_qry = base_qry.filter(_filter_networks(ResourceType.network_id, network_id))
 
     #Filter the group attributes by template
     if template_id is not None:
@@ -709,28 +1267,23 @@ def _get_all_templates(network_id, template_id):
     group_type_dict = dict()
     network_type_dict = dict()
 
-    for t in all_types:
-
-        resourcetype = dictobj({'type_id':t.type_id})
-        resourcetype.templatetype = dictobj(t)
-        rttemplate = dictobj({'template_name':t.template_name})
-        resourcetype.templatetype.template =rttemplate
+    for t in _rows_to_records(ResourceTypeRecord, all_types):
 
         if t.ref_key == 'NODE':
             nodetype = node_type_dict.get(t.node_id, [])
-            nodetype.append(resourcetype)
+            nodetype.append(t)
             node_type_dict[t.node_id] = nodetype
         elif t.ref_key == 'LINK':
             linktype = link_type_dict.get(t.link_id, [])
-            linktype.append(resourcetype)
+            linktype.append(t)
             link_type_dict[t.link_id] = linktype
         elif t.ref_key == 'GROUP':
             grouptype = group_type_dict.get(t.group_id, [])
-            grouptype.append(resourcetype)
+            grouptype.append(t)
             group_type_dict[t.group_id] = grouptype
         elif t.ref_key == 'NETWORK':
             nettype = network_type_dict.get(t.network_id, [])
-            nettype.append(resourcetype)
+            nettype.append(t)
             network_type_dict[t.network_id] = nettype
 
 
@@ -745,14 +1298,18 @@ def _get_all_templates(network_id, template_id):
     return all_types
 
 
-def _get_all_group_items(network_id):
+def _get_all_group_items(network_id, scenario_ids=None):
     """
-        Get all the resource group items in the network, across all scenarios
+        Get all the resource group items in the network, across all scenarios,
+        or only those specified.
         returns a dictionary of dict objects, keyed on scenario_id
     """
     base_qry = DBSession.query(ResourceGroupItem)
 
-    item_qry = base_qry.join(Scenario).filter(Scenario.network_id==network_id)
+    item_qry = base_qry.join(Scenario).filter(_filter_networks(Scenario.network_id, network_id))
+
+    if scenario_ids is not None:
+        item_qry = item_qry.filter(Scenario.scenario_id.in_(scenario_ids))
 
     x = time.time()
     logging.info("Getting all items")
@@ -773,9 +1330,10 @@ def _get_all_group_items(network_id):
 
     return item_dict
 
-def _get_all_resourcescenarios(network_id, user_id):
+def _get_all_resourcescenarios(network_id, user_id, scenario_ids=None, resource_attr_ids=None):
     """
-        Get all the resource scenarios in a network, across all scenarios
+        Get all the resource scenarios in a network, across all scenarios,
+        optionally limited to the specified scenarios and resource attributes.
         returns a dictionary of dict objects, keyed on scenario_id
     """
 
@@ -800,9 +1358,14 @@ def _get_all_resourcescenarios(network_id, user_id):
                 or_(Dataset.hidden=='N', DatasetOwner.user_id != None),
                 ResourceAttr.resource_attr_id == ResourceScenario.resource_attr_id,
                 Scenario.scenario_id==ResourceScenario.scenario_id,
-                Scenario.network_id==network_id,
+                _filter_networks(Scenario.network_id, network_id),
                 Dataset.dataset_id==ResourceScenario.dataset_id)
 
+    if scenario_ids is not None:
+        rs_qry = rs_qry.filter(ResourceScenario.scenario_id.in_(scenario_ids))
+    if resource_attr_ids is not None:
+        rs_qry = rs_qry.filter(ResourceScenario.resource_attr_id.in_(resource_attr_ids))
+
     x = time.time()
     logging.info("Getting all resource scenarios")
     all_rs = DBSession.execute(rs_qry.statement).fetchall()
@@ -812,37 +1375,23 @@ def _get_all_resourcescenarios(network_id, user_id):
     logging.info("resource scenarios retrieved. Processing results...")
     x = time.time()
     rs_dict = dict()
-    for rs in all_rs:
-        rs_obj = dictobj(rs)
-        rs_attr = dictobj({'attr_id':rs.attr_id})
+    for (data_type, data_units, data_dimen, data_name, data_hash, cr_date,
+         created_by, hidden, start_time, frequency, value,
+         dataset_id, scenario_id, resource_attr_id, source, attr_id) in all_rs:
 
-        value = rs.value
-        try:
-            value = zlib.decompress(value)
-        except:
-            pass
-
-        rs_dataset = dictobj({
-            'dataset_id':rs.dataset_id,
-            'data_type' : rs.data_type,
-            'data_units':rs.data_units,
-            'data_dimen':rs.data_dimen,
-            'data_name':rs.data_name,
-            'data_hash':rs.data_hash,
-            'cr_date':rs.cr_date,
-            'created_by':rs.created_by,
-            'hidden':rs.hidden,
-            'start_date':rs.start_time,
-            'frequency':rs.frequency,
-            'value':value,
-            'metadata':[],
-        })
-        rs_obj.resourceattr = rs_attr
-        rs_obj.dataset = rs_dataset
+        value = decode_value(value)
+
+        rs_dataset = DatasetRecord(dataset_id, data_type, data_units, data_dimen,
+                                   data_name, data_hash, cr_date, created_by, hidden,
+                                   start_time, frequency, value, [])
 
-        scenario_rs = rs_dict.get(rs.scenario_id, [])
+        rs_obj = ResourceScenarioRecord(resource_attr_id, scenario_id, dataset_id,
+                                        source, cr_date, attr_id, rs_dataset)
+
+        scenario_rs = rs_dict.get(scenario_id)
+        if scenario_rs is None:
+            scenario_rs = rs_dict[scenario_id] = []
         scenario_rs.append(rs_obj)
-        rs_dict[rs.scenario_id] = scenario_rs
 
     logging.info("resource scenarios processed in %s", time.time()-x)
 
@@ -860,7 +1409,7 @@ def _get_metadata(network_id, user_id):
     ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id, DatasetOwner.user_id==user_id)).filter(
                 or_(Dataset.hidden=='N', DatasetOwner.user_id != None),
                 Scenario.scenario_id==ResourceScenario.scenario_id,
-                Scenario.network_id==network_id,
+                _filter_networks(Scenario.network_id, network_id),
                 Dataset.dataset_id==ResourceScenario.dataset_id).distinct().subquery()
 
     rs_qry = DBSession.query(
@@ -888,84 +1437,68 @@ def _get_nodes(network_id, template_id=None):
     """
         Get all the nodes in a network
     """
-    extras = {'types':[], 'attributes':[]}
 
     node_qry = DBSession.query(Node).filter(
-                        Node.network_id==network_id,
+                        _filter_networks(Node.network_id, network_id),
                         Node.status=='A').options(noload('network'))
     if template_id is not None:
         node_qry = node_qry.filter(ResourceType.node_id==Node.node_id, TemplateType.type_id==ResourceType.type_id, TemplateType.template_id==template_id)
     node_res = DBSession.execute(node_qry.statement).fetchall()
 
-    nodes = []
-    for n in node_res:
-        nodes.append(dictobj(n, extras))
-
-    return nodes
+    return _rows_to_records(NodeRecord, node_res)
 
 def _get_links(network_id, template_id=None):
     """
         Get all the links in a network
     """
-    extras = {'types':[], 'attributes':[]}
     link_qry = DBSession.query(Link).filter(
-                                        Link.network_id==network_id,
+                                        _filter_networks(Link.network_id, network_id),
                                         Link.status=='A').options(noload('network'))
     if template_id is not None:
         link_qry = link_qry.filter(ResourceType.link_id==Link.link_id, TemplateType.type_id==ResourceType.type_id, TemplateType.template_id==template_id)
 
     link_res = DBSession.execute(link_qry.statement).fetchall()
 
-    links = []
-    for l in link_res:
-        links.append(dictobj(l, extras))
-
-    return links
+    return _rows_to_records(LinkRecord, link_res)
 
 def _get_groups(network_id, template_id=None):
     """
         Get all the resource groups in a network
     """
-    extras = {'types':[], 'attributes':[]}
     group_qry = DBSession.query(ResourceGroup).filter(
-                                        ResourceGroup.network_id==network_id,
+                                        _filter_networks(ResourceGroup.network_id, network_id),
                                         ResourceGroup.status=='A').options(noload('network'))
     if template_id is not None:
         group_qry = group_qry.filter(ResourceType.group_id==ResourceGroup.group_id, TemplateType.type_id==ResourceType.type_id, TemplateType.template_id==template_id)
 
     group_res = DBSession.execute(group_qry.statement).fetchall()
-    groups = []
-    for g in group_res:
-        groups.append(dictobj(g, extras))
 
-    return groups
+    return _rows_to_records(GroupRecord, group_res)
 
 
-def _get_scenarios(network_id, include_data, user_id, scenario_ids=None):
+def _get_scenario_list(network_id, scenario_ids=None):
     """
-        Get all the scenarios in a network
+        Get the scenarios in a network, without their data or group items.
     """
     scen_qry = DBSession.query(Scenario).filter(
-                    Scenario.network_id == network_id).options(
+                    _filter_networks(Scenario.network_id, network_id)).options(
                         noload('network')).filter(
                         Scenario.status == 'A')
 
     if scenario_ids:
         logging.info("Filtering by scenario_ids %s",scenario_ids)
         scen_qry = scen_qry.filter(Scenario.scenario_id.in_(scenario_ids))
-    extras = {'resourcescenarios': [], 'resourcegroupitems': []}
-    scens = [dictobj(s,extras) for s in DBSession.execute(scen_qry.statement).fetchall()]
-
-    all_resource_group_items = _get_all_group_items(network_id)
-
-    if include_data == 'Y':
-        all_rs = _get_all_resourcescenarios(network_id, user_id)
-        metadata = _get_metadata(network_id, user_id)
+    return _rows_to_records(ScenarioRecord, DBSession.execute(scen_qry.statement).fetchall())
 
+def _set_scenario_data(scens, all_resource_group_items, all_rs=None, metadata=None):
+    """
+        Add the group items, and optionally the resource scenarios and
+        their metadata, to a list of scenarios.
+    """
     for s in scens:
         s.resourcegroupitems = all_resource_group_items.get(s.scenario_id, [])
 
-        if include_data == 'Y':
+        if all_rs is not None:
             s.resourcescenarios  = all_rs.get(s.scenario_id, [])
 
             for rs in s.resourcescenarios:
@@ -973,7 +1506,282 @@ def _get_scenarios(network_id, include_data, user_id, scenario_ids=None):
 
     return scens
 
-def get_network(network_id, include_resources=True, summary=False, include_data='N', scenario_ids=None, template_id=None, **kwargs):
+def _init_query_pool(num_threads):
+    """
+        Set the number of threads used to run the get_network queries
+        concurrently. A num_threads of 0 or 1 means the queries are run
+        one after another, in the request's own session.
+    """
+    global _query_pool, _query_pool_size
+    with _query_pool_lock:
+        if _query_pool is not None:
+            _query_pool.close()
+            _query_pool = None
+        _query_pool_size = num_threads
+
+def _get_query_pool():
+    global _query_pool
+    with _query_pool_lock:
+        if _query_pool is None and _query_pool_size > 1:
+            _query_pool = ThreadPool(_query_pool_size)
+        return _query_pool
+
+def _run_query_in_thread(fn, args):
+    """
+        Run one of the get_network queries in a thread from the query pool.
+        The thread has its own session, and so its own connection, which is
+        discarded once the query is finished, as it only reads.
+    """
+    try:
+        if DBSession.bind.dialect.name == 'mysql':
+            #Take the snapshot now, rather than at the first read, so all the
+            #queries see the DB at as close to the same time as possible.
+            DBSession.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        return fn(*args)
+    finally:
+        rollback_transaction()
+        close_session()
+
+def _get_versions(network_ids):
+    """
+        Get the versions, as stored in the DB, on which the contents of
+        some networks depend.
+    """
+    return (get_change_versions(network_ids), get_template_version(), get_data_version())
+
+def _run_network_queries(network_id, queries, parallel=True):
+    """
+        Run the queries needed to build a network, returning their results
+        as a dictionary, keyed on the name of each query.
+
+        queries is a list of (name, function, args) tuples. The queries are
+        run concurrently when the query pool is enabled, and otherwise one
+        after another.
+
+        The concurrent queries each use their own connection, so they can't see
+        anything the current request has not yet committed. The query pool is
+        therefore only used if the request has not made any changes, which
+        callers that have flushed changes must indicate with parallel=False.
+
+        The concurrent queries can also see changes committed since the
+        request's own snapshot, which the network's version does not include.
+        Once they are finished, the versions are read again in a new
+        transaction. If they differ from those in the request's snapshot,
+        the queries are run again one after another in the request's session,
+        so the result always matches its version.
+    """
+    pool = _get_query_pool()
+
+    if isinstance(network_id, (list, tuple, set)):
+        network_ids = list(network_id)
+    else:
+        network_ids = [network_id]
+
+    if parallel is False or pool is None or len(queries) < 2 \
+       or DBSession.new or DBSession.dirty or DBSession.deleted \
+       or len([n for n in network_ids if is_network_changed(n)]) > 0:
+        return dict([(name, fn(*args)) for name, fn, args in queries])
+
+    versions = _get_versions(network_ids)
+
+    x = time.time()
+    async_results = [(name, pool.apply_async(_run_query_in_thread, (fn, args)))
+                     for name, fn, args in queries]
+    results = dict([(name, r.get()) for name, r in async_results])
+    log.info("%s network queries run concurrently in %s", len(queries), time.time()-x)
+
+    if pool.apply(_run_query_in_thread, (_get_versions, (network_ids,))) != versions:
+        log.info("Network %s changed while being read. Reading it again.", network_id)
+        return _run_network_queries(network_id, queries, parallel=False)
+
+    return results
+
+def _get_owners(net_i):
+    """
+        Get the owners of a network as plain objects, so they
+        can be used once the session is closed.
+    """
+    owners = []
+    for o in net_i.owners:
+        owner = dictobj({'user_id' : o.user_id,
+                         'view'    : o.view,
+                         'edit'    : o.edit,
+                         'share'   : o.share})
+        owner.user = dictobj({'username'     : o.user.username,
+                              'display_name' : o.user.display_name})
+        owners.append(owner)
+    return owners
+
+def _get_shared_cache_key(include_data, user_id):
+    """
+        Get the part of the key under which a network is cached which is
+        the same for every network. The types on the resources depend on the
+        templates, so the template version is included. When data is included,
+        what is returned also depends on which hidden datasets the user can
+        see, and on the datasets themselves, so the user and the dataset
+        version are included too.
+    """
+    if include_data == 'Y':
+        data_key = (get_data_version(), user_id)
+    else:
+        data_key = None
+
+    return (get_template_version(), data_key)
+
+def _get_network_cache_key(network_id, version, shared_key, include_resources, summary,
+                           include_data, scenario_ids, template_id):
+    """
+        Build the key under which a network is cached. This includes the
+        version of the network, so any edit to the network produces a new key,
+        and the key returned by _get_shared_cache_key.
+    """
+    if scenario_ids:
+        scenario_ids = tuple(sorted(scenario_ids))
+    else:
+        scenario_ids = None
+
+    return (network_id,
+            version,
+            shared_key,
+            bool(include_resources),
+            bool(summary),
+            include_data,
+            scenario_ids,
+            template_id)
+
+def _cache_network(cache_key, net):
+    """
+        Cache a network, unless it was read by a transaction which has
+        changed it. The network is then shared by every request for it,
+        so must not be changed. See get_network.
+    """
+    if network_cache.max_bytes <= 0:
+        return net
+    network_id, version = cache_key[0], cache_key[1]
+    #What the current transaction has changed is not committed,
+    #so the network read may never exist as far as anyone else is concerned.
+    if is_network_changed(network_id) or is_changed('TEMPLATE') or is_changed('DATA'):
+        return net
+    #Older versions of this network can never be requested again.
+    network_cache.remove_where(lambda k: k[0] == network_id and k[1] != version)
+    network_cache.put(cache_key, net)
+    return net
+
+def get_network_cache_stats(**kwargs):
+    """
+        Get the number of entries, size and hit rate of the network cache.
+    """
+    return network_cache.get_stats()
+
+def _get_network_dict(net_i, version):
+    """
+        Get the column values and owners of a network, to which its
+        resources and scenarios are then added.
+    """
+    #Only take the column values. The loaded relationships are ORM
+    #objects which can't be used once the session is closed.
+    net = dictobj(dict([(k, v) for k, v in net_i.__dict__.items()
+                        if not k.startswith('_')
+                        and not isinstance(v, list)
+                        and not hasattr(v, '_sa_instance_state')]))
+    net.owners = _get_owners(net_i)
+    #The version to pass to get_network_changes to find what has changed since.
+    net.version = version
+    return net
+
+def _get_network_queries(network_id, include_resources, summary, include_data,
+                         scenario_ids, template_id, user_id):
+    """
+        Get the queries needed to build a network, or several networks
+        if network_id is a list, as taken by _run_network_queries.
+    """
+    #The queries are independent of each other, so can be run in any order.
+    #The largest are put first, so they start first when run concurrently.
+    queries = []
+    if summary is False and include_data == 'Y':
+        queries.append(('resourcescenarios', _get_all_resourcescenarios, (network_id, user_id)))
+        queries.append(('metadata', _get_metadata, (network_id, user_id)))
+    if summary is False:
+        queries.append(('attributes', _get_all_resource_attributes, (network_id, template_id)))
+    queries.append(('types', _get_all_templates, (network_id, template_id)))
+    if include_resources is True:
+        queries.append(('nodes', _get_nodes, (network_id, template_id)))
+        queries.append(('links', _get_links, (network_id, template_id)))
+        queries.append(('groups', _get_groups, (network_id, template_id)))
+    if summary is False:
+        queries.append(('scenarios', _get_scenario_list, (network_id, scenario_ids)))
+        queries.append(('groupitems', _get_all_group_items, (network_id,)))
+    return queries
+
+def _by_network(rows):
+    """
+        Split the rows returned by a query across several networks
+        into a dictionary, keyed on network ID.
+    """
+    rows_by_network = {}
+    for row in rows:
+        network_rows = rows_by_network.get(row.network_id)
+        if network_rows is None:
+            network_rows = rows_by_network[row.network_id] = []
+        network_rows.append(row)
+    return rows_by_network
+
+def _set_network_contents(nets, results, include_resources, summary):
+    """
+        Add the results of the network queries to the networks they came
+        from. The queries can be for one network or for several.
+    """
+    log.info("Setting types")
+    all_types = results['types']
+
+    if summary is False:
+        all_attributes = results['attributes']
+    else:
+        all_attributes = {}
+
+    if include_resources is True:
+        nodes  = _by_network(results['nodes'])
+        links  = _by_network(results['links'])
+        groups = _by_network(results['groups'])
+
+        for node in results['nodes']:
+            node.types = all_types['NODE'].get(node.node_id, [])
+        for link in results['links']:
+            link.types = all_types['LINK'].get(link.link_id, [])
+        for group in results['groups']:
+            group.types = all_types['GROUP'].get(group.group_id, [])
+
+        if summary is False:
+            for node in results['nodes']:
+                node.attributes = all_attributes['NODE'].get(node.node_id, [])
+            log.info("Node attributes set")
+            for link in results['links']:
+                link.attributes = all_attributes['LINK'].get(link.link_id, [])
+            log.info("Link attributes set")
+            for group in results['groups']:
+                group.attributes = all_attributes['GROUP'].get(group.group_id, [])
+            log.info("Group attributes set")
+
+    if summary is False:
+        log.info("Setting scenarios")
+        scenarios = _by_network(_set_scenario_data(results['scenarios'],
+                                                   results['groupitems'],
+                                                   results.get('resourcescenarios'),
+                                                   results.get('metadata')))
+
+    for net in nets:
+        net.types = all_types['NETWORK'].get(net.network_id, [])
+
+        if summary is False:
+            net.attributes = all_attributes['NETWORK'].get(net.network_id, [])
+            net.scenarios  = scenarios.get(net.network_id, [])
+
+        if include_resources is True:
+            net.nodes          = nodes.get(net.network_id, [])
+            net.links          = links.get(net.network_id, [])
+            net.resourcegroups = groups.get(net.network_id, [])
+
+def get_network(network_id, include_resources=True, summary=False, include_data='N', scenario_ids=None, template_id=None, parallel=True, **kwargs):
     """
         Return a whole network as a dictionary.
         network_id: ID of the network to retrieve
@@ -985,6 +1793,14 @@ def get_network(network_id, include_resources=True, summary=False, include_data=
                       will speed up this function call.
         template_id:  Return the network with only attributes associated with this
                       template on the network, groups, nodes and links.
+        parallel:     Allow the queries to be run concurrently, if the query pool
+                      is enabled. Must be False if the caller has made changes which
+                      are not yet committed.
+
+        The network may come from, or be put in, network_cache, so is shared
+        with other requests, and must be treated as read-only. Copying it for
+        each request would cost nearly as much as reading it again. The SOAP
+        layer only reads it, to build the complex models it returns.
     """
     log.debug("getting network %s"%network_id)
     user_id = kwargs.get('user_id')
@@ -1001,59 +1817,746 @@ def get_network(network_id, include_resources=True, summary=False, include_data=
                                 noload('resourcegroups')).one()
 
         net_i.check_read_permission(user_id)
-        net_i.owners
-        # TODO: delete the above once owners can be added automatically by SQLAlchemy, non-lazily, or some other mod
 
-        net = dictobj(net_i.__dict__)
+        version = get_change_version(network_id)
 
-        log.info("Setting types")
-        all_types = _get_all_templates(network_id, template_id)
-        net.types = all_types['NETWORK'].get(network_id, [])
+        cache_key = _get_network_cache_key(network_id,
+                                           version,
+                                           _get_shared_cache_key(include_data, user_id),
+                                           include_resources, summary, include_data,
+                                           scenario_ids, template_id)
+        net = network_cache.get(cache_key)
+        if net is not None:
+            log.info("Network %s retrieved from cache", network_id)
+            return net
 
-        if summary is False:
-            all_attributes = _get_all_resource_attributes(network_id, template_id)
-            log.info("Setting attributes")
-            net.attributes = all_attributes['NETWORK'].get(network_id, [])
-        else:
-            all_attributes = {}
+        net = _get_network_dict(net_i, version)
 
-        if include_resources is True:
-            net.nodes          = _get_nodes(network_id, template_id=template_id)
-            net.links          = _get_links(network_id, template_id=template_id)
-            net.resourcegroups = _get_groups(network_id, template_id=template_id)
-
-            for node in net.nodes:
-                node.types = all_types['NODE'].get(node.node_id, [])
-            for link in net.links:
-                link.types = all_types['LINK'].get(link.link_id, [])
-            for group in net.resourcegroups:
-                group.types = all_types['GROUP'].get(group.group_id, [])
-
-            if summary is False:
-
-                # all_attributes = _get_all_resource_attributes(network_id, template_id)
-                # log.info("Setting attributes")
-                # net.attributes = all_attributes['NETWORK'].get(network_id, [])
-                for node in net.nodes:
-                    node.attributes = all_attributes['NODE'].get(node.node_id, [])
-                log.info("Node attributes set")
-                for link in net.links:
-                    link.attributes = all_attributes['LINK'].get(link.link_id, [])
-                log.info("Link attributes set")
-                for group in net.resourcegroups:
-                    group.attributes = all_attributes['GROUP'].get(group.group_id, [])
-                log.info("Group attributes set")
+        queries = _get_network_queries(network_id, include_resources, summary, include_data,
+                                       scenario_ids, template_id, user_id)
 
-        if summary is False:
-            log.info("Getting scenarios")
+        results = _run_network_queries(network_id, queries, parallel=parallel)
 
-            net.scenarios = _get_scenarios(network_id, include_data, user_id, scenario_ids)
+        _set_network_contents([net], results, include_resources, summary)
 
     except NoResultFound:
         raise ResourceNotFoundError("Network (network_id=%s) not found." %
                                   network_id)
 
-    return net
+    return _cache_network(cache_key, net)
+
+def get_networks(network_ids, include_resources=True, summary=False, include_data='N', template_id=None, parallel=True, **kwargs):
+    """
+        Return several networks, as get_network does, but reading them all
+        with one set of queries rather than one set per network.
+        Networks the user can't read are left out.
+        The networks are returned in the order of network_ids, and
+        are read-only, as they can be shared with the cache.
+    """
+    user_id = kwargs.get('user_id')
+
+    shared_key = _get_shared_cache_key(include_data, user_id)
+
+    nets = {}
+    for idx in range(0, len(network_ids), data.qry_in_threshold):
+        id_chunk = network_ids[idx:idx+data.qry_in_threshold]
+
+        nets_i = DBSession.query(Network).filter(
+                                Network.network_id.in_(id_chunk)).options(
+                                noload('scenarios')).options(
+                                noload('nodes')).options(
+                                noload('links')).options(
+                                noload('types')).options(
+                                noload('attributes')).options(
+                                noload('resourcegroups')).options(
+                                joinedload_all('owners.user')).all()
+
+        versions = get_change_versions(id_chunk)
+
+        to_read = {}
+        for net_i in nets_i:
+            try:
+                net_i.check_read_permission(user_id)
+            except PermissionError:
+                log.info("Not returning network %s as user %s does not have "
+                         "permission to read it.", net_i.network_id, user_id)
+                continue
+
+            cache_key = _get_network_cache_key(net_i.network_id,
+                                               versions[net_i.network_id],
+                                               shared_key,
+                                               include_resources, summary,
+                                               include_data, None, template_id)
+            net = network_cache.get(cache_key)
+            if net is not None:
+                nets[net_i.network_id] = net
+            else:
+                to_read[net_i.network_id] = (net_i, cache_key)
+
+        if len(to_read) == 0:
+            continue
+
+        read_ids = to_read.keys()
+        read_nets = [_get_network_dict(to_read[network_id][0], versions[network_id])
+                     for network_id in read_ids]
+
+        queries = _get_network_queries(read_ids, include_resources, summary, include_data,
+                                       None, template_id, user_id)
+
+        results = _run_network_queries(read_ids, queries, parallel=parallel)
+
+        _set_network_contents(read_nets, results, include_resources, summary)
+
+        for net in read_nets:
+            nets[net.network_id] = _cache_network(to_read[net.network_id][1], net)
+
+    log.info("%s networks retrieved", len(nets))
+
+    return [nets[network_id] for network_id in network_ids if network_id in nets]
+
+def _get_rows_by_id(qry, id_col, ids):
+    """
+        Get the rows of a query which match a list of IDs, as a dictionary
+        keyed on ID. The IDs are queried in batches, to keep the IN clause
+        within the limits of the DB.
+    """
+    rows = {}
+    ids = list(ids)
+    for idx in range(0, len(ids), data.qry_in_threshold):
+        for row in qry.filter(id_col.in_(ids[idx:idx+data.qry_in_threshold])).all():
+            rows[getattr(row, id_col.key)] = row
+    return rows
+
+def _get_dataset_metadata(all_rs):
+    """
+        Get the metadata of the datasets in a dictionary of resource
+        scenarios, as returned by _get_all_resourcescenarios.
+    """
+    dataset_ids = set()
+    for scenario_rs in all_rs.values():
+        for rs in scenario_rs:
+            dataset_ids.add(rs.dataset_id)
+
+    metadata = {}
+    for m in data._get_metadata(list(dataset_ids)):
+        metadata.setdefault(m.dataset_id, []).append(m)
+    return metadata
+
+def get_network_changes(network_id, since_version, **kwargs):
+    """
+        Get what has changed in a network since the specified version. The
+        version of a network is returned by get_network, and by this function,
+        so a client can keep its copy of a network up to date.
+
+        Returns an object containing:
+            network_id
+            version:        The version to pass to the next call.
+            nodes, links, resourcegroups, resourceattrs:
+                            Those which have been added or changed.
+            scenarios:      The scenarios which have been added or changed. A
+                            scenario which has changed as a whole contains all its
+                            data and group items. Otherwise it contains only the
+                            resource scenarios which have changed.
+            deleted:        The change log entries for the things which have been
+                            deleted since the specified version.
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        net_i = DBSession.query(Network).filter(Network.network_id == network_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
+
+    net_i.check_read_permission(user_id)
+
+    if since_version is None:
+        since_version = 0
+
+    pruned_version = get_pruned_version(network_id)
+    if since_version < pruned_version:
+        raise HydraError("The changes to network %s up to version %s are no longer kept."
+                         " Get the whole network again."%(network_id, pruned_version))
+
+    version = get_change_version(network_id)
+
+    changes = {}
+    for change in get_changes(network_id, since_version):
+        if change.version <= version:
+            changes.setdefault(change.ref_key, []).append(change)
+
+    deleted = []
+    def _set_deleted(ref_changes, current_ids):
+        for change in ref_changes:
+            if change.ref_id not in current_ids:
+                entry = dictobj(change)
+                entry.change_type = 'DELETE'
+                deleted.append(entry)
+
+    ret = dictobj({'network_id' : network_id, 'version' : version})
+
+    #Deleted and inactive resources are both reported as deleted,
+    #as get_network does not return either.
+    for key, model, id_col, name in (('NODE', Node, Node.node_id, 'nodes'),
+                                     ('LINK', Link, Link.link_id, 'links'),
+                                     ('GROUP', ResourceGroup, ResourceGroup.group_id, 'resourcegroups')):
+        ref_changes = changes.get(key, [])
+        qry = DBSession.query(model).filter(model.network_id==network_id, model.status=='A')
+        current = _get_rows_by_id(qry, id_col, [c.ref_id for c in ref_changes])
+        _set_deleted(ref_changes, current)
+        ret[name] = current.values()
+
+    ref_changes = changes.get('RESOURCEATTR', [])
+    current = _get_rows_by_id(DBSession.query(ResourceAttr),
+                              ResourceAttr.resource_attr_id,
+                              [c.ref_id for c in ref_changes])
+    _set_deleted(ref_changes, current)
+    ret.resourceattrs = current.values()
+
+    #Scenarios which have changed as a whole
+    scenario_changes = changes.get('SCENARIO', [])
+    whole_scenario_ids = set([c.ref_id for c in scenario_changes])
+
+    #Scenarios in which only some data has changed
+    data_changes = {}
+    for change in changes.get('RESOURCESCENARIO', []):
+        if change.scenario_id not in whole_scenario_ids:
+            data_changes.setdefault(change.scenario_id, []).append(change)
+
+    scenario_ids = list(whole_scenario_ids) + data_changes.keys()
+    if len(scenario_ids) > 0:
+        scenarios = dict([(s.scenario_id, s) for s in _get_scenario_list(network_id, scenario_ids)])
+    else:
+        scenarios = {}
+
+    _set_deleted(scenario_changes, scenarios)
+
+    whole_scenarios = [s for s in scenarios.values() if s.scenario_id in whole_scenario_ids]
+    if len(whole_scenarios) > 0:
+        ids = [s.scenario_id for s in whole_scenarios]
+        all_rs = _get_all_resourcescenarios(network_id, user_id, scenario_ids=ids)
+        _set_scenario_data(whole_scenarios,
+                           _get_all_group_items(network_id, scenario_ids=ids),
+                           all_rs,
+                           _get_dataset_metadata(all_rs))
+
+    for scenario_id, ref_changes in data_changes.items():
+        s = scenarios.get(scenario_id)
+        if s is None:
+            #The scenario itself has been deleted, which has already been reported.
+            continue
+
+        ra_ids = list(set([c.ref_id for c in ref_changes]))
+        all_rs = {}
+        existing_ra_ids = set()
+        for idx in range(0, len(ra_ids), data.qry_in_threshold):
+            ra_id_chunk = ra_ids[idx:idx+data.qry_in_threshold]
+            chunk_rs = _get_all_resourcescenarios(network_id, user_id,
+                                                  scenario_ids=[scenario_id],
+                                                  resource_attr_ids=ra_id_chunk)
+            all_rs.setdefault(scenario_id, []).extend(chunk_rs.get(scenario_id, []))
+
+            #Data hidden from this user is left out, but has not been deleted.
+            existing_qry = DBSession.query(ResourceScenario.resource_attr_id).filter(
+                                ResourceScenario.scenario_id==scenario_id,
+                                ResourceScenario.resource_attr_id.in_(ra_id_chunk))
+            existing_ra_ids.update([r.resource_attr_id for r in existing_qry.all()])
+
+        _set_deleted(ref_changes, existing_ra_ids)
+        _set_scenario_data([s], {}, all_rs, _get_dataset_metadata(all_rs))
+
+    ret.scenarios = scenarios.values()
+    ret.deleted = deleted
+
+    return ret
+
+def _get_stream_chunk_size():
+    return int(config.get('hydra_server', 'stream_chunk_size', 1000))
+
+def _stream_layout(layout):
+    """
+        Convert a stored layout string into a dict, in the same way
+        as the complex models do for outgoing resources.
+    """
+    if layout in (None, ""):
+        return {}
+    try:
+        return dict(eval(layout))
+    except:
+        return {}
+
+def _stream_default(obj):
+    """
+        JSON fallback serialiser for the values which come straight out of
+        the DB (decimal coordinates and datetimes).
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+def _stream_dumps(obj):
+    return json.dumps(obj, default=_stream_default)
+
+def _stream_resource_attr(a):
+    ref_id = None
+    if a.ref_key == 'NETWORK':
+        ref_id = a.network_id
+    elif a.ref_key == 'NODE':
+        ref_id = a.node_id
+    elif a.ref_key == 'LINK':
+        ref_id = a.link_id
+    elif a.ref_key == 'GROUP':
+        ref_id = a.group_id
+
+    return {
+        'id'          : a.resource_attr_id,
+        'attr_id'     : a.attr_id,
+        'attr_name'   : a.attr_name,
+        'attr_dimen'  : a.attr_dimen,
+        'ref_id'      : ref_id,
+        'ref_key'     : a.ref_key,
+        'attr_is_var' : a.attr_is_var,
+        'unit'        : a.unit,
+        'data_type'   : a.data_type,
+        'description' : a.description,
+        'properties'  : json.loads(a.properties) if a.properties else {},
+        'cr_date'     : str(a.cr_date),
+    }
+
+def _stream_type(t):
+    return {
+        'name'          : t.type_name,
+        'id'            : t.type_id,
+        'template_name' : t.template_name,
+        'template_id'   : t.template_id,
+    }
+
+def _stream_node(n, attributes, types):
+    return {
+        'id'          : n.node_id,
+        'name'        : n.node_name,
+        'description' : n.node_description,
+        'layout'      : _stream_layout(n.layout),
+        'x'           : n.node_x,
+        'y'           : n.node_y,
+        'status'      : n.status,
+        'cr_date'     : str(n.cr_date),
+        'attributes'  : attributes,
+        'types'       : types,
+    }
+
+def _stream_link(l, attributes, types):
+    return {
+        'id'          : l.link_id,
+        'name'        : l.link_name,
+        'description' : l.link_description,
+        'layout'      : _stream_layout(l.layout),
+        'node_1_id'   : l.node_1_id,
+        'node_2_id'   : l.node_2_id,
+        'status'      : l.status,
+        'cr_date'     : str(l.cr_date),
+        'attributes'  : attributes,
+        'types'       : types,
+    }
+
+def _stream_group(g, attributes, types):
+    return {
+        'id'          : g.group_id,
+        'network_id'  : g.network_id,
+        'name'        : g.group_name,
+        'description' : g.group_description,
+        'status'      : g.status,
+        'cr_date'     : str(g.cr_date),
+        'attributes'  : attributes,
+        'types'       : types,
+    }
+
+def _stream_group_item(item):
+    ref_id = None
+    if item.ref_key == 'NODE':
+        ref_id = item.node_id
+    elif item.ref_key == 'LINK':
+        ref_id = item.link_id
+    elif item.ref_key == 'GROUP':
+        ref_id = item.subgroup_id
+
+    return {
+        'id'       : item.item_id,
+        'ref_id'   : ref_id,
+        'ref_key'  : item.ref_key,
+        'group_id' : item.group_id,
+        'cr_date'  : str(item.cr_date),
+    }
+
+def _stream_resourcescenario(rs, metadata):
+    value = decode_value(rs.value)
+
+    dataset = {
+        'id'         : rs.dataset_id,
+        'type'       : rs.data_type,
+        'dimension'  : rs.data_dimen,
+        'unit'       : rs.data_units,
+        'name'       : rs.data_name,
+        'value'      : value,
+        'hidden'     : rs.hidden,
+        'created_by' : rs.created_by,
+        'cr_date'    : str(rs.cr_date),
+        'metadata'   : json.dumps(dict([(m.metadata_name, m.metadata_val) for m in metadata])),
+    }
+
+    return {
+        'resource_attr_id' : rs.resource_attr_id,
+        'attr_id'          : rs.attr_id,
+        'dataset_id'       : rs.dataset_id,
+        'value'            : dataset,
+        'source'           : rs.source,
+        'cr_date'          : str(rs.rs_cr_date),
+    }
+
+def _stream_timestamp(ordinal):
+    if ordinal is None:
+        return None
+    return str(ordinal_to_timestamp(Decimal(ordinal)))
+
+def _get_resource_attrs_by_ref(ref_key, ref_ids, template_id=None):
+    """
+        Get the attributes of the given nodes, links or groups, keyed
+        on the ID of the resource. Used to fill in a single chunk of
+        resources when streaming a network.
+    """
+    if len(ref_ids) == 0:
+        return {}
+
+    ref_col = {'NODE':ResourceAttr.node_id,
+               'LINK':ResourceAttr.link_id,
+               'GROUP':ResourceAttr.group_id,
+               'NETWORK':ResourceAttr.network_id}[ref_key]
+
+    attr_qry = DBSession.query(ResourceAttr.resource_attr_id.label('resource_attr_id'),
+                               ResourceAttr.ref_key.label('ref_key'),
+                               ResourceAttr.cr_date.label('cr_date'),
+                               ResourceAttr.attr_is_var.label('attr_is_var'),
+                               ResourceAttr.node_id.label('node_id'),
+                               ResourceAttr.link_id.label('link_id'),
+                               ResourceAttr.group_id.label('group_id'),
+                               ResourceAttr.network_id.label('network_id'),
+                               ResourceAttr.attr_id.label('attr_id'),
+                               ResourceAttr.unit.label('unit'),
+                               ResourceAttr.data_type.label('data_type'),
+                               ResourceAttr.description.label('description'),
+                               ResourceAttr.properties.label('properties'),
+                               Attr.attr_name.label('attr_name'),
+                               Attr.attr_dimen.label('attr_dimen'),
+                              ).filter(Attr.attr_id==ResourceAttr.attr_id,
+                                       ResourceAttr.ref_key==ref_key,
+                                       ref_col.in_(ref_ids))
+
+    if template_id is not None:
+        attr_qry = attr_qry.filter(ResourceType.ref_key==ref_key,
+                                   getattr(ResourceType, ref_col.key)==ref_col,
+                                   TemplateType.type_id==ResourceType.type_id,
+                                   TemplateType.template_id==template_id,
+                                   TypeAttr.type_id==TemplateType.type_id,
+                                   TypeAttr.attr_id==ResourceAttr.attr_id).distinct()
+
+    attr_dict = {}
+    for a in DBSession.execute(attr_qry.statement).fetchall():
+        attr_dict.setdefault(getattr(a, ref_col.key), []).append(_stream_resource_attr(a))
+
+    return attr_dict
+
+def _get_resource_types_by_ref(ref_key, ref_ids, template_id=None):
+    """
+        Get the types of the given nodes, links or groups, keyed
+        on the ID of the resource.
+    """
+    if len(ref_ids) == 0:
+        return {}
+
+    ref_col = {'NODE':ResourceType.node_id,
+               'LINK':ResourceType.link_id,
+               'GROUP':ResourceType.group_id,
+               'NETWORK':ResourceType.network_id}[ref_key]
+
+    type_qry = DBSession.query(
+                               ref_col.label('ref_id'),
+                               Template.template_name.label('template_name'),
+                               Template.template_id.label('template_id'),
+                               TemplateType.type_id.label('type_id'),
+                               TemplateType.type_name.label('type_name'),
+                              ).filter(TemplateType.type_id==ResourceType.type_id,
+                                       Template.template_id==TemplateType.template_id,
+                                       ResourceType.ref_key==ref_key,
+                                       ref_col.in_(ref_ids))
+
+    if template_id is not None:
+        type_qry = type_qry.filter(Template.template_id==template_id)
+
+    type_dict = {}
+    for t in DBSession.execute(type_qry.statement).fetchall():
+        type_dict.setdefault(t.ref_id, []).append(_stream_type(t))
+
+    return type_dict
+
+def _iter_resource_chunks(resource, id_col, network_id, ref_key, template_id, chunk_size):
+    """
+        Page through the active nodes, links or groups of a network in ID order,
+        using the last ID seen rather than an offset so each page costs the same.
+        Yields (rows, attributes, types) for each page.
+    """
+    last_id = None
+    while True:
+        qry = DBSession.query(resource).filter(
+                        resource.network_id==network_id,
+                        resource.status=='A').options(noload('network'))
+
+        if template_id is not None:
+            qry = qry.filter(getattr(ResourceType, id_col.key)==id_col,
+                             TemplateType.type_id==ResourceType.type_id,
+                             TemplateType.template_id==template_id).distinct()
+
+        if last_id is not None:
+            qry = qry.filter(id_col > last_id)
+
+        qry = qry.order_by(id_col).limit(chunk_size)
+
+        rows = DBSession.execute(qry.statement).fetchall()
+        if len(rows) == 0:
+            break
+
+        ids = [getattr(r, id_col.key) for r in rows]
+        attrs = _get_resource_attrs_by_ref(ref_key, ids, template_id)
+        types = _get_resource_types_by_ref(ref_key, ids, template_id)
+
+        yield rows, attrs, types
+
+        if len(rows) < chunk_size:
+            break
+
+        last_id = ids[-1]
+
+def _iter_scenario_group_items(scenario_id, chunk_size):
+    """
+        Page through the resource group items of a single scenario.
+    """
+    last_id = None
+    while True:
+        item_qry = DBSession.query(ResourceGroupItem).filter(
+                        ResourceGroupItem.scenario_id==scenario_id)
+
+        if last_id is not None:
+            item_qry = item_qry.filter(ResourceGroupItem.item_id > last_id)
+
+        item_qry = item_qry.order_by(ResourceGroupItem.item_id).limit(chunk_size)
+
+        rows = DBSession.execute(item_qry.statement).fetchall()
+        if len(rows) == 0:
+            break
+
+        yield rows
+
+        if len(rows) < chunk_size:
+            break
+
+        last_id = rows[-1].item_id
+
+def _iter_scenario_resourcescenarios(scenario_id, user_id, chunk_size):
+    """
+        Page through the resource scenarios of a single scenario, along with the
+        metadata for the datasets in each page. As in get_network, data
+        hidden from the user is left out.
+    """
+    last_id = None
+    while True:
+        rs_qry = DBSession.query(
+                    Dataset.data_type,
+                    Dataset.data_units,
+                    Dataset.data_dimen,
+                    Dataset.data_name,
+                    Dataset.cr_date,
+                    Dataset.created_by,
+                    Dataset.hidden,
+                    Dataset.value,
+                    ResourceScenario.dataset_id,
+                    ResourceScenario.resource_attr_id,
+                    ResourceScenario.source,
+                    ResourceScenario.cr_date.label('rs_cr_date'),
+                    ResourceAttr.attr_id,
+        ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id,
+                                       DatasetOwner.user_id==user_id)).filter(
+                    or_(Dataset.hidden=='N', DatasetOwner.user_id != None),
+                    ResourceAttr.resource_attr_id == ResourceScenario.resource_attr_id,
+                    ResourceScenario.scenario_id==scenario_id,
+                    Dataset.dataset_id==ResourceScenario.dataset_id)
+
+        if last_id is not None:
+            rs_qry = rs_qry.filter(ResourceScenario.resource_attr_id > last_id)
+
+        rs_qry = rs_qry.order_by(ResourceScenario.resource_attr_id).limit(chunk_size)
+
+        rows = DBSession.execute(rs_qry.statement).fetchall()
+        if len(rows) == 0:
+            break
+
+        dataset_ids = list(set([r.dataset_id for r in rows]))
+        metadata = {}
+        for m in DBSession.query(Metadata).filter(Metadata.dataset_id.in_(dataset_ids)).all():
+            metadata.setdefault(m.dataset_id, []).append(m)
+
+        yield rows, metadata
+
+        if len(rows) < chunk_size:
+            break
+
+        last_id = rows[-1].resource_attr_id
+
+def _stream_array(items):
+    """
+        Wrap an iterable of JSON strings in '[' and ']', separating
+        them with commas.
+    """
+    yield '['
+    first = True
+    for item in items:
+        if first is False:
+            yield ','
+        first = False
+        yield item
+    yield ']'
+
+def stream_network(network_id, include_data='N', scenario_ids=None, template_id=None, **kwargs):
+    """
+        Return a generator which produces a network as a series of JSON strings,
+        in the same format as the 'Network' complex model.
+
+        Unlike get_network, the network is never held in memory in its entirety.
+        Nodes, links, groups and resource scenarios are read from the DB in pages of
+        'stream_chunk_size' rows and are written out before the next page is read,
+        so memory use is bounded by the page size rather than the network size.
+
+        The permission check is done before the generator is returned so that
+        an error can be reported to the client before any output is sent.
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        net_i = DBSession.query(Network).filter(
+                                Network.network_id == network_id).options(
+                                noload('scenarios')).options(
+                                noload('nodes')).options(
+                                noload('links')).options(
+                                noload('types')).options(
+                                noload('attributes')).options(
+                                noload('resourcegroups')).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Network (network_id=%s) not found." %
+                                  network_id)
+
+    net_i.check_read_permission(user_id)
+
+    chunk_size = kwargs.get('chunk_size') or _get_stream_chunk_size()
+
+    header = {
+        'project_id'  : net_i.project_id,
+        'id'          : net_i.network_id,
+        'name'        : net_i.network_name,
+        'description' : net_i.network_description if net_i.network_description else '',
+        'created_by'  : net_i.created_by,
+        'cr_date'     : str(net_i.cr_date),
+        'layout'      : _stream_layout(net_i.layout),
+        'status'      : net_i.status,
+        'projection'  : net_i.projection,
+        'owners'      : [{'user_id'      : o.user_id,
+                           'username'     : o.user.username,
+                           'display_name' : o.user.display_name,
+                           'edit'         : o.edit,
+                           'view'         : o.view,
+                           'share'        : o.share} for o in net_i.owners],
+        'attributes'  : _get_resource_attrs_by_ref('NETWORK', [network_id], template_id).get(network_id, []),
+        'types'       : _get_resource_types_by_ref('NETWORK', [network_id], template_id).get(network_id, []),
+    }
+
+    scen_qry = DBSession.query(Scenario).filter(
+                    Scenario.network_id == network_id,
+                    Scenario.status == 'A').options(noload('network'))
+    if scenario_ids:
+        scen_qry = scen_qry.filter(Scenario.scenario_id.in_(scenario_ids))
+    scenarios = DBSession.execute(scen_qry.order_by(Scenario.scenario_id).statement).fetchall()
+
+    def _nodes():
+        for rows, attrs, types in _iter_resource_chunks(Node, Node.node_id, network_id, 'NODE', template_id, chunk_size):
+            for n in rows:
+                yield _stream_dumps(_stream_node(n, attrs.get(n.node_id, []), types.get(n.node_id, [])))
+
+    def _links():
+        for rows, attrs, types in _iter_resource_chunks(Link, Link.link_id, network_id, 'LINK', template_id, chunk_size):
+            for l in rows:
+                yield _stream_dumps(_stream_link(l, attrs.get(l.link_id, []), types.get(l.link_id, [])))
+
+    def _groups():
+        for rows, attrs, types in _iter_resource_chunks(ResourceGroup, ResourceGroup.group_id, network_id, 'GROUP', template_id, chunk_size):
+            for g in rows:
+                yield _stream_dumps(_stream_group(g, attrs.get(g.group_id, []), types.get(g.group_id, [])))
+
+    def _group_items(scenario_id):
+        for rows in _iter_scenario_group_items(scenario_id, chunk_size):
+            for item in rows:
+                yield _stream_dumps(_stream_group_item(item))
+
+    def _resourcescenarios(scenario_id):
+        for rows, metadata in _iter_scenario_resourcescenarios(scenario_id, user_id, chunk_size):
+            for rs in rows:
+                yield _stream_dumps(_stream_resourcescenario(rs, metadata.get(rs.dataset_id, [])))
+
+    def _scenario(s):
+        scenario_header = {
+            'id'          : s.scenario_id,
+            'name'        : s.scenario_name,
+            'description' : s.scenario_description,
+            'network_id'  : s.network_id,
+            'layout'      : _stream_layout(s.layout),
+            'status'      : s.status,
+            'locked'      : s.locked,
+            'start_time'  : _stream_timestamp(s.start_time),
+            'end_time'    : _stream_timestamp(s.end_time),
+            'time_step'   : s.time_step,
+            'created_by'  : s.created_by,
+            'cr_date'     : str(s.cr_date),
+        }
+        yield _stream_dumps(scenario_header)[:-1]
+
+        yield ', "resourcegroupitems": '
+        for chunk in _stream_array(_group_items(s.scenario_id)):
+            yield chunk
+
+        yield ', "resourcescenarios": '
+        if include_data == 'Y':
+            for chunk in _stream_array(_resourcescenarios(s.scenario_id)):
+                yield chunk
+        else:
+            yield '[]'
+        yield '}'
+
+    def _network():
+        #Write the header without its closing brace so the large
+        #lists can be appended to it.
+        yield _stream_dumps(header)[:-1]
+
+        for key, items in (('nodes', _nodes()),
+                           ('links', _links()),
+                           ('resourcegroups', _groups())):
+            yield ', "%s": ' % key
+            for chunk in _stream_array(items):
+                yield chunk
+
+        yield ', "scenarios": ['
+        for i, s in enumerate(scenarios):
+            if i > 0:
+                yield ','
+            for chunk in _scenario(s):
+                yield chunk
+        yield ']}'
+
+    return _network()
 
 def get_network_simple(network_id,**kwargs):
     try:
@@ -1147,6 +2650,210 @@ def network_exists(project_id, network_name,**kwargs):
     except NoResultFound:
         return 'N'
 
+#The model, ID column and name column of each kind of resource
+#updated in bulk by update_network.
+_resource_tables = {
+    'NODE'  : (Node,          'node_id',  'node_name'),
+    'LINK'  : (Link,          'link_id',  'link_name'),
+    'GROUP' : (ResourceGroup, 'group_id', 'group_name'),
+}
+
+def _value_changed(old_val, new_val):
+    """
+        Compare a column value from the DB with an incoming one. Coordinates
+        come back from the DB as Decimals, so numbers are compared as floats.
+    """
+    if old_val is None or new_val is None:
+        return old_val is not new_val
+    if isinstance(old_val, (Decimal, float, int, long)):
+        try:
+            return float(old_val) != float(new_val)
+        except (TypeError, ValueError):
+            return True
+    return old_val != new_val
+
+def _bulk_update_resources(net_i, ref_key, resources, to_row):
+    """
+        Add or update some of the nodes, links or groups of a network.
+        The existing rows are read in one query and compared with the incoming
+        resources, so only those which differ are updated, in a single
+        executemany. New resources are inserted the same way.
+
+        to_row turns an incoming resource into a dict of column values.
+
+        Returns a map from the incoming IDs, including the temporary IDs
+        of new resources, to the real IDs, and the IDs of the resources
+        which were added or changed.
+    """
+    if len(resources) == 0:
+        return {}, set()
+
+    resource, id_key, name_key = _resource_tables[ref_key]
+    table = resource.__table__
+
+    rows = [to_row(r) for r in resources]
+    columns = rows[0].keys()
+
+    existing_qry = DBSession.query(*[getattr(resource, c) for c in [id_key] + columns]).filter(
+                                        resource.network_id==net_i.network_id)
+    existing = dict([(r[id_key], r) for r in DBSession.execute(existing_qry.statement).fetchall()])
+
+    #Check the names all the resources will have after the update at once,
+    #rather than querying for each new resource.
+    names = dict([(ref_id, r[name_key]) for ref_id, r in existing.items()])
+
+    id_map = {}
+    changed_ids = set()
+    updates = []
+    new_rows = []
+    new_resources = []
+    for r, row in izip(resources, rows):
+        if r.id is not None and r.id > 0:
+            current = existing.get(r.id)
+            if current is None:
+                raise ResourceNotFoundError("%s %s not found in network %s"%
+                                            (ref_key.title(), r.id, net_i.network_id))
+            id_map[r.id] = r.id
+            names[r.id] = row[name_key]
+            for c in columns:
+                if _value_changed(current[c], row[c]):
+                    row['b_%s'%(id_key,)] = r.id
+                    updates.append(row)
+                    changed_ids.add(r.id)
+                    break
+        else:
+            row['network_id'] = net_i.network_id
+            new_rows.append(row)
+            new_resources.append(r)
+
+    all_names = names.values() + [row[name_key] for row in new_rows]
+    if len(set(all_names)) != len(all_names):
+        seen = set()
+        for name in all_names:
+            if name in seen:
+                raise HydraError("Duplicate %s Name: %s"%(ref_key.title(), name))
+            seen.add(name)
+
+    if len(updates) > 0:
+        DBSession.execute(table.update().where(
+                            table.c[id_key]==bindparam('b_%s'%(id_key,))), updates)
+
+    if len(new_rows) > 0:
+        DBSession.execute(table.insert(), new_rows)
+        new_ids = _get_resources_by_name(net_i.network_id,
+                                         getattr(resource, name_key),
+                                         getattr(resource, id_key),
+                                         [row[name_key] for row in new_rows])
+        for r, row in izip(new_resources, new_rows):
+            ref_id = getattr(new_ids[row[name_key]], id_key)
+            id_map[r.id] = ref_id
+            changed_ids.add(ref_id)
+
+    log.info("%s %ss updated and %s added", len(updates), ref_key.lower(), len(new_rows))
+
+    return id_map, changed_ids
+
+def _get_by_ref_ids(qry, ref_col, ref_ids):
+    ref_ids = list(ref_ids)
+    rows = []
+    for i in range(0, len(ref_ids), data.qry_in_threshold):
+        chunk_qry = qry.filter(ref_col.in_(ref_ids[i:i+data.qry_in_threshold]))
+        rows.extend(DBSession.execute(chunk_qry.statement).fetchall())
+    return rows
+
+def _bulk_update_resource_attrs(ref_key, resources, id_map):
+    """
+        Add the new attributes of some updated resources, and set attr_is_var
+        on the existing ones which have changed, using the existing attributes
+        of all the resources read in one go.
+
+        Returns the IDs of the resources whose attributes were added to or
+        changed.
+    """
+    ref_id_key = _resource_tables[ref_key][1]
+    ref_col = getattr(ResourceAttr, ref_id_key)
+
+    resources = [r for r in resources if r.attributes is not None and len(r.attributes) > 0]
+    if len(resources) == 0:
+        return set()
+
+    qry = DBSession.query(ResourceAttr.resource_attr_id,
+                          ResourceAttr.attr_id,
+                          ResourceAttr.attr_is_var,
+                          ref_col)
+    existing = _get_by_ref_ids(qry, ref_col, set([id_map[r.id] for r in resources]))
+    existing_by_id   = dict([(ra.resource_attr_id, ra) for ra in existing])
+    existing_by_attr = dict([((ra[ref_id_key], ra.attr_id), ra) for ra in existing])
+
+    changed_ids = set()
+    updates = []
+    new_ras = {}
+    for r in resources:
+        ref_id = id_map[r.id]
+        for ra in r.attributes:
+            if ra.id is not None and ra.id > 0:
+                current = existing_by_id.get(ra.id)
+                if current is None or current[ref_id_key] != ref_id:
+                    raise ResourceNotFoundError("Resource attribute %s not found on %s %s"%
+                                                (ra.id, ref_key.lower(), ref_id))
+                if current.attr_is_var != ra.attr_is_var:
+                    updates.append({'b_resource_attr_id':ra.id, 'attr_is_var':ra.attr_is_var})
+                    changed_ids.add(ref_id)
+            elif (ref_id, ra.attr_id) not in existing_by_attr:
+                new_ras[(ref_id, ra.attr_id)] = {'ref_key'     : ref_key,
+                                                 ref_id_key    : ref_id,
+                                                 'attr_id'     : ra.attr_id,
+                                                 'attr_is_var' : ra.attr_is_var}
+                changed_ids.add(ref_id)
+
+    if len(updates) > 0:
+        table = ResourceAttr.__table__
+        DBSession.execute(table.update().where(
+                            table.c.resource_attr_id==bindparam('b_resource_attr_id')), updates)
+
+    if len(new_ras) > 0:
+        DBSession.execute(ResourceAttr.__table__.insert(), new_ras.values())
+
+    return changed_ids
+
+def _bulk_update_resource_types(ref_key, resources, id_map):
+    """
+        Add the types of some updated resources which they do not already have.
+        Returns the IDs of the resources which were given new types.
+    """
+    ref_id_key = _resource_tables[ref_key][1]
+    ref_col = getattr(ResourceType, ref_id_key)
+
+    resources = [r for r in resources if r.types is not None and len(r.types) > 0]
+    if len(resources) == 0:
+        return set()
+
+    qry = DBSession.query(ResourceType.type_id, ref_col)
+    existing = set([(rt[ref_id_key], rt.type_id) for rt in
+                    _get_by_ref_ids(qry, ref_col, set([id_map[r.id] for r in resources]))])
+
+    new_types = {}
+    for r in resources:
+        ref_id = id_map[r.id]
+        for t in r.types:
+            if (ref_id, t.id) not in existing:
+                new_types[(ref_id, t.id)] = {'ref_key' : ref_key,
+                                             ref_id_key: ref_id,
+                                             'type_id' : t.id}
+
+    if len(new_types) > 0:
+        DBSession.execute(ResourceType.__table__.insert(), new_types.values())
+
+    return set([type_ref_id for type_ref_id, type_id in new_types.keys()])
+
+def _bulk_update_network_resources(net_i, ref_key, resources, to_row):
+    t0 = time.time()
+    id_map, changed_ids = _bulk_update_resources(net_i, ref_key, resources, to_row)
+    changed_ids.update(_bulk_update_resource_attrs(ref_key, resources, id_map))
+    changed_ids.update(_bulk_update_resource_types(ref_key, resources, id_map))
+    log.info("Updating %ss took %s", ref_key.lower(), time.time() - t0)
+    return id_map, changed_ids
+
 def update_network(network,
     update_nodes=True,
     update_links=True,
@@ -1154,7 +2861,10 @@ def update_network(network,
     update_scenarios=True,
     **kwargs):
     """
-        Update an entire network
+        Update an entire network.
+
+        The nodes, links and groups are compared with those already in the
+        network, and only those which have changed are updated.
     """
     log.info("Updating Network %s", network.name)
     user_id = kwargs.get('user_id')
@@ -1165,107 +2875,62 @@ def update_network(network,
     except NoResultFound:
         raise ResourceNotFoundError("Network with id %s not found"%(network.id))
 
+    net_i.check_write_permission(user_id)
+
     net_i.project_id          = network.project_id
     net_i.network_name        = network.name
     net_i.network_description = network.description
     net_i.projection          = network.projection
     net_i.layout              = network.get_layout()
 
-    all_resource_attrs = {}
-    all_resource_attrs.update(_update_attributes(net_i, network.attributes))
+    network_attrs = _update_attributes(net_i, network.attributes)
     add_resource_types(net_i, network.types)
+    DBSession.flush()
 
-    #Maps temporary node_ids to real node_ids
+    #Maps the incoming node IDs, including temporary ones, to real node IDs
     node_id_map = dict()
 
+    #The nodes, links and groups which have been added or changed,
+    #to be recorded in the change log.
+    changed_nodes  = set()
+    changed_links  = set()
+    changed_groups = set()
+
     if network.nodes is not None and update_nodes is True:
         log.info("Updating nodes")
-        t0 = time.time()
-        #First add all the nodes
-        node_id_map = dict([(n.node_id, n) for n in net_i.nodes])
-        for node in network.nodes:
-            #If we get a negative or null node id, we know
-            #it is a new node.
-            if node.id is not None and node.id > 0:
-                n = node_id_map[node.id]
-                n.node_name        = node.name
-                n.node_description = node.description
-                n.node_x           = node.x
-                n.node_y           = node.y
-                n.status           = node.status
-                n.layout           = node.get_layout()
-            else:
-                log.info("Adding new node %s", node.name)
-                n = net_i.add_node(node.name,
-                                   node.description,
-                                   node.get_layout(),
-                                   node.x,
-                                   node.y)
-                net_i.nodes.append(n)
-                node_id_map[n.id] = n
-
-            all_resource_attrs.update(_update_attributes(n, node.attributes))
-            add_resource_types(n, node.types)
-        log.info("Updating nodes took %s", time.time() - t0)
+        node_id_map, changed_nodes = _bulk_update_network_resources(net_i, 'NODE', network.nodes,
+            lambda node: {'node_name'        : node.name,
+                          'node_description' : node.description,
+                          'node_x'           : node.x,
+                          'node_y'           : node.y,
+                          'status'           : node.status,
+                          'layout'           : node.get_layout()})
 
-    link_id_map = dict()
     if network.links is not None and update_links is True:
         log.info("Updating links")
-        t0 = time.time()
-        link_id_map = dict([(l.link_id, l) for l in net_i.links])
-        for link in network.links:
-            node_1 = node_id_map[link.node_1_id]
-
-            node_2 = node_id_map[link.node_2_id]
-
-            if link.id is None or link.id < 0:
-                log.info("Adding new link %s", link.name)
-                l = net_i.add_link(link.name,
-                                   link.description,
-                                   link.get_layout(),
-                                   node_1,
-                                   node_2)
-                net_i.links.append(l)
-                link_id_map[link.id] = l
-            else:
-                l = link_id_map[link.id]
-                l.link_name       = link.name
-                l.link_descripion = link.description
-                l.node_a          = node_1
-                l.node_b          = node_2
-                l.layout          = link.get_layout()
-
+        network_node_ids = set([n.node_id for n in DBSession.query(Node.node_id).filter(
+                                                    Node.network_id==net_i.network_id).all()])
+
+        def _link_node_id(node_id):
+            real_node_id = node_id_map.get(node_id, node_id)
+            if real_node_id not in network_node_ids:
+                raise HydraError("Node %s is not in network %s"%(node_id, net_i.network_id))
+            return real_node_id
+
+        link_id_map, changed_links = _bulk_update_network_resources(net_i, 'LINK', network.links,
+            lambda link: {'link_name'        : link.name,
+                          'link_description' : link.description,
+                          'node_1_id'        : _link_node_id(link.node_1_id),
+                          'node_2_id'        : _link_node_id(link.node_2_id),
+                          'layout'           : link.get_layout()})
 
-            all_resource_attrs.update(_update_attributes(l, link.attributes))
-            add_resource_types(l, link.types)
-        log.info("Updating links took %s", time.time() - t0)
-
-    group_id_map = dict()
     #Next all the groups
     if network.resourcegroups is not None and update_groups is True:
         log.info("Updating groups")
-        t0 = time.time()
-        group_id_map = dict([(g.group_id, g) for g in net_i.resourcegroups])
-        for group in network.resourcegroups:
-            #If we get a negative or null group id, we know
-            #it is a new group.
-            if group.id is not None and group.id > 0:
-                g_i = group_id_map[group.id]
-                g_i.group_name        = group.name
-                g_i.group_description = group.description
-                g_i.status           = group.status
-            else:
-                log.info("Adding new group %s", link.name)
-                g_i = net_i.add_group(group.name,
-                                   group.description,
-                                   group.status)
-                net_i.resourcegroups.append(net_i)
-                group_id_map[g_i.group_id] = g_i
-
-            all_resource_attrs.update(_update_attributes(g_i, group.attributes))
-            add_resource_types(g_i, group.types)
-            group_id_map[group.id] = g_i
-        log.info("Updating groups took %s", time.time() - t0)
+        group_id_map, changed_groups = _bulk_update_network_resources(net_i, 'GROUP', network.resourcegroups,
+            lambda group: {'group_name'        : group.name,
+                           'group_description' : group.description,
+                           'status'            : group.status})
 
     errors = []
     if network.scenarios is not None and update_scenarios is True:
@@ -1291,11 +2956,215 @@ def update_network(network,
                 log.info("Adding new scenario %s to network", s.name)
                 scenario.add_scenario(network.id, s, **kwargs)
 
+    bump_network_version(network.id)
+
     DBSession.flush()
 
-    updated_net = get_network(network.id, summary=True, **kwargs)
+    record_changes(network.id, 'NODE', changed_nodes)
+    record_changes(network.id, 'LINK', changed_links)
+    record_changes(network.id, 'GROUP', changed_groups)
+    record_changes(network.id, 'RESOURCEATTR', [ra.resource_attr_id for ra in network_attrs.values()])
+
+    updated_net = get_network(network.id, summary=True, parallel=False, **kwargs)
     return updated_net
 
+def _clone_id_map(resource, id_col, name_col, network_id, new_network_id):
+    """
+        A query mapping the IDs of the nodes, links, groups or scenarios in a
+        network to those of their copies in a cloned network, matched by name,
+        which is unique within a network.
+    """
+    old = aliased(resource)
+    new = aliased(resource)
+    return DBSession.query(getattr(old, id_col).label('old_id'),
+                           getattr(new, id_col).label('new_id')).filter(
+                               old.network_id==network_id,
+                               new.network_id==new_network_id,
+                               getattr(new, name_col)==getattr(old, name_col))
+
+def _clone_rows(model, columns, qry):
+    """
+        Copy rows with a single INSERT ... SELECT.
+        qry must select values for the columns in the order they are listed.
+    """
+    DBSession.execute(model.__table__.insert().from_select(columns, qry.statement))
+
+def clone_network(network_id, new_name=None, scenario_ids=None, **kwargs):
+    """
+        Make a copy of a network in the same project, including its nodes,
+        links, groups, attributes, types and scenarios.
+
+        The copy is made in the database, a table at a time, so nothing is
+        read into the server. The copied scenarios refer to the same datasets
+        as the originals, so no data is copied.
+
+        If scenario_ids is specified, only those scenarios are copied.
+        Returns the new network.
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        net_i = DBSession.query(Network).filter(Network.network_id == network_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
+
+    net_i.check_read_permission(user_id)
+    net_i.project.check_write_permission(user_id)
+
+    if new_name is None:
+        new_name = "%s (clone)"%(net_i.network_name,)
+
+    existing_net = DBSession.query(Network.network_id).filter(
+                            Network.project_id == net_i.project_id,
+                            Network.network_name == new_name).first()
+    if existing_net is not None:
+        raise HydraError("A network with the name %s is already in project %s"%(new_name, net_i.project_id))
+
+    new_net_i = Network()
+    new_net_i.project_id          = net_i.project_id
+    new_net_i.network_name        = new_name
+    new_net_i.network_description = net_i.network_description
+    new_net_i.layout              = net_i.layout
+    new_net_i.projection          = net_i.projection
+    new_net_i.status              = net_i.status
+    new_net_i.created_by          = user_id
+    DBSession.add(new_net_i)
+    DBSession.flush()
+    new_net_i.set_owner(user_id)
+
+    new_network_id = new_net_i.network_id
+
+    start_time = datetime.datetime.now()
+
+    _clone_rows(Node,
+                ['network_id', 'node_name', 'node_description', 'status', 'node_x', 'node_y', 'layout'],
+                DBSession.query(literal(new_network_id), Node.node_name, Node.node_description,
+                                Node.status, Node.node_x, Node.node_y, Node.layout).filter(
+                                    Node.network_id==network_id))
+
+    node_map = _clone_id_map(Node, 'node_id', 'node_name', network_id, new_network_id)
+    node_1_map = node_map.subquery()
+    node_2_map = node_map.subquery()
+
+    _clone_rows(Link,
+                ['network_id', 'link_name', 'link_description', 'status', 'layout', 'node_1_id', 'node_2_id'],
+                DBSession.query(literal(new_network_id), Link.link_name, Link.link_description,
+                                Link.status, Link.layout, node_1_map.c.new_id, node_2_map.c.new_id).filter(
+                                    Link.network_id==network_id,
+                                    node_1_map.c.old_id==Link.node_1_id,
+                                    node_2_map.c.old_id==Link.node_2_id))
+
+    _clone_rows(ResourceGroup,
+                ['network_id', 'group_name', 'group_description', 'status'],
+                DBSession.query(literal(new_network_id), ResourceGroup.group_name,
+                                ResourceGroup.group_description, ResourceGroup.status).filter(
+                                    ResourceGroup.network_id==network_id))
+
+    log.info("Resources cloned in %s", get_timing(start_time))
+
+    #The maps from the original nodes, links and groups to their copies.
+    #The network itself maps to the new network.
+    id_maps = {
+        'NODE'  : ('node_id', node_map),
+        'LINK'  : ('link_id', _clone_id_map(Link, 'link_id', 'link_name', network_id, new_network_id)),
+        'GROUP' : ('group_id', _clone_id_map(ResourceGroup, 'group_id', 'group_name', network_id, new_network_id)),
+    }
+
+    ra_cols = ['attr_id', 'attr_is_var', 'unit', 'data_type', 'description', 'properties']
+    for ref_key in ('NETWORK', 'NODE', 'LINK', 'GROUP'):
+        if ref_key == 'NETWORK':
+            ref_col = 'network_id'
+            new_ref_id = literal(new_network_id)
+            ra_qry = DBSession.query(ResourceAttr).filter(ResourceAttr.network_id==network_id)
+            rt_qry = DBSession.query(ResourceType).filter(ResourceType.network_id==network_id)
+        else:
+            ref_col, id_map = id_maps[ref_key]
+            id_map = id_map.subquery()
+            new_ref_id = id_map.c.new_id
+            ra_qry = DBSession.query(ResourceAttr).filter(
+                            getattr(ResourceAttr, ref_col)==id_map.c.old_id)
+            rt_qry = DBSession.query(ResourceType).filter(
+                            getattr(ResourceType, ref_col)==id_map.c.old_id)
+
+        _clone_rows(ResourceAttr,
+                    ['ref_key', ref_col] + ra_cols,
+                    ra_qry.with_entities(literal(ref_key), new_ref_id,
+                                         *[getattr(ResourceAttr, c) for c in ra_cols]).filter(
+                                             ResourceAttr.ref_key==ref_key))
+
+        _clone_rows(ResourceType,
+                    ['ref_key', ref_col, 'type_id'],
+                    rt_qry.with_entities(literal(ref_key), new_ref_id, ResourceType.type_id).filter(
+                                             ResourceType.ref_key==ref_key))
+
+    log.info("Attributes and types cloned in %s", get_timing(start_time))
+
+    scenario_qry = DBSession.query(literal(new_network_id),
+                                   Scenario.scenario_name,
+                                   Scenario.scenario_description,
+                                   Scenario.layout,
+                                   Scenario.status,
+                                   Scenario.start_time,
+                                   Scenario.end_time,
+                                   Scenario.time_step,
+                                   literal(user_id)).filter(Scenario.network_id==network_id)
+    if scenario_ids:
+        scenario_qry = scenario_qry.filter(Scenario.scenario_id.in_(scenario_ids))
+
+    _clone_rows(Scenario,
+                ['network_id', 'scenario_name', 'scenario_description', 'layout', 'status',
+                 'start_time', 'end_time', 'time_step', 'created_by'],
+                scenario_qry)
+
+    scenario_map = _clone_id_map(Scenario, 'scenario_id', 'scenario_name', network_id, new_network_id).subquery()
+
+    #Each resource scenario is copied to the copy of its scenario and the
+    #resource attribute with the same attribute on the copy of its resource.
+    old_ra = aliased(ResourceAttr)
+    new_ra = aliased(ResourceAttr)
+    for ref_key in ('NETWORK', 'NODE', 'LINK', 'GROUP'):
+        rs_qry = DBSession.query(scenario_map.c.new_id,
+                                 new_ra.resource_attr_id,
+                                 ResourceScenario.dataset_id,
+                                 ResourceScenario.source).filter(
+                                     ResourceScenario.scenario_id==scenario_map.c.old_id,
+                                     old_ra.resource_attr_id==ResourceScenario.resource_attr_id,
+                                     old_ra.ref_key==ref_key,
+                                     new_ra.ref_key==ref_key,
+                                     new_ra.attr_id==old_ra.attr_id)
+        if ref_key == 'NETWORK':
+            rs_qry = rs_qry.filter(old_ra.network_id==network_id,
+                                   new_ra.network_id==new_network_id)
+        else:
+            ref_col, id_map = id_maps[ref_key]
+            id_map = id_map.subquery()
+            rs_qry = rs_qry.filter(getattr(old_ra, ref_col)==id_map.c.old_id,
+                                   getattr(new_ra, ref_col)==id_map.c.new_id)
+
+        _clone_rows(ResourceScenario,
+                    ['scenario_id', 'resource_attr_id', 'dataset_id', 'source'],
+                    rs_qry)
+
+    group_map = id_maps['GROUP'][1].subquery()
+    for ref_key, item_col in (('NODE', 'node_id'), ('LINK', 'link_id'), ('GROUP', 'subgroup_id')):
+        id_map = id_maps[ref_key][1].subquery()
+        _clone_rows(ResourceGroupItem,
+                    ['scenario_id', 'group_id', 'ref_key', item_col],
+                    DBSession.query(scenario_map.c.new_id,
+                                    group_map.c.new_id,
+                                    literal(ref_key),
+                                    id_map.c.new_id).filter(
+                                        ResourceGroupItem.scenario_id==scenario_map.c.old_id,
+                                        ResourceGroupItem.ref_key==ref_key,
+                                        ResourceGroupItem.group_id==group_map.c.old_id,
+                                        getattr(ResourceGroupItem, item_col)==id_map.c.old_id))
+
+    log.info("Network %s cloned to %s in %s", network_id, new_network_id, get_timing(start_time))
+
+    DBSession.flush()
+
+    return new_net_i
+
 def set_network_status(network_id,status,**kwargs):
     """
     Activates a network by setting its status attribute to 'A'.
@@ -1306,6 +3175,7 @@ def set_network_status(network_id,status,**kwargs):
         net_i = DBSession.query(Network).filter(Network.network_id == network_id).one()
         net_i.check_write_permission(user_id)
         net_i.status = status
+        bump_network_version(network_id)
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
     DBSession.flush()
@@ -1321,34 +3191,112 @@ def get_network_extents(network_id,**kwargs):
 
     @returns NetworkExtents object
     """
-    rs = DBSession.query(Node.node_x, Node.node_y).filter(Node.network_id==network_id).all()
-    if len(rs) == 0:
-        return dict(
-            network_id = network_id,
-            min_x = None,
-            max_x = None,
-            min_y = None,
-            max_y = None,
-        )
-
-    x_values = []
-    y_values = []
-    for r in rs:
-        x_values.append(r.node_x)
-        y_values.append(r.node_y)
-
-    x_values.sort()
-    y_values.sort()
+    #Answered from idx_node_network_xy, without reading the nodes themselves.
+    extents = DBSession.query(func.min(Node.node_x).label('min_x'),
+                              func.max(Node.node_x).label('max_x'),
+                              func.min(Node.node_y).label('min_y'),
+                              func.max(Node.node_y).label('max_y')).filter(
+                                  Node.network_id==network_id).one()
 
     ne = dict(
         network_id = network_id,
-        min_x = x_values[0],
-        max_x = x_values[-1],
-        min_y = y_values[0],
-        max_y = y_values[-1],
+        min_x = extents.min_x,
+        max_x = extents.max_x,
+        min_y = extents.min_y,
+        max_y = extents.max_y,
     )
     return ne
 
+def _get_type_records(ref_key, ref_ids):
+    """
+        Get the types of the given nodes or links, keyed on the ID
+        of the resource.
+    """
+    ref_col = {'NODE':ResourceType.node_id,
+               'LINK':ResourceType.link_id}[ref_key]
+
+    type_qry = DBSession.query(
+                               ResourceType.ref_key.label('ref_key'),
+                               ResourceType.node_id.label('node_id'),
+                               ResourceType.link_id.label('link_id'),
+                               ResourceType.group_id.label('group_id'),
+                               ResourceType.network_id.label('network_id'),
+                               Template.template_name.label('template_name'),
+                               Template.template_id.label('template_id'),
+                               TemplateType.type_id.label('type_id'),
+                               TemplateType.layout.label('layout'),
+                               TemplateType.type_name.label('type_name'),
+                              ).filter(TemplateType.type_id==ResourceType.type_id,
+                                       Template.template_id==TemplateType.template_id)
+
+    type_dict = {}
+    for idx in range(0, len(ref_ids), data.qry_in_threshold):
+        id_chunk = ref_ids[idx:idx+data.qry_in_threshold]
+        rows = DBSession.execute(type_qry.filter(ref_col.in_(id_chunk)).statement).fetchall()
+        for t in _rows_to_records(ResourceTypeRecord, rows):
+            type_dict.setdefault(getattr(t, ref_col.key), []).append(t)
+
+    return type_dict
+
+def get_resources_in_bbox(network_id, min_x, min_y, max_x, max_y, **kwargs):
+    """
+        Get the nodes of a network which lie within a bounding box, and
+        the links which connect to them, so a map can load only the part
+        of a large network which is in view. The nodes and links contain
+        their types but not their attributes.
+
+        Returns an object containing network_id, nodes and links.
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        net_i = DBSession.query(Network).filter(Network.network_id == network_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
+
+    net_i.check_read_permission(user_id)
+
+    if min_x > max_x or min_y > max_y:
+        raise HydraError("Invalid bounding box. The minimum x and y must be"
+                         " less than the maximum x and y.")
+
+    #Uses idx_node_network_xy
+    in_bbox = and_(Node.network_id==network_id,
+                   Node.node_x >= min_x,
+                   Node.node_x <= max_x,
+                   Node.node_y >= min_y,
+                   Node.node_y <= max_y,
+                   Node.status=='A')
+
+    node_qry = DBSession.query(Node).filter(in_bbox).options(noload('network'))
+    nodes = _rows_to_records(NodeRecord, DBSession.execute(node_qry.statement).fetchall())
+
+    #The links from the nodes and to the nodes are queried separately,
+    #rather than with an OR, so each can use the index on its node column.
+    links = {}
+    for node_col in (Link.node_1_id, Link.node_2_id):
+        link_qry = DBSession.query(Link).join(Node, Node.node_id==node_col).filter(
+                                        in_bbox, Link.status=='A').options(noload('network'))
+        for l in _rows_to_records(LinkRecord, DBSession.execute(link_qry.statement).fetchall()):
+            links[l.link_id] = l
+    links = links.values()
+
+    node_types = _get_type_records('NODE', [n.node_id for n in nodes])
+    for n in nodes:
+        n.types = node_types.get(n.node_id, [])
+
+    link_types = _get_type_records('LINK', [l.link_id for l in links])
+    for l in links:
+        l.types = link_types.get(l.link_id, [])
+
+    log.info("%s nodes and %s links found in bounding box", len(nodes), len(links))
+
+    return dictobj({
+        'network_id' : network_id,
+        'nodes'      : nodes,
+        'links'      : links,
+    })
+
 #########################################
 def add_nodes(network_id, nodes,**kwargs):
     """
@@ -1388,6 +3336,8 @@ def add_nodes(network_id, nodes,**kwargs):
 
     node_attrs, defaults = _bulk_add_resource_attrs(network_id, 'NODE', nodes, iface_nodes)
 
+    record_changes(network_id, 'NODE', [n.node_id for n in node_id_map.values()], 'INSERT')
+
     log.info("Nodes added in %s", get_timing(start_time))
     return node_s
 
@@ -1421,6 +3371,7 @@ def add_links(network_id, links,**kwargs):
     for l_i in link_s:
         iface_links[l_i.link_name] = l_i
     link_attrs, defaults = _bulk_add_resource_attrs(net_i.network_id, 'LINK', links, iface_links)
+    record_changes(network_id, 'LINK', [iface_links[l.name].link_id for l in links], 'INSERT')
     log.info("Nodes added in %s", get_timing(start_time))
     return link_s
 #########################################
@@ -1476,6 +3427,8 @@ def add_node(network_id, node,**kwargs):
                 DBSession.execute(ResourceScenario.__table__.insert(), all_rs)
 
 
+    record_changes(network_id, 'NODE', new_node.node_id, 'INSERT')
+
     DBSession.refresh(new_node)
 
     return new_node
@@ -1495,6 +3448,7 @@ def update_node(node,**kwargs):
         raise ResourceNotFoundError("Node %s not found"%(node.id))
 
     node_i.network.check_write_permission(user_id)
+    record_changes(node_i.network_id, 'NODE', node_i.node_id)
 
     node_i.node_name = node.name if node.name != None else node_i.node_name
     node_i.node_x    = node.x if node.x is not None else node_i.node_x
@@ -1522,7 +3476,6 @@ def set_node_status(node_id, status, **kwargs):
         raise ResourceNotFoundError("Node %s not found"%(node_id))
 
     node_i.network.check_write_permission(user_id)
-
     node_i.status = status
 
     for link in node_i.links_to:
@@ -1530,6 +3483,10 @@ def set_node_status(node_id, status, **kwargs):
     for link in node_i.links_from:
         link.status = status
 
+    record_changes(node_i.network_id, 'NODE', node_i.node_id)
+    record_changes(node_i.network_id, 'LINK',
+                   [l.link_id for l in node_i.links_to] + [l.link_id for l in node_i.links_from])
+
     DBSession.flush()
 
     return node_i
@@ -1556,6 +3513,92 @@ def _unique_data_qry(count=1):
     return unique_data
 
 
+def _get_ids(qry):
+    return [r[0] for r in DBSession.execute(qry.statement).fetchall()]
+
+def _delete_in(model, col_name, ids):
+    """
+        Delete the rows of a table whose col_name is one of ids,
+        in chunks, without loading them into the session.
+    """
+    tbl = model.__table__
+    col = tbl.c[col_name]
+    ids = list(ids)
+    for i in range(0, len(ids), data.qry_in_threshold):
+        DBSession.execute(tbl.delete().where(col.in_(ids[i:i+data.qry_in_threshold])))
+
+def _purge_resources(network_id, node_ids, link_ids, group_ids, scenario_ids,
+                     include_network=False, purge_data='N', progress=None):
+    """
+        Delete nodes, links, groups and scenarios from a network, and
+        everything which refers to them, with bulk DELETE statements,
+        children before parents. The deleted rows are never loaded into
+        the session, so this must not be mixed with ORM changes to the
+        same resources.
+
+        If include_network is True, the attributes, types, rules and notes
+        of the network itself are deleted too (but not the network).
+
+        If purge_data is 'Y', any datasets which are left unused
+        once the resources have gone are deleted.
+    """
+    ra_qry = DBSession.query(ResourceAttr.resource_attr_id)
+    ra_ids = []
+    if include_network:
+        ra_ids.extend(_get_ids(ra_qry.filter(ResourceAttr.network_id==network_id)))
+    for ref_col, ref_ids in ((ResourceAttr.node_id, node_ids),
+                             (ResourceAttr.link_id, link_ids),
+                             (ResourceAttr.group_id, group_ids)):
+        ra_ids.extend([r[0] for r in _get_by_ref_ids(ra_qry, ref_col, ref_ids)])
+
+    dataset_ids = set()
+    if purge_data == 'Y':
+        rs_qry = DBSession.query(ResourceScenario.dataset_id).distinct()
+        for ref_col, ref_ids in ((ResourceScenario.resource_attr_id, ra_ids),
+                                 (ResourceScenario.scenario_id, scenario_ids)):
+            dataset_ids.update([r[0] for r in _get_by_ref_ids(rs_qry, ref_col, ref_ids)])
+
+    log.info("Deleting %s resource attributes from network %s", len(ra_ids), network_id)
+
+    _delete_in(ResourceScenario, 'scenario_id', scenario_ids)
+    _delete_in(ResourceScenario, 'resource_attr_id', ra_ids)
+    _report_progress(progress, 30, "Resource scenarios deleted")
+
+    _delete_in(ResourceAttrMap, 'resource_attr_id_a', ra_ids)
+    _delete_in(ResourceAttrMap, 'resource_attr_id_b', ra_ids)
+    _delete_in(ResourceAttr, 'resource_attr_id', ra_ids)
+    _report_progress(progress, 50, "Resource attributes deleted")
+
+    ref_ids = [('node_id', node_ids), ('link_id', link_ids), ('group_id', group_ids)]
+    if include_network:
+        ref_ids.append(('network_id', [network_id]))
+
+    for col_name, ids in ref_ids:
+        _delete_in(ResourceType, col_name, ids)
+        _delete_in(Rule, col_name, ids)
+        _delete_in(Note, col_name, ids)
+
+    for col_name, ids in (('scenario_id', scenario_ids),
+                          ('node_id', node_ids),
+                          ('link_id', link_ids),
+                          ('subgroup_id', group_ids),
+                          ('group_id', group_ids)):
+        _delete_in(ResourceGroupItem, col_name, ids)
+
+    _delete_in(Rule, 'scenario_id', scenario_ids)
+    _delete_in(Note, 'scenario_id', scenario_ids)
+    _report_progress(progress, 60, "Types, group items, rules and notes deleted")
+
+    _delete_in(Link, 'link_id', link_ids)
+    _delete_in(Node, 'node_id', node_ids)
+    _delete_in(ResourceGroup, 'group_id', group_ids)
+    _delete_in(Scenario, 'scenario_id', scenario_ids)
+    _report_progress(progress, 80, "Resources deleted")
+
+    if len(dataset_ids) > 0:
+        data._delete_orphan_datasets(dataset_ids)
+        _report_progress(progress, 90, "Unused data deleted")
+
 def purge_network(network_id, purge_data,**kwargs):
     """
         Remove a network from DB completely
@@ -1564,6 +3607,7 @@ def purge_network(network_id, purge_data,**kwargs):
 
     """
     user_id = kwargs.get('user_id')
+    progress = kwargs.get('progress')
     try:
         net_i = DBSession.query(Network).filter(Network.network_id == network_id).one()
     except NoResultFound:
@@ -1572,7 +3616,24 @@ def purge_network(network_id, purge_data,**kwargs):
     log.info("Deleting network %s, id=%s", net_i.network_name, network_id)
 
     net_i.check_write_permission(user_id)
-    DBSession.delete(net_i)
+
+    _purge_resources(network_id,
+                     _get_ids(DBSession.query(Node.node_id).filter(Node.network_id==network_id)),
+                     _get_ids(DBSession.query(Link.link_id).filter(Link.network_id==network_id)),
+                     _get_ids(DBSession.query(ResourceGroup.group_id).filter(ResourceGroup.network_id==network_id)),
+                     _get_ids(DBSession.query(Scenario.scenario_id).filter(Scenario.network_id==network_id)),
+                     include_network=True,
+                     purge_data=purge_data,
+                     progress=progress)
+
+    delete_changes(network_id)
+    _delete_in(ResourceAttrMap, 'network_a_id', [network_id])
+    _delete_in(ResourceAttrMap, 'network_b_id', [network_id])
+    _delete_in(NetworkOwner, 'network_id', [network_id])
+    _delete_in(Network, 'network_id', [network_id])
+    DBSession.expunge(net_i)
+
+    bump_network_version(network_id)
     DBSession.flush()
     return 'OK'
 
@@ -1615,6 +3676,10 @@ def delete_node(node_id, purge_data,**kwargs):
     log.info("Deleting node %s, id=%s", node_i.node_name, node_id)
 
     node_i.network.check_write_permission(user_id)
+    record_changes(node_i.network_id, 'NODE', node_id, 'DELETE')
+    record_changes(node_i.network_id, 'LINK',
+                   [l.link_id for l in node_i.links_to] + [l.link_id for l in node_i.links_from],
+                   'DELETE')
     DBSession.delete(node_i)
     DBSession.flush()
     return 'OK'
@@ -1674,6 +3739,8 @@ def add_link(network_id, link,**kwargs):
             if len(all_rs) > 0:
                 DBSession.execute(ResourceScenario.__table__.insert(), all_rs)
 
+    record_changes(network_id, 'LINK', link_i.link_id, 'INSERT')
+
     DBSession.refresh(link_i)
 
     return link_i
@@ -1690,6 +3757,8 @@ def update_link(link,**kwargs):
     except NoResultFound:
         raise ResourceNotFoundError("Link %s not found"%(link.id))
 
+    record_changes(link_i.network_id, 'LINK', link_i.link_id)
+
     link_i.link_name = link.name
     link_i.node_1_id = link.node_1_id
     link_i.node_2_id = link.node_2_id
@@ -1713,6 +3782,7 @@ def set_link_status(link_id, status, **kwargs):
         raise ResourceNotFoundError("Link %s not found"%(link_id))
 
     link_i.network.check_write_permission(user_id)
+    record_changes(link_i.network_id, 'LINK', link_i.link_id)
 
     link_i.status = status
     DBSession.flush()
@@ -1756,6 +3826,7 @@ def delete_link(link_id, purge_data,**kwargs):
     log.info("Deleting link %s, id=%s", link_i.link_name, link_id)
 
     link_i.network.check_write_permission(user_id)
+    record_changes(link_i.network_id, 'LINK', link_id, 'DELETE')
     DBSession.delete(link_i)
     DBSession.flush()
 
@@ -1806,6 +3877,8 @@ def add_group(network_id, group,**kwargs):
                 DBSession.execute(ResourceScenario.__table__.insert(), all_rs)
 
 
+    record_changes(network_id, 'GROUP', res_grp_i.group_id, 'INSERT')
+
     DBSession.refresh(res_grp_i)
 
     return res_grp_i
@@ -1823,6 +3896,7 @@ def update_group(group,**kwargs):
         raise ResourceNotFoundError("group %s not found"%(group.id))
 
     group_i.network.check_write_permission(user_id)
+    record_changes(group_i.network_id, 'GROUP', group_i.group_id)
 
     group_i.group_name = group.name if group.name != None else group_i.group_name
     group_i.group_description = group.description if group.description else group_i.group_description
@@ -1848,6 +3922,7 @@ def set_group_status(group_id, status, **kwargs):
         raise ResourceNotFoundError("ResourceGroup %s not found"%(group_id))
 
     group_i.network.check_write_permission(user_id)
+    record_changes(group_i.network_id, 'GROUP', group_i.group_id)
 
     group_i.status = status
 
@@ -1894,6 +3969,7 @@ def delete_group(group_id, purge_data,**kwargs):
     log.info("Deleting group %s, id=%s", group_i.group_name, group_id)
 
     group_i.network.check_write_permission(user_id)
+    record_changes(group_i.network_id, 'GROUP', group_id, 'DELETE')
     DBSession.delete(group_i)
     DBSession.flush()
 
@@ -1958,39 +4034,46 @@ def get_resources_of_type(network_id, type_id, **kwargs):
 
     return nodes_with_type, links_with_type, networks_with_type, groups_with_type
 
-def clean_up_network(network_id, **kwargs):
+def clean_up_network(network_id, purge_data='N', **kwargs):
     """
-        Purge any deleted nodes, links, resourcegroups and scenarios in a given network
+        Purge any deleted nodes, links, resourcegroups and scenarios in a given network.
+        Links to deleted nodes are purged along with them.
+        Use purge_data to delete any data which is left unused once they have gone.
     """
     user_id = kwargs.get('user_id')
     #check_perm(user_id, 'delete_network')
     try:
         log.debug("Querying Network %s", network_id)
-        net_i = DBSession.query(Network).filter(Network.network_id == network_id).\
-        options(noload('scenarios')).options(noload('nodes')).options(noload('links')).options(noload('resourcegroups')).options(joinedload_all('types.templatetype.template')).one()
-        net_i.attributes
+        net_i = DBSession.query(Network).filter(Network.network_id == network_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
 
-        #Define the basic resource queries
-        node_qry = DBSession.query(Node).filter(Node.network_id==network_id).filter(Node.status=='X').all()
+    net_i.check_write_permission(user_id)
 
-        link_qry = DBSession.query(Link).filter(Link.network_id==network_id).filter(Link.status=='X').all()
+    deleted_node_qry = DBSession.query(Node.node_id).filter(Node.network_id==network_id,
+                                                            Node.status=='X')
 
-        group_qry = DBSession.query(ResourceGroup).filter(ResourceGroup.network_id==network_id).filter(ResourceGroup.status=='X').all()
+    link_qry = DBSession.query(Link.link_id).filter(Link.network_id==network_id).filter(
+                                    or_(Link.status=='X',
+                                        Link.node_1_id.in_(deleted_node_qry.subquery()),
+                                        Link.node_2_id.in_(deleted_node_qry.subquery())))
 
-        scenario_qry = DBSession.query(Scenario).filter(Scenario.network_id==network_id).filter(Scenario.status=='X').all()
+    group_qry = DBSession.query(ResourceGroup.group_id).filter(ResourceGroup.network_id==network_id,
+                                                               ResourceGroup.status=='X')
 
+    scenario_qry = DBSession.query(Scenario.scenario_id).filter(Scenario.network_id==network_id,
+                                                                Scenario.status=='X')
 
-        for n in node_qry:
-            DBSession.delete(n)
-        for l in link_qry:
-            DBSession.delete(l)
-        for g in group_qry:
-            DBSession.delete(g)
-        for s in scenario_qry:
-            DBSession.delete(s)
+    _purge_resources(network_id,
+                     _get_ids(deleted_node_qry),
+                     _get_ids(link_qry),
+                     _get_ids(group_qry),
+                     _get_ids(scenario_qry),
+                     purge_data=purge_data,
+                     progress=kwargs.get('progress'))
+
+    bump_network_version(network_id)
 
-    except NoResultFound:
-        raise ResourceNotFoundError("Network %s not found"%(network_id))
     DBSession.flush()
     return 'OK'
 
@@ -2011,7 +4094,8 @@ def get_attributes_for_resource(network_id, scenario_id, ref_key, ref_ids=None,
                             ResourceScenario.scenario_id==scenario_id,
                             ResourceAttr.ref_key==ref_key)\
             .join(ResourceScenario.dataset)\
-            .options(noload('dataset.metadata'))
+            .options(noload('dataset.metadata'))\
+            .options(undefer('dataset.value'))
 
     log.info("Querying %s data",ref_key)
     if ref_ids is not None and len(ref_ids) < 999:
@@ -9,6 +9,7 @@ from datetime import datetime
 from HydraLib.HydraException import HydraError
 
 from HydraServer.util import generate_data_hash
+from HydraServer.util.dataformat import encode_timeseries
 from HydraLib import config
 import zlib
 import pandas as pd
@@ -132,6 +133,48 @@ class ResourceScenario(JSONObject):
                 setattr(self, k, Dataset(v))
 
 
+def parse_dataset_value(data_type, value, metadata):
+    """
+        Turn the value of an incoming JSON dataset into a hydra-friendly value.
+        Unlike HydraServer.util.dataformat.parse_value, blank values and
+        'null' in any case are taken to be NULL.
+    """
+    if value is None:
+        log.warn("Cannot parse dataset. No value specified.")
+        return None
+
+    data = str(value)
+
+    if data.upper().strip() == 'NULL':
+        return 'NULL'
+
+    if data.strip() == '':
+        return "NULL"
+
+    if len(data) > 100:
+        log.debug("Parsing %s", data[0:100])
+    else:
+        log.debug("Parsing %s", data)
+
+    if data_type == 'descriptor':
+        #Hack to work with hashtables. REMOVE AFTER DEMO
+        if metadata.get('data_type') == 'hashtable':
+            df = pd.read_json(data)
+            data = df.transpose().to_json() 
+        return data
+    elif data_type == 'scalar':
+        return data
+    elif data_type == 'timeseries':
+        timeseries_pd = pd.read_json(data)
+        return encode_timeseries(timeseries_pd)
+    elif data_type == 'array':
+        #check to make sure this is valid json
+        json.loads(data)
+        if len(data) > int(config.get('db', 'compression_threshold', 1000)):
+            return zlib.compress(data)
+        else:
+            return data
+
 class Dataset(JSONObject):
     
     def __init__(self, obj_dict, parent=None):
@@ -142,51 +185,11 @@ class Dataset(JSONObject):
             Turn the value of an incoming dataset into a hydra-friendly value.
         """
         try:
-            #attr_data.value is a dictionary,
-            #but the keys have namespaces which must be stripped.
-
-
-            if self.value is None:
-                log.warn("Cannot parse dataset. No value specified.")
-                return None
-
-            data = str(self.value)
-
-            if data.upper().strip() == 'NULL':
-                return 'NULL'
-
-            if data.strip() == '':
-                return "NULL"
-
-            if len(data) > 100:
-                log.debug("Parsing %s", data[0:100])
-            else:
-                log.debug("Parsing %s", data)
-
+            #The metadata is only needed to identify hashtables.
+            metadata = {}
             if self.type == 'descriptor':
-                #Hack to work with hashtables. REMOVE AFTER DEMO
-                if self.get_metadata_as_dict().get('data_type') == 'hashtable':
-                    df = pd.read_json(data)
-                    data = df.transpose().to_json() 
-                return data
-            elif self.type == 'scalar':
-                return data
-            elif self.type == 'timeseries':
-                timeseries_pd = pd.read_json(data)
-                #Epoch doesn't work here because dates before 1970 are not
-                # supported in read_json. Ridiculous.
-                ts = timeseries_pd.to_json(date_format='iso', date_unit='ns')
-                if len(data) > int(config.get('db', 'compression_threshold', 1000)):
-                    return zlib.compress(ts)
-                else:
-                    return ts
-            elif self.type == 'array':
-                #check to make sure this is valid json
-                json.loads(data)
-                if len(data) > int(config.get('db', 'compression_threshold', 1000)):
-                    return zlib.compress(data)
-                else:
-                    return data
+                metadata = self.get_metadata_as_dict()
+            return parse_dataset_value(self.type, self.value, metadata)
         except Exception as e:
             log.exception(e)
             raise HydraError("Error parsing value %s: %s"%(self.value, e))
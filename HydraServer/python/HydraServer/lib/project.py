@@ -16,7 +16,7 @@
 from HydraLib.HydraException import ResourceNotFoundError
 import scenario
 import logging
-from HydraLib.HydraException import PermissionError, HydraError
+from HydraLib.HydraException import HydraError
 from HydraServer.db.model import Project, ProjectOwner, Network
 from HydraServer.db import DBSession
 import network
@@ -256,18 +256,11 @@ def get_networks(project_id, include_resources=True, summary=False, include_data
     project.check_read_permission(user_id)
 
     rs = DBSession.query(Network.network_id, Network.status).filter(Network.project_id == project_id).all()
-    networks = []
-    for r in rs:
-        if r.status != 'A':
-            continue
-        try:
-            net = network.get_network(r.network_id, include_resources=include_resources, summary=summary,
-                                      include_data=include_data, **kwargs)
-            log.info("Network %s retrieved", net.network_name)
-            networks.append(net)
-        except PermissionError:
-            log.info("Not returning network %s as user %s does not have "
-                     "permission to read it." % (r.network_id, user_id))
+    network_ids = [r.network_id for r in rs if r.status == 'A']
+
+    #Networks the user can't read are left out.
+    networks = network.get_networks(network_ids, include_resources=include_resources, summary=summary,
+                                    include_data=include_data, **kwargs)
 
     return networks
 
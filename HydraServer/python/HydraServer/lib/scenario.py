@@ -30,12 +30,13 @@ import units as hydra_units
 
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy import or_, and_
-from sqlalchemy.orm import joinedload_all, joinedload, aliased
+from sqlalchemy.orm import joinedload_all, joinedload, aliased, undefer
 import data
 from HydraLib.hydra_dateutil import timestamp_to_ordinal
+from HydraServer.util.changelog import record_changes
 from collections import namedtuple
 from copy import deepcopy
-import zlib
+from HydraServer.util.dataformat import decode_value
 
 log = logging.getLogger(__name__)
 
@@ -52,6 +53,14 @@ def _check_network_ownership(network_id, user_id):
                               " User %s is not an owner of network %s" % (user_id, network_id))
 
 
+def _record_data_changes(scenario_id, resource_attr_ids, change_type='UPDATE'):
+    """
+        Record that the data of some resource attributes has changed in a scenario.
+    """
+    network_id = DBSession.query(Scenario.network_id).filter(Scenario.scenario_id == scenario_id).scalar()
+    record_changes(network_id, 'RESOURCESCENARIO', resource_attr_ids, change_type, scenario_id=scenario_id)
+
+
 def _get_scenario(scenario_id, include_data=True, include_items=True):
     try:
         scenario_qry = DBSession.query(Scenario).filter(Scenario.scenario_id == scenario_id)
@@ -81,6 +90,8 @@ def set_rs_dataset(resource_attr_id, scenario_id, dataset_id, **kwargs):
 
     rs.dataset_id = dataset_id
 
+    record_changes(rs.scenario.network_id, 'RESOURCESCENARIO', resource_attr_id, scenario_id=scenario_id)
+
     DBSession.flush()
 
     rs = DBSession.query(ResourceScenario).filter(
@@ -123,6 +134,8 @@ def copy_data_from_scenario(resource_attrs, source_scenario_id, target_scenario_
             target_rs.resource_attr_id = source_rs.resource_attr_id
             DBSession.add(target_rs)
 
+    _record_data_changes(target_scenario_id, [rs.resource_attr_id for rs in source_resourcescenarios])
+
     DBSession.flush()
 
     return target_resourcescenarios
@@ -206,6 +219,7 @@ def add_scenario(network_id, scenario, **kwargs):
             scen.resourcegroupitems.append(group_item_i)
     DBSession.add(scen)
     DBSession.flush()
+    record_changes(network_id, 'SCENARIO', scen.scenario_id, 'INSERT')
     return scen
 
 
@@ -223,6 +237,8 @@ def update_scenario(scenario, update_data=True, update_groups=True, **kwargs):
     if scen.locked == 'Y':
         raise PermissionError('Scenario is locked. Unlock before editing.')
 
+    record_changes(scen.network_id, 'SCENARIO', scen.scenario_id)
+
     scen.scenario_name = scenario.name
     scen.scenario_description = scenario.description
     scen.layout = scenario.get_layout()
@@ -265,6 +281,7 @@ def set_scenario_status(scenario_id, status, **kwargs):
     scenario_i = _get_scenario(scenario_id, False, False)
 
     scenario_i.status = status
+    record_changes(scenario_i.network_id, 'SCENARIO', scenario_id)
     DBSession.flush()
     return 'OK'
 
@@ -277,6 +294,7 @@ def purge_scenario(scenario_id, **kwargs):
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
     scenario_i = _get_scenario(scenario_id, False, False)
     DBSession.delete(scenario_i)
+    record_changes(scenario_i.network_id, 'SCENARIO', scenario_id, 'DELETE')
     DBSession.flush()
     return 'OK'
 
@@ -337,6 +355,7 @@ def clone_scenario(scenario_id, **kwargs):
 
     DBSession.add(cloned_scen)
     DBSession.flush()
+    record_changes(cloned_scen.network_id, 'SCENARIO', cloned_scen.scenario_id, 'INSERT')
 
     log.info("Cloning finished.")
 
@@ -351,6 +370,9 @@ def _get_dataset_as_dict(rs, user_id):
 
     del dataset['_sa_instance_state']
 
+    #The value is deferred, so it is not in __dict__ unless already loaded.
+    dataset['value'] = rs.dataset.value
+
     try:
         rs.dataset.check_read_permission(user_id)
     except PermissionError:
@@ -505,7 +527,7 @@ def get_resource_scenario(resource_attr_id, scenario_id, **kwargs):
         rs = DBSession.query(ResourceScenario).filter(
             ResourceScenario.resource_attr_id == resource_attr_id,
             ResourceScenario.scenario_id == scenario_id
-        ).options(joinedload_all('dataset')).options(joinedload_all('dataset.metadata')).one()
+        ).options(joinedload_all('dataset')).options(joinedload_all('dataset.metadata')).options(undefer('dataset.value')).one()
 
         return rs
     except NoResultFound:
@@ -521,6 +543,7 @@ def lock_scenario(scenario_id, **kwargs):
 
     if owner.edit == 'Y':
         scenario_i.locked = 'Y'
+        record_changes(scenario_i.network_id, 'SCENARIO', scenario_id)
     else:
         raise PermissionError('User %s cannot lock scenario %s' % (kwargs['user_id'], scenario_id))
     DBSession.flush()
@@ -535,6 +558,7 @@ def unlock_scenario(scenario_id, **kwargs):
     owner = _check_network_owner(scenario_i.network, kwargs['user_id'])
     if owner.edit == 'Y':
         scenario_i.locked = 'N'
+        record_changes(scenario_i.network_id, 'SCENARIO', scenario_id)
     else:
         raise PermissionError('User %s cannot unlock scenario %s' % (kwargs['user_id'], scenario_id))
     DBSession.flush()
@@ -577,6 +601,8 @@ def bulk_update_resourcedata(scenario_ids, resource_scenarios, **kwargs):
         _check_can_edit_scenario(scenario_id, kwargs['user_id'])
 
         scen_i = _get_scenario(scenario_id, False, False)
+        record_changes(scen_i.network_id, 'RESOURCESCENARIO',
+                       [rs.resource_attr_id for rs in resource_scenarios], scenario_id=scenario_id)
         res[scenario_id] = []
         for rs in resource_scenarios:
             if rs.value is not None:
@@ -613,6 +639,8 @@ def update_resourcedata(scenario_id, resource_scenarios, **kwargs):
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
 
     scen_i = _get_scenario(scenario_id, False, False)
+    record_changes(scen_i.network_id, 'RESOURCESCENARIO',
+                   [rs.resource_attr_id for rs in resource_scenarios], scenario_id=scenario_id)
 
     res = []
     for rs in resource_scenarios:
@@ -636,6 +664,8 @@ def delete_resourcedata(scenario_id, resource_scenario, **kwargs):
 
     _delete_resourcescenario(scenario_id, resource_scenario)
 
+    _record_data_changes(scenario_id, resource_scenario.resource_attr_id, 'DELETE')
+
 
 def _delete_resourcescenario(scenario_id, resource_scenario):
     ra_id = resource_scenario.resource_attr_id
@@ -796,6 +826,7 @@ def add_data_to_attribute(scenario_id, resource_attr_id, dataset, **kwargs):
     _check_can_edit_scenario(scenario_id, user_id)
 
     scenario_i = _get_scenario(scenario_id, False, False)
+    record_changes(scenario_i.network_id, 'RESOURCESCENARIO', resource_attr_id, scenario_id=scenario_id)
 
     try:
         r_scen_i = DBSession.query(ResourceScenario).filter(
@@ -875,7 +906,7 @@ def get_attribute_data(attr_ids, node_ids, **kwargs):
 
     resource_scenarios = DBSession.query(ResourceScenario).filter(
         ResourceScenario.resource_attr_id.in_(ra_ids)).options(joinedload('resourceattr')).options(
-        joinedload_all('dataset.metadata')).order_by(ResourceScenario.scenario_id).all()
+        joinedload_all('dataset.metadata')).options(undefer('dataset.value')).order_by(ResourceScenario.scenario_id).all()
 
     for rs in resource_scenarios:
         if rs.dataset.hidden == 'Y':
@@ -914,7 +945,7 @@ def get_resource_data(ref_key, ref_id, scenario_id, type_id, **kwargs):
             ResourceAttr.node_id == ref_id,
             ResourceAttr.link_id == ref_id,
             ResourceAttr.group_id == ref_id
-        )).distinct().options(joinedload('resourceattr')).options(joinedload_all('dataset.metadata'))
+        )).distinct().options(joinedload('resourceattr')).options(joinedload_all('dataset.metadata')).options(undefer('dataset.value'))
 
     if type_id is not None:
         attr_ids = []
@@ -927,10 +958,7 @@ def get_resource_data(ref_key, ref_id, scenario_id, type_id, **kwargs):
     resource_data = resource_data_qry.all()
 
     for rs in resource_data:
-        try:
-            rs.dataset.value = zlib.decompress(rs.dataset.value)
-        except zlib.error:
-            pass
+        rs.dataset.value = decode_value(rs.dataset.value)
 
         if rs.dataset.hidden == 'Y':
             try:
@@ -964,7 +992,7 @@ def get_scenarios_data(networks, nodes, links, scenario_id, attr_id, type_id, **
             ResourceScenario.scenario_id == scenario.scenario_id) \
             .distinct() \
             .options(joinedload('resourceattr')) \
-            .options(joinedload_all('dataset.metadata'))
+            .options(joinedload_all('dataset.metadata')).options(undefer('dataset.value'))
 
         if attr_id:
             resource_data_qry = resource_data_qry.filter(ResourceAttr.attr_id.in_(set(attr_id)))
@@ -1000,10 +1028,7 @@ def get_scenarios_data(networks, nodes, links, scenario_id, attr_id, type_id, **
         resource_data = resource_data_qry.all()
 
         for rs in resource_data:
-            try:
-                rs.dataset.value = zlib.decompress(rs.dataset.value)
-            except zlib.error:
-                pass
+            rs.dataset.value = decode_value(rs.dataset.value)
 
             if rs.dataset.hidden == 'Y':
                 try:
@@ -1052,7 +1077,7 @@ def get_resource_attribute_data(ref_key, ref_id, scenario_id, attr_id, **kwargs)
             ResourceAttr.node_id == ref_id,
             ResourceAttr.link_id == ref_id,
             ResourceAttr.group_id == ref_id
-        )).distinct().options(joinedload('resourceattr')).options(joinedload_all('dataset.metadata'))
+        )).distinct().options(joinedload('resourceattr')).options(joinedload_all('dataset.metadata')).options(undefer('dataset.value'))
 
     if attr_id is not None:
         if not isinstance(attr_id, list):
@@ -1062,10 +1087,7 @@ def get_resource_attribute_data(ref_key, ref_id, scenario_id, attr_id, **kwargs)
     resource_data = resource_data_qry.all()
 
     for rs in resource_data:
-        try:
-            rs.dataset.value = zlib.decompress(rs.dataset.value)
-        except zlib.error:
-            pass
+        rs.dataset.value = decode_value(rs.dataset.value)
 
         if rs.dataset.hidden == 'Y':
             try:
@@ -1119,7 +1141,7 @@ def get_resourcescenarios(resource_attr_ids, scenario_ids, **kwargs):
     rs_result = DBSession.query(ResourceScenario).filter(
                 ResourceScenario.scenario_id.in_(scenario_ids),
                 ResourceScenario.resource_attr_id.in_(resource_attr_ids)
-            ).all()
+            ).options(joinedload_all('dataset.metadata')).options(undefer('dataset.value')).all()
 
     return rs_result
 
@@ -1161,6 +1183,7 @@ def delete_resourcegroupitems(scenario_id, item_ids, **kwargs):
     user_id = int(kwargs.get('user_id'))
     scenario = _get_scenario(scenario_id, include_data=False, include_items=False)
     _check_network_ownership(scenario.network_id, user_id)
+    record_changes(scenario.network_id, 'SCENARIO', scenario.scenario_id)
     for item_id in item_ids:
         rgi = DBSession.query(ResourceGroupItem). \
             filter(ResourceGroupItem.item_id == item_id).one()
@@ -1174,6 +1197,7 @@ def empty_group(group_id, scenario_id, **kwargs):
     user_id = int(kwargs.get('user_id'))
     scenario = _get_scenario(scenario_id, False, False)
     _check_network_ownership(scenario.network_id, user_id)
+    record_changes(scenario.network_id, 'SCENARIO', scenario.scenario_id)
 
     rgi = DBSession.query(ResourceGroupItem). \
         filter(ResourceGroupItem.group_id == group_id). \
@@ -1191,6 +1215,7 @@ def add_resourcegroupitems(scenario_id, items, scenario=None, **kwargs):
         scenario = _get_scenario(scenario_id, include_data=False, include_items=False)
 
     _check_network_ownership(scenario.network_id, user_id)
+    record_changes(scenario.network_id, 'SCENARIO', scenario.scenario_id)
 
     newitems = []
     for group_item in items:
@@ -1260,6 +1285,7 @@ def update_value_from_mapping(source_resource_attr_id, target_resource_attr_id,
     #check scenarios exist
     s1 = _get_scenario(source_scenario_id, False, False)
     s2 = _get_scenario(target_scenario_id, False, False)
+    record_changes(s2.network_id, 'RESOURCESCENARIO', target_resource_attr_id, scenario_id=target_scenario_id)
 
     rs = aliased(ResourceScenario, name='rs')
     rs1 = DBSession.query(rs).filter(rs.resource_attr_id == source_resource_attr_id,
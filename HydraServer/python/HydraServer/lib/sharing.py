@@ -18,6 +18,7 @@ import logging
 
 log = logging.getLogger(__name__)
 from HydraServer.db import DBSession
+from HydraServer.util.changelog import bump_network_version, bump_data_version
 from HydraServer.db.model import Network, Project, Template, User, Dataset
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -76,6 +77,7 @@ def share_network(network_id, usernames, read_only, share, **kwargs):
     user_id = kwargs.get('user_id')
     net_i = _get_network(network_id)
     net_i.check_share_permission(user_id)
+    bump_network_version(net_i.network_id)
 
     if read_only == 'Y':
         write = 'N'
@@ -109,6 +111,7 @@ def unshare_network(network_id, usernames, **kwargs):
     user_id = kwargs.get('user_id')
     net_i = _get_network(network_id)
     net_i.check_share_permission(user_id)
+    bump_network_version(net_i.network_id)
 
     for username in usernames:
         user_i = _get_user(username)
@@ -161,6 +164,7 @@ def share_project(project_id, usernames, read_only, share, **kwargs):
         proj_i.set_owner(user_i.user_id, write=write, share=share)
 
         for net_i in proj_i.networks:
+            bump_network_version(net_i.network_id)
             net_i.set_owner(user_i.user_id, write=write, share=share)
     DBSession.flush()
 
@@ -177,7 +181,11 @@ def unshare_project(project_id, usernames, **kwargs):
     for username in usernames:
         user_i = _get_user(username)
         # Set the owner ship on the network itself
-        proj_i.unset_owner(user_i.user_id, write=write, share=share)
+        proj_i.unset_owner(user_i.user_id)
+
+        for net_i in proj_i.networks:
+            bump_network_version(net_i.network_id)
+            net_i.unset_owner(user_i.user_id)
     DBSession.flush()
 
 
@@ -218,6 +226,7 @@ def set_project_permission(project_id, usernames, read, write, share, **kwargs):
             proj_i.set_owner(user_i.user_id, read=read, write=write, share=share)
 
         for net_i in proj_i.networks:
+            bump_network_version(net_i.network_id)
             net_i.set_owner(user_i.user_id, read=read, write=write, share=share)
     DBSession.flush()
 
@@ -253,6 +262,7 @@ def set_network_permission(network_id, usernames, read, write, share, **kwargs):
 
     # Check if the user is allowed to share this network.
     net_i.check_share_permission(user_id)
+    bump_network_version(net_i.network_id)
 
     # You cannot edit something you cannot see.
     if read == 'N':
@@ -293,6 +303,7 @@ def hide_dataset(dataset_id, exceptions, read, write, share, **kwargs):
                          % (user_id, dataset_i.data_name))
 
     dataset_i.hidden = 'Y'
+    bump_data_version()
     if exceptions is not None:
         for username in exceptions:
             user_i = _get_user(username)
@@ -319,6 +330,7 @@ def unhide_dataset(dataset_id, **kwargs):
                          % (user_id, dataset_i.data_name))
 
     dataset_i.hidden = 'N'
+    bump_data_version()
     DBSession.flush()
 
 
@@ -17,6 +17,7 @@ from HydraServer.db import DBSession
 from HydraServer.db.model import Template, TemplateType, TypeAttr, Attr, Network, Node, Link, ResourceGroup, \
     ResourceType, ResourceAttr, ResourceScenario, Scenario, TemplateOwner
 from data import add_dataset
+from HydraServer.util.changelog import record_changes, bump_network_version, bump_template_version
 
 from HydraLib.HydraException import HydraError, ResourceNotFoundError
 from HydraLib import config, util
@@ -24,7 +25,7 @@ from lxml import etree
 from decimal import Decimal
 import logging
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import joinedload_all, noload
+from sqlalchemy.orm import joinedload_all, noload, undefer
 from sqlalchemy import or_, and_
 import re
 import units
@@ -241,6 +242,7 @@ def upload_template_xml(template_xml, **kwargs):
             joinedload_all('templatetypes.typeattrs.attr')).one()
         tmpl_i.layout = template_layout
         log.info("Existing template found. name=%s", template_name)
+        bump_template_version()
     except NoResultFound:
         log.info("Template not found. Creating new one. name=%s", template_name)
         tmpl_i = Template(template_name=template_name, layout=template_layout)
@@ -431,6 +433,8 @@ def remove_template_from_network(network_id, template_id, remove_attrs, **kwargs
     except NoResultFound:
         raise HydraError("Template %s not found" % template_id)
 
+    bump_network_version(network_id)
+
     type_ids = [tmpltype.type_id for tmpltype in template.templatetypes]
 
     node_ids = [n.node_id for n in network.nodes]
@@ -450,6 +454,9 @@ def remove_template_from_network(network_id, template_id, remove_attrs, **kwargs
         for ra in resource_attrs_to_remove:
             DBSession.delete(ra)
 
+        record_changes(network_id, 'RESOURCEATTR',
+                       [ra.resource_attr_id for ra in resource_attrs_to_remove], 'DELETE')
+
     resource_types = DBSession.query(ResourceType).filter(
         and_(or_(
             ResourceType.network_id == network_id,
@@ -461,6 +468,10 @@ def remove_template_from_network(network_id, template_id, remove_attrs, **kwargs
     for resource_type in resource_types:
         DBSession.delete(resource_type)
 
+    record_changes(network_id, 'NODE', [rt.node_id for rt in resource_types if rt.ref_key == 'NODE'])
+    record_changes(network_id, 'LINK', [rt.link_id for rt in resource_types if rt.ref_key == 'LINK'])
+    record_changes(network_id, 'GROUP', [rt.group_id for rt in resource_types if rt.ref_key == 'GROUP'])
+
 
 def _get_resources_to_remove(resource, template):
     """
@@ -552,6 +563,10 @@ def assign_types_to_resources(resource_types, **kwargs):
     nodes = _get_nodes(node_ids)
     links = _get_links(link_ids)
     groups = _get_groups(grp_ids)
+
+    #The resources which have been changed, keyed on network and ref_key.
+    changed_resources = {}
+
     for resource_type in resource_types:
         ref_key = resource_type.ref_key
         type_id = resource_type.type_id
@@ -559,10 +574,13 @@ def assign_types_to_resources(resource_types, **kwargs):
             resource = net
         elif ref_key == 'NODE':
             resource = nodes[resource_type.node_id]
+            changed_resources.setdefault((resource.network_id, ref_key), []).append(resource_type.node_id)
         elif ref_key == 'LINK':
             resource = links[resource_type.link_id]
+            changed_resources.setdefault((resource.network_id, ref_key), []).append(resource_type.link_id)
         elif ref_key == 'GROUP':
             resource = groups[resource_type.group_id]
+            changed_resources.setdefault((resource.network_id, ref_key), []).append(resource_type.group_id)
 
         ra, rt, rs= set_resource_type(resource, type_id, types)
 
@@ -594,6 +612,9 @@ def assign_types_to_resources(resource_types, **kwargs):
     if len(res_scenarios) > 0:
         DBSession.execute(ResourceScenario.__table__.insert(), res_scenarios)
 
+    for (network_id, ref_key), ref_ids in changed_resources.items():
+        record_changes(network_id, ref_key, ref_ids)
+
     #Make DBsession 'dirty' to pick up the inserts by doing a fake delete.
     DBSession.query(ResourceAttr).filter(ResourceAttr.attr_id==None).delete()
 
@@ -798,6 +819,9 @@ def assign_type_to_resource(type_id, resource_type, resource_id, **kwargs):
     if len(res_scenarios) > 0:
         DBSession.execute(ResourceScenario.__table__.insert(), res_scenarios)
 
+    if resource_type != 'NETWORK':
+        record_changes(resource.network_id, resource_type, resource_id)
+
     # Make DBsession 'dirty' to pick up the inserts by doing a fake delete.
     DBSession.query(Attr).filter(Attr.attr_id == None).delete()
 
@@ -819,6 +843,8 @@ def set_resource_type(resource, type_id, types={}, **kwargs):
 
     ref_key = resource.ref_key
 
+    bump_network_version(resource.network_id)
+
     existing_attr_ids = []
     for attr in resource.attributes:
         existing_attr_ids.append(attr.attr_id)
@@ -915,6 +941,20 @@ def remove_type_from_resource(type_id, resource_type, resource_id, **kwargs):
         ResourceType.link_id == link_id,
         ResourceType.group_id == group_id).one()
 
+    if resource_type == 'NODE':
+        network_id = DBSession.query(Node.network_id).filter(Node.node_id == node_id).scalar()
+    elif resource_type == 'LINK':
+        network_id = DBSession.query(Link.network_id).filter(Link.link_id == link_id).scalar()
+    elif resource_type == 'GROUP':
+        network_id = DBSession.query(ResourceGroup.network_id).filter(ResourceGroup.group_id == group_id).scalar()
+    else:
+        network_id = resource_id
+
+    if resource_type == 'NETWORK':
+        bump_network_version(network_id)
+    else:
+        record_changes(network_id, resource_type, resource_id)
+
     DBSession.delete(resourcetype)
 
 
@@ -974,6 +1014,7 @@ def update_template(template, **kwargs):
     """
     tmpl = DBSession.query(Template).filter(Template.template_id == template.id).one()
     tmpl.template_name = template.name
+    bump_template_version()
     if template.layout is not None:
         tmpl.layout = str(template.layout)
 
@@ -1011,6 +1052,7 @@ def delete_template(template_id, **kwargs):
     except NoResultFound:
         raise ResourceNotFoundError("Template %s not found" % (template_id,))
     DBSession.delete(tmpl)
+    bump_template_version()
     return 'OK'
 
 
@@ -1064,6 +1106,7 @@ def remove_attr_from_type(type_id, attr_id, **kwargs):
     """
     typeattr_i = DBSession.query(TypeAttr).filter(TypeAttr.type_id == type_id,
                                                   TypeAttr.attr_id == attr_id).one()
+    bump_template_version()
     DBSession.delete(typeattr_i)
 
 
@@ -1073,7 +1116,8 @@ def get_template(template_id, **kwargs):
     """
 
     tmpl = DBSession.query(Template).filter(Template.template_id == template_id).options(
-        joinedload_all('templatetypes.typeattrs.default_dataset.metadata')).one()
+        joinedload_all('templatetypes.typeattrs.default_dataset.metadata')).options(
+        undefer('templatetypes.typeattrs.default_dataset.value')).one()
 
     return tmpl
 
@@ -1112,6 +1156,7 @@ def update_templatetype(templatetype, **kwargs):
     tmpltype_i = DBSession.query(TemplateType).filter(TemplateType.type_id == templatetype.id).one()
 
     _update_templatetype(templatetype, tmpltype_i)
+    bump_template_version()
 
     DBSession.flush()
 
@@ -1243,6 +1288,7 @@ def delete_templatetype(type_id, **kwargs):
     except NoResultFound:
         raise ResourceNotFoundError("Template Type %s not found" % (type_id,))
     DBSession.delete(tmpltype)
+    bump_template_version()
     DBSession.flush()
 
 
@@ -1275,6 +1321,7 @@ def add_typeattr(typeattr, **kwargs):
     """
 
     ta = _set_typeattr(typeattr)
+    bump_template_version()
 
     DBSession.flush()
 
@@ -1289,6 +1336,7 @@ def delete_typeattr(typeattr, **kwargs):
     """
     ta = DBSession.query(TypeAttr).filter(TypeAttr.type_id == typeattr.type_id,
                                           TypeAttr.attr_id == typeattr.attr_id).one()
+    bump_template_version()
     DBSession.delete(ta)
 
     return 'OK'
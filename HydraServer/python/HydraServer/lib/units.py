@@ -160,7 +160,9 @@ def convert_dataset(dataset_id, to_unit,**kwargs):
         if existing_ds is not None:
             DBSession.expunge_all()
             return existing_ds.dataset_id
-        
+
+        new_dataset.set_trigrams()
+        new_dataset.set_chunks()
         DBSession.add(new_dataset)
         DBSession.flush()
 
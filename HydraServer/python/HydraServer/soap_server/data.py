@@ -17,7 +17,9 @@ from spyne.model.primitive import Integer, Integer32, Boolean, Unicode, AnyDict,
 from spyne.model.complex import Array as SpyneArray
 from spyne.decorator import rpc
 from hydra_complexmodels import Dataset,\
-        DatasetCollection
+        DatasetCollection,\
+        DatasetChunk,\
+        CacheStats
 
 from HydraServer.lib import data
 
@@ -130,6 +132,7 @@ class DataService(HydraService):
          Unicode(pattern='[YN]', default='N'), #include metadata flag
          Unicode(pattern='[YN]', default='N'), # include value flag
          Integer(default=0),Integer(default=2000), #start, size page flags
+         Integer, #the last dataset ID of the previous page
          _returns=SpyneArray(Dataset))
     def search_datasets(ctx, dataset_id,
                 name,
@@ -146,7 +149,8 @@ class DataService(HydraService):
                 inc_metadata,
                 inc_val,
                 page_start,
-                page_size):
+                page_size,
+                last_dataset_id):
         """
         Search for datadets that satisfy the criteria specified.
         By default, returns a max of 2000 datasets. To return datasets from 2001 onwards,
@@ -169,6 +173,9 @@ class DataService(HydraService):
             inc_val         (char) (default 'N')  : Include the value with the dataset. 'Y' gives a performance hit
             page_start      (int)    : Return datasets from this point (ex: from index 2001 of 10,000)
             page_size       (int)    : Return this number of datasets in one go. default is 2000.
+            last_dataset_id (int)    : Return datasets after the one with this ID. Datasets are
+                                       returned in order of ID, so passing the ID of the last dataset
+                                       in a page gets the next page, faster than page_start does.
 
         Returns:
             List(Dataset): The datasets matching all the specified criteria.
@@ -190,6 +197,7 @@ class DataService(HydraService):
                                      inc_val,
                                      page_start,
                                      page_size,
+                                     last_dataset_id,
                                      **ctx.in_header.__dict__)
 
         cm_datasets = []
@@ -584,6 +592,68 @@ class DataService(HydraService):
                                            increment,
                                            **ctx.in_header.__dict__)
 
+    @rpc(Integer32(min_occurs=0, max_occurs='unbounded'),
+         Unicode,
+         Unicode(values=['sum', 'mean', 'min', 'max', 'last']),
+         _returns=AnyDict)
+    def resample_datasets(ctx, dataset_ids, freq, how):
+        """
+        Resample timeseries to a new frequency, aggregating the values in each
+        period on the server. For example, get the monthly means of daily
+        timeseries without downloading them in full.
+
+        Args:
+            dataset_ids (List(int)): The IDs of the timeseries datasets
+            freq (string): A pandas frequency, such as 'D', 'W', 'M' or 'A'
+            how (string): How to aggregate the values in each period:
+                          'sum', 'mean', 'min', 'max' or 'last'
+
+        Returns:
+            dict: A dictionary, keyed on 'dataset_<id>', of the resampled
+                  timeseries as JSON strings. The entry is None for datasets
+                  which are not timeseries or cannot be resampled.
+
+        Raises:
+            HydraError: If the frequency or method is not valid
+        """
+        return data.resample_datasets(dataset_ids,
+                                      freq,
+                                      how,
+                                      **ctx.in_header.__dict__)
+
+    @rpc(Integer, _returns=SpyneArray(DatasetChunk))
+    def get_dataset_chunks(ctx, dataset_id):
+        """
+        Get the windows of time into which a large timeseries is split
+        (see timeseries_chunk_rows in hydra.ini), with the number of rows and
+        the smallest and largest values in each.
+
+        Args:
+            dataset_id (int): The ID of the timeseries dataset
+
+        Returns:
+            List(hydra_complexmodels.DatasetChunk): The windows, in order of
+            time. Empty if the timeseries has not been split.
+
+        Raises:
+            ResourceNotFoundError: If the dataset does not exist
+            PermissionError: If the dataset is hidden from the user
+        """
+        chunks = data.get_dataset_chunks(dataset_id, **ctx.in_header.__dict__)
+        return [DatasetChunk(c) for c in chunks]
+
+    @rpc(_returns=CacheStats)
+    def get_value_cache_stats(ctx):
+        """
+        Get the size and hit rate of the cache of decoded timeseries
+        used when reading values at given times.
+
+        Returns:
+            hydra_complexmodels.CacheStats: The cache statistics
+        """
+        stats = data.get_value_cache_stats(**ctx.in_header.__dict__)
+        return CacheStats(stats)
+
     @rpc(Unicode, _returns=Unicode)
     def check_json(ctx, json_string):
         """
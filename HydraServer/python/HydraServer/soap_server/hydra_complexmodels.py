@@ -21,12 +21,10 @@ from spyne.model.primitive import AnyDict
 from spyne.model.primitive import Double
 from decimal import Decimal as Dec
 from HydraLib.hydra_dateutil import ordinal_to_timestamp
-import pandas as pd
 import logging
 from HydraServer.util import generate_data_hash
+from HydraServer.util.dataformat import decode_value, parse_value
 import json
-import zlib
-from HydraLib import config
 from HydraLib.HydraException import HydraError
 
 from HydraServer.lib.objects import Dataset
@@ -178,10 +176,7 @@ class ResourceData(HydraComplexModel):
         self.dataset_unit = ra.data_units
         self.dataset_frequency = ra.frequency
         if include_value == 'Y':
-            try:
-                self.dataset_value = zlib.decompress(ra.value)
-            except:
-                self.dataset_value = ra.value
+            self.dataset_value = decode_value(ra.value)
 
         if ra.metadata:
             self.metadata = {}
@@ -265,10 +260,7 @@ class Dataset(HydraComplexModel, Dataset):
         self.value = None
 
         if parent.value is not None:
-            try:
-                self.value = zlib.decompress(parent.value)
-            except:
-                self.value = parent.value
+            self.value = decode_value(parent.value)
 
         if include_metadata is True:
             metadata = {}
@@ -281,46 +273,7 @@ class Dataset(HydraComplexModel, Dataset):
             Turn the value of an incoming dataset into a hydra-friendly value.
         """
         try:
-            # attr_data.value is a dictionary,
-            # but the keys have namespaces which must be stripped.
-
-
-            if self.value is None:
-                log.warn("Cannot parse dataset. No value specified.")
-                return None
-
-            data = str(self.value)
-
-            if data == 'NULL':
-                return 'NULL'
-
-            if len(data) > 100:
-                log.debug("Parsing %s", data[0:100])
-            else:
-                log.debug("Parsing %s", data)
-
-            if self.type == 'descriptor':
-                return data
-            elif self.type == 'scalar':
-                return data
-            elif self.type == 'timeseries':
-                timeseries_pd = pd.read_json(data)
-
-                # Epoch doesn't work here because dates before 1970 are not
-                # supported in read_json. Ridiculous.
-                ts = timeseries_pd.to_json(date_format='iso', date_unit='ns')
-                if len(data) > int(config.get('db', 'compression_threshold', 1000)):
-                    return zlib.compress(ts)
-                else:
-                    return ts
-            elif self.type == 'array':
-                # check to make sure this is valid json
-                log.info(data)
-                json.loads(data)
-                if len(data) > int(config.get('db', 'compression_threshold', 1000)):
-                    return zlib.compress(data)
-                else:
-                    return data
+            return parse_value(self.type, self.value)
         except Exception as e:
             log.exception(e)
             raise HydraError("Error parsing value %s: %s" % (self.value, e))
@@ -1222,6 +1175,7 @@ class Network(Resource):
        - **types**               SpyneArray(TypeSummary)
        - **projection**          Unicode(default=None)
        - **owners**               SpyneArray(Owner)
+       - **version**             Integer(min_occurs=0, default=None)
     """
     _type_info = [
         ('project_id', Integer(default=None)),
@@ -1240,6 +1194,7 @@ class Network(Resource):
         ('types', SpyneArray(TypeSummary)),
         ('projection', Unicode(default=None)),
         ('owners', SpyneArray(Owner)),
+        ('version', Integer(min_occurs=0, default=None)),
     ]
 
     def __init__(self, parent=None, summary=False):
@@ -1263,6 +1218,7 @@ class Network(Resource):
         self.projection = parent.projection
         self.owners = [Owner(owner) for owner in parent.owners]
         self.attributes = [ResourceAttr(ra) for ra in parent.attributes] if summary is False else []
+        self.version = getattr(parent, 'version', None)
 
 
 class NetworkSummary(Resource):
@@ -1357,6 +1313,140 @@ class NetworkExtents(HydraComplexModel):
         self.max_y = parent.max_y
 
 
+class ResourcesInBBox(HydraComplexModel):
+    """
+        The nodes of a network within a bounding box, and the links
+        connected to them.
+       - **network_id** Integer(default=None)
+       - **nodes**      SpyneArray(Node)
+       - **links**      SpyneArray(Link)
+    """
+    _type_info = [
+        ('network_id', Integer(default=None)),
+        ('nodes', SpyneArray(Node)),
+        ('links', SpyneArray(Link)),
+    ]
+
+    def __init__(self, parent=None):
+        super(ResourcesInBBox, self).__init__()
+
+        if parent is None:
+            return
+
+        self.network_id = parent.network_id
+        self.nodes      = [Node(n, summary=True) for n in parent.nodes]
+        self.links      = [Link(l, summary=True) for l in parent.links]
+
+
+class NetworkChange(HydraComplexModel):
+    """
+        An entry in the change log of a network.
+       - **version**     Integer(default=None)
+       - **ref_key**     Unicode(default=None)
+       - **ref_id**      Integer(default=None)
+       - **scenario_id** Integer(default=None)
+       - **change_type** Unicode(default=None)
+    """
+    _type_info = [
+        ('version', Integer(default=None)),
+        ('ref_key', Unicode(default=None)),
+        ('ref_id', Integer(default=None)),
+        ('scenario_id', Integer(default=None)),
+        ('change_type', Unicode(default=None)),
+    ]
+
+    def __init__(self, parent=None):
+        super(NetworkChange, self).__init__()
+
+        if parent is None:
+            return
+
+        self.version     = parent.version
+        self.ref_key     = parent.ref_key
+        self.ref_id      = parent.ref_id
+        self.scenario_id = parent.scenario_id
+        self.change_type = parent.change_type
+
+
+class NetworkChanges(HydraComplexModel):
+    """
+        What has changed in a network since a given version.
+       - **network_id**     Integer(default=None)
+       - **version**        Integer(default=None)
+       - **nodes**          SpyneArray(Node)
+       - **links**          SpyneArray(Link)
+       - **resourcegroups** SpyneArray(ResourceGroup)
+       - **resourceattrs**  SpyneArray(ResourceAttr)
+       - **scenarios**      SpyneArray(Scenario)
+       - **deleted**        SpyneArray(NetworkChange)
+    """
+    _type_info = [
+        ('network_id', Integer(default=None)),
+        ('version', Integer(default=None)),
+        ('nodes', SpyneArray(Node)),
+        ('links', SpyneArray(Link)),
+        ('resourcegroups', SpyneArray(ResourceGroup)),
+        ('resourceattrs', SpyneArray(ResourceAttr)),
+        ('scenarios', SpyneArray(Scenario)),
+        ('deleted', SpyneArray(NetworkChange)),
+    ]
+
+    def __init__(self, parent=None):
+        super(NetworkChanges, self).__init__()
+
+        if parent is None:
+            return
+
+        self.network_id     = parent.network_id
+        self.version        = parent.version
+        self.nodes          = [Node(n) for n in parent.nodes]
+        self.links          = [Link(l) for l in parent.links]
+        self.resourcegroups = [ResourceGroup(g) for g in parent.resourcegroups]
+        self.resourceattrs  = [ResourceAttr(ra) for ra in parent.resourceattrs]
+        self.scenarios      = [Scenario(s) for s in parent.scenarios]
+        self.deleted        = [NetworkChange(c) for c in parent.deleted]
+
+
+class Job(HydraComplexModel):
+    """
+        A long-running request, run in the background.
+       - **id**         Integer(default=None)
+       - **job_type**   Unicode(default=None)
+       - **status**     Unicode(default=None): QUEUED, RUNNING, FINISHED or FAILED
+       - **progress**   Integer(default=None): Percentage complete
+       - **message**    Unicode(default=None): The latest progress message,
+                        or the error if the job failed.
+       - **cr_date**    Unicode(default=None)
+       - **start_time** Unicode(default=None)
+       - **end_time**   Unicode(default=None)
+    """
+    _type_info = [
+        ('id', Integer(default=None)),
+        ('job_type', Unicode(default=None)),
+        ('status', Unicode(default=None)),
+        ('progress', Integer(default=None)),
+        ('message', Unicode(default=None)),
+        ('cr_date', Unicode(default=None)),
+        ('start_time', Unicode(default=None)),
+        ('end_time', Unicode(default=None)),
+    ]
+
+    def __init__(self, parent=None):
+        super(Job, self).__init__()
+
+        if parent is None:
+            return
+
+        self.id         = parent.job_id
+        self.job_type   = parent.job_type
+        self.status     = parent.status
+        self.progress   = parent.progress
+        self.message    = parent.message
+        self.cr_date    = str(parent.cr_date)
+        self.start_time = str(parent.start_time) if parent.start_time else None
+        self.end_time   = str(parent.end_time) if parent.end_time else None
+
+
 class ProjectOwner(HydraComplexModel):
     """
        - **project_id**   Integer
@@ -1736,3 +1826,66 @@ class DimensionComplete(HydraComplexModel):
     def __init__(self, name, units):
         self.name = name
         self.units = units
+
+class DatasetChunk(HydraComplexModel):
+    """
+        A window of time into which a large timeseries has been split.
+       - **start_time** Unicode
+       - **first_time** Unicode
+       - **last_time**  Unicode
+       - **num_rows**   Integer
+       - **min_val**    Double
+       - **max_val**    Double
+    """
+    _type_info = [
+        ('start_time', Unicode),
+        ('first_time', Unicode),
+        ('last_time', Unicode),
+        ('num_rows', Integer),
+        ('min_val', Double),
+        ('max_val', Double),
+    ]
+
+    def __init__(self, parent=None):
+        super(DatasetChunk, self).__init__()
+        if parent is None:
+            return
+        self.start_time = parent['start_time']
+        self.first_time = parent['first_time']
+        self.last_time  = parent['last_time']
+        self.num_rows   = parent['num_rows']
+        self.min_val    = parent['min_val']
+        self.max_val    = parent['max_val']
+
+class CacheStats(HydraComplexModel):
+    """
+        The size and hit rate of an in-process cache.
+       - **entries**   Integer
+       - **bytes**     Integer
+       - **max_bytes** Integer
+       - **hits**      Integer
+       - **misses**    Integer
+       - **evictions** Integer
+       - **hit_rate**  Double
+    """
+    _type_info = [
+        ('entries', Integer),
+        ('bytes', Integer),
+        ('max_bytes', Integer),
+        ('hits', Integer),
+        ('misses', Integer),
+        ('evictions', Integer),
+        ('hit_rate', Double),
+    ]
+
+    def __init__(self, parent=None):
+        super(CacheStats, self).__init__()
+        if parent is None:
+            return
+        self.entries   = parent['entries']
+        self.bytes     = parent['bytes']
+        self.max_bytes = parent['max_bytes']
+        self.hits      = parent['hits']
+        self.misses    = parent['misses']
+        self.evictions = parent['evictions']
+        self.hit_rate  = parent['hit_rate']
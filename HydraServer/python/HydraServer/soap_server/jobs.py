@@ -0,0 +1,143 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+from spyne.model.primitive import Integer, Unicode
+from spyne.decorator import rpc
+from hydra_complexmodels import Network, Job
+
+from HydraServer.lib import jobs
+from hydra_base import HydraService
+
+class JobService(HydraService):
+    """
+        The job SOAP service. Runs long requests in the background,
+        returning a job which can be polled for its status and result.
+    """
+
+    @rpc(Network, _returns=Job)
+    def queue_add_network(ctx, net):
+        """
+        Add a network in the background. See add_network.
+
+        Args:
+            net (hydra_complexmodels.Network): The entire network complex model structure including nodes, links, scenarios and data
+
+        Returns:
+            hydra_complexmodels.Job: The queued job. Its result is {"network_id": ID}
+        """
+        job = jobs.queue_job('add_network', net, **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Integer, _returns=Job)
+    def queue_clone_scenario(ctx, scenario_id):
+        """
+        Clone a scenario in the background. See clone_scenario.
+
+        Returns:
+            hydra_complexmodels.Job: The queued job. Its result is {"scenario_id": ID}
+        """
+        job = jobs.queue_job('clone_scenario', scenario_id, **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Integer, Integer, Integer(min_occurs=0, max_occurs=1), _returns=Job)
+    def queue_validate_network(ctx, network_id, template_id, scenario_id):
+        """
+        Validate a network against a template in the background. See validate_network.
+
+        Returns:
+            hydra_complexmodels.Job: The queued job. Its result is a list of errors.
+        """
+        job = jobs.queue_job('validate_network', network_id, template_id, scenario_id,
+                             **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Integer, Integer, _returns=Job)
+    def queue_apply_template_to_network(ctx, template_id, network_id):
+        """
+        Apply a template to a network in the background. See apply_template_to_network.
+
+        Returns:
+            hydra_complexmodels.Job: The queued job. Its result is "OK"
+        """
+        job = jobs.queue_job('apply_template_to_network', template_id, network_id,
+                             **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Integer, Unicode(pattern="[YN]", default='Y'), _returns=Job)
+    def queue_purge_network(ctx, network_id, purge_data):
+        """
+        Remove a network completely, in the background. See purge_network.
+
+        Returns:
+            hydra_complexmodels.Job: The queued job. Its result is "OK"
+        """
+        job = jobs.queue_job('purge_network', network_id, purge_data, **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Unicode(pattern="[YN]", default='N'), Integer(default=24), _returns=Job)
+    def queue_collect_datasets(ctx, merge_duplicates, min_age_hours):
+        """
+        Delete the datasets which are no longer used by any scenario,
+        dataset collection or template, along with their metadata and
+        owners, in the background. Requires the 'collect_data' permission.
+
+        Args:
+            merge_duplicates (char): 'Y' to first merge datasets which are
+                                     identical to another dataset into it.
+            min_age_hours (int): Only delete datasets added more than this many
+                                 hours ago, as whatever uses a dataset added more
+                                 recently may not have been committed yet.
+
+        Returns:
+            hydra_complexmodels.Job: The queued job. Its result is the number
+                                     of datasets {"deleted": N, "merged": N}
+        """
+        job = jobs.queue_job('collect_datasets', merge_duplicates, min_age_hours,
+                             **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Integer, _returns=Job)
+    def get_job_status(ctx, job_id):
+        """
+        Get the status and progress of a job.
+
+        Args:
+            job_id (int): The job, as returned when it was queued.
+
+        Returns:
+            hydra_complexmodels.Job: The job
+
+        Raises:
+            ResourceNotFoundError: If the job is not found
+            PermissionError: If the job was queued by another user
+        """
+        job = jobs.get_job_status(job_id, **ctx.in_header.__dict__)
+        return Job(job)
+
+    @rpc(Integer, _returns=Unicode)
+    def get_job_result(ctx, job_id):
+        """
+        Get the result of a finished job.
+
+        Args:
+            job_id (int): The job, as returned when it was queued.
+
+        Returns:
+            string: The result of the job, as JSON
+
+        Raises:
+            HydraError: If the job failed or has not finished
+        """
+        return jobs.get_job_result(job_id, **ctx.in_header.__dict__)
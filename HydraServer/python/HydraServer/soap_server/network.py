@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
-from spyne.model.primitive import Unicode, Integer
+from spyne.model.primitive import Unicode, Integer, Decimal
 from spyne.model.complex import Array as SpyneArray
 from spyne.decorator import rpc
 from hydra_complexmodels import Network,\
@@ -25,7 +25,10 @@ from hydra_complexmodels import Network,\
     ResourceSummary,\
     ResourceAttr,\
     ResourceScenario,\
-    ResourceData
+    ResourceData,\
+    CacheStats,\
+    NetworkChanges,\
+    ResourcesInBBox
 from HydraServer.lib import network, scenario
 from hydra_base import HydraService
 import datetime
@@ -102,6 +105,39 @@ class NetworkService(HydraService):
         ret_net = Network(net, summary)
         return ret_net
 
+    @rpc(Integer, Integer, _returns=NetworkChanges)
+    def get_network_changes(ctx, network_id, since_version):
+        """
+        Get what has changed in a network since a given version, so that a
+        copy of the network can be updated without retrieving all of it again.
+
+        Args:
+            network_id    (int): The ID of the network
+            since_version (int): The 'version' of the network, as returned by get_network or by a previous call to this function.
+
+        Returns:
+            hydra_complexmodels.NetworkChanges: The nodes, links, groups, attributes and scenarios which have been added or changed, along with those which have been deleted, and the new version of the network.
+
+        Raises:
+            ResourceNotFoundError: If the network is not found.
+            HydraError: If the changes since since_version have been pruned from the log.
+        """
+        changes = network.get_network_changes(network_id,
+                                              since_version,
+                                              **ctx.in_header.__dict__)
+        return NetworkChanges(changes)
+
+    @rpc(_returns=CacheStats)
+    def get_network_cache_stats(ctx):
+        """
+        Get the size and hit rate of the cache used by get_network.
+
+        Returns:
+            hydra_complexmodels.CacheStats: The cache statistics
+        """
+        stats = network.get_network_cache_stats(**ctx.in_header.__dict__)
+        return CacheStats(stats)
+
     @rpc(Integer,
          _returns=Unicode)
     def get_network_as_json(ctx, network_id):
@@ -428,6 +464,31 @@ class NetworkService(HydraService):
         network.purge_network(network_id, purge_data, **ctx.in_header.__dict__)
         return 'OK'
 
+    @rpc(Integer, Unicode(min_occurs=0, max_occurs=1), SpyneArray(Integer()), _returns=Network)
+    def clone_network(ctx, network_id, new_name, scenario_ids):
+        """
+        Make a copy of a network, in the same project. The copy is made
+        entirely on the server, and its scenarios share their datasets
+        with the original network.
+
+        Args:
+            network_id (int): The network to copy
+            new_name (string): The name of the copy. Defaults to '<network name> (clone)'
+            scenario_ids (List(int)): The scenarios to copy. All scenarios are copied if not specified.
+
+        Returns:
+            hydra_complexmodels.Network: A summary of the new network
+
+        Raises:
+            ResourceNotFoundError: If the network is not found
+            HydraError: If a network with the new name is already in the project
+        """
+        net = network.clone_network(network_id,
+                                    new_name,
+                                    scenario_ids,
+                                    **ctx.in_header.__dict__)
+        return Network(net, summary=True)
+
     @rpc(Integer, _returns=Unicode)
     def activate_network(ctx, network_id):
         """
@@ -477,6 +538,35 @@ class NetworkService(HydraService):
 
         return ne
 
+    @rpc(Integer, Decimal, Decimal, Decimal, Decimal, _returns=ResourcesInBBox)
+    def get_resources_in_bbox(ctx, network_id, min_x, min_y, max_x, max_y):
+        """
+        Get the nodes of a network which lie within a bounding box, along
+        with the links connected to them. Used to show only the part of a
+        large network which is visible on a map.
+
+        Args:
+            network_id (int): The network to search
+            min_x (decimal): The left edge of the bounding box
+            min_y (decimal): The bottom edge of the bounding box
+            max_x (decimal): The right edge of the bounding box
+            max_y (decimal): The top edge of the bounding box
+
+        Returns:
+            ResourcesInBBox: The nodes and links, with their types but without their attributes.
+
+        Raises:
+            ResourceNotFoundError: If the network is not found.
+            HydraError: If the minimum x or y is greater than the maximum.
+        """
+        resources = network.get_resources_in_bbox(network_id,
+                                                  min_x,
+                                                  min_y,
+                                                  max_x,
+                                                  max_y,
+                                                  **ctx.in_header.__dict__)
+        return ResourcesInBBox(resources)
+
     @rpc(Integer, Node, _returns=Node)
     def add_node(ctx, network_id, node):
 
@@ -933,14 +1023,15 @@ class NetworkService(HydraService):
 
         return resources
 
-    @rpc(Integer, _returns=Unicode)
-    def clean_up_network(ctx, network_id):
+    @rpc(Integer, Unicode(pattern="[YN]", default='N'), _returns=Unicode)
+    def clean_up_network(ctx, network_id, purge_data):
         """
         Purge all nodes, links, groups and scenarios from a network which
         have previously been deleted.
 
         Args:
             network_id (int): The network to clean up
+            purge_data (string) ('Y' or 'N'): Delete any data left unused by the purged resources. Defaults to 'N'
 
         Returns:
             string: 'OK'
@@ -949,7 +1040,7 @@ class NetworkService(HydraService):
             ResourceNotFoundError: If the network is not found
 
         """
-        return network.clean_up_network(network_id, **ctx.in_header.__dict__)
+        return network.clean_up_network(network_id, purge_data, **ctx.in_header.__dict__)
 
     @rpc(Integer, Integer, Integer(max_occurs="unbounded"), Unicode(pattern="['YN']", default='N'), _returns=SpyneArray(ResourceAttr))
     def get_all_node_data(ctx, network_id, scenario_id, node_ids, include_metadata):
@@ -0,0 +1,243 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import logging
+import urlparse
+import traceback
+import sys
+
+from HydraLib.HydraException import HydraError, PermissionError, ResourceNotFoundError
+from HydraServer.lib import network
+from HydraServer.db import commit_transaction, rollback_transaction, close_session
+
+log = logging.getLogger(__name__)
+
+class _WsgiApplication(object):
+    """
+        Base for the plain WSGI applications, which are mounted
+        alongside the spyne applications.
+    """
+
+    #Set on all the mounted applications by the server. These
+    #applications read their requests themselves, so ignore it.
+    max_content_length = None
+
+    def _get_user_id(self, environ):
+        session = environ.get('beaker.session')
+        if session is None:
+            return None
+        return session.get('user_id')
+
+    def _error(self, start_response, status, code, message):
+        start_response(status, [('Content-Type', 'application/json')])
+        return [json.dumps({'faultcode':code, 'faultstring':message})]
+
+class NetworkStreamApplication(_WsgiApplication):
+    """
+        A plain WSGI application which writes a network out as JSON
+        while it is being read from the DB, rather than building the
+        complete 'Network' complex model first.
+
+        The output is the same structure as the 'get_network' JSON response,
+        without the enclosing response wrapper.
+
+        Parameters are taken from the query string, or from a JSON
+        request body:
+            network_id:   ID of the network to retrieve
+            include_data: 'Y' or 'N'. Defaults to 'N'
+            scenario_ids: list (or comma separated string) of scenario IDs.
+            template_id:  Only include attributes from this template.
+
+        The user must already have logged in, using the session cookie
+        from the 'login' call.
+    """
+
+    def _get_params(self, environ):
+        params = {}
+        for k, v in urlparse.parse_qs(environ.get('QUERY_STRING', '')).items():
+            params[k] = v[0]
+
+        if environ.get('REQUEST_METHOD') == 'POST':
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            if length > 0:
+                body = json.loads(environ['wsgi.input'].read(length))
+                #Allow the request to be sent in the same format as the JSON RPC calls
+                if len(body) == 1 and isinstance(body.values()[0], dict):
+                    body = body.values()[0]
+                params.update(body)
+
+        return params
+
+    def __call__(self, environ, start_response):
+        user_id = self._get_user_id(environ)
+
+        if user_id is None:
+            return self._error(start_response, '403 Forbidden', 'Client.AuthenticationError', 'No Session!')
+
+        try:
+            params = self._get_params(environ)
+
+            if params.get('network_id') is None:
+                raise HydraError("No network_id specified.")
+
+            network_id = int(params['network_id'])
+
+            scenario_ids = params.get('scenario_ids')
+            if isinstance(scenario_ids, basestring):
+                scenario_ids = [int(s) for s in scenario_ids.split(',') if s.strip() != '']
+
+            template_id = params.get('template_id')
+            if template_id is not None:
+                template_id = int(template_id)
+
+            chunks = network.stream_network(network_id,
+                                            include_data=params.get('include_data', 'N'),
+                                            scenario_ids=scenario_ids,
+                                            template_id=template_id,
+                                            user_id=user_id)
+        except ResourceNotFoundError as e:
+            self._cleanup()
+            return self._error(start_response, '404 Not Found', 'NoObjectFoundError', e.message)
+        except PermissionError as e:
+            self._cleanup()
+            return self._error(start_response, '403 Forbidden', 'HydraError %s' % e.code, e.message)
+        except HydraError as e:
+            self._cleanup()
+            return self._error(start_response, '400 Bad Request', 'HydraError %s' % e.code, e.message)
+        except Exception as e:
+            log.critical(e)
+            traceback.print_exc(file=sys.stdout)
+            self._cleanup()
+            return self._error(start_response, '500 Internal Server Error', 'Server', str(e))
+
+        start_response('200 OK', [('Content-Type', 'application/json')])
+
+        return self._write(chunks)
+
+    def _write(self, chunks):
+        """
+            Pass the chunks on to the server. Once the headers have been
+            sent an error can no longer be reported to the client,
+            so it is just logged and the response is cut short.
+        """
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('utf-8')
+                yield chunk
+        except Exception as e:
+            log.critical("Error streaming network: %s", e)
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            self._cleanup()
+
+    def _cleanup(self):
+        #This is a read-only request, so there is nothing to commit.
+        rollback_transaction()
+        close_session()
+
+class NetworkImportApplication(_WsgiApplication):
+    """
+        A plain WSGI application which adds a network sent in chunks,
+        for networks too big to send, or to hold, as a single 'Network'
+        complex model.
+
+        The request body is a POST of JSON lines: each line is one chunk,
+        as described in HydraServer.lib.network.import_network. The body
+        is read a line at a time and each chunk is added before the
+        next line is read. The whole import is a single transaction, so
+        if any chunk fails, nothing is added.
+
+        The name of the app adding the network can be passed
+        as 'app_name' in the query string.
+
+        The response is the ID of the new network and the number of
+        each kind of item added.
+
+        The user must already have logged in, using the session cookie
+        from the 'login' call.
+    """
+
+    def _read_chunks(self, environ, position):
+        """
+            Read the request body a line at a time, without reading more
+            than the content length. position holds the current line
+            number, for reporting errors.
+        """
+        try:
+            remaining = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            remaining = 0
+
+        body = environ['wsgi.input']
+        while remaining > 0:
+            line = body.readline(remaining)
+            if line == '':
+                break
+            remaining = remaining - len(line)
+            position[0] = position[0] + 1
+
+            line = line.strip()
+            if line == '':
+                continue
+
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise HydraError("Invalid JSON: %s" % (e,))
+
+    def __call__(self, environ, start_response):
+        user_id = self._get_user_id(environ)
+
+        if user_id is None:
+            return self._error(start_response, '403 Forbidden', 'Client.AuthenticationError', 'No Session!')
+
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return self._error(start_response, '405 Method Not Allowed', 'Client', 'A network must be imported using POST.')
+
+        params = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+        app_name = params.get('app_name', [None])[0]
+
+        position = [0]
+        try:
+            result = network.import_network(self._read_chunks(environ, position),
+                                             user_id=user_id,
+                                             app_name=app_name)
+        except PermissionError as e:
+            rollback_transaction()
+            close_session()
+            return self._error(start_response, '403 Forbidden', 'HydraError %s' % e.code, e.message)
+        except HydraError as e:
+            rollback_transaction()
+            close_session()
+            return self._error(start_response, '400 Bad Request', 'HydraError %s' % e.code,
+                               "Line %s: %s" % (position[0], e.message))
+        except Exception as e:
+            log.critical(e)
+            traceback.print_exc(file=sys.stdout)
+            rollback_transaction()
+            close_session()
+            return self._error(start_response, '500 Internal Server Error', 'Server',
+                               "Line %s: %s" % (position[0], e))
+
+        commit_transaction()
+        close_session()
+
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(result)]
@@ -0,0 +1,79 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Compare the time taken by get_network when its queries are run one after
+    another and when they are run concurrently.
+
+    This talks to the DB in hydra.ini directly, rather than through the server,
+    so the difference is not hidden by the time taken to build the response.
+    Use an existing network, ideally a large one (test_load.py creates one):
+
+        python bench_get_network.py -n <network_id> -t 4 -r 5
+"""
+import argparse
+import timeit
+
+from HydraServer.db import connect
+connect()
+
+from HydraServer.db import rollback_transaction, close_session
+from HydraServer.lib import network
+
+def run_get_network(network_id, user_id, include_data, parallel):
+    network.network_cache.clear()
+    try:
+        network.get_network(network_id,
+                            include_data=include_data,
+                            parallel=parallel,
+                            user_id=user_id)
+    finally:
+        rollback_transaction()
+        close_session()
+
+def time_get_network(network_id, user_id, include_data, parallel, repeat):
+    timer = timeit.Timer(lambda: run_get_network(network_id, user_id, include_data, parallel))
+    #Warm up the connection pool and the DB's own caches first.
+    timer.timeit(number=1)
+    return min(timer.repeat(repeat=repeat, number=1))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark get_network.')
+    parser.add_argument('-n', '--network-id', type=int, required=True,
+                        help='ID of the network to retrieve')
+    parser.add_argument('-u', '--user-id', type=int, default=1,
+                        help='ID of a user who can read the network. Defaults to root.')
+    parser.add_argument('-t', '--threads', type=int, default=4,
+                        help='Number of threads for the concurrent queries')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of times to retrieve the network. The best time is reported.')
+    parser.add_argument('-d', '--include-data', default='Y', choices=['Y', 'N'],
+                        help='Whether to retrieve the scenario data')
+    args = parser.parse_args()
+
+    network._init_query_pool(args.threads)
+
+    serial = time_get_network(args.network_id, args.user_id, args.include_data, False, args.repeat)
+    parallel = time_get_network(args.network_id, args.user_id, args.include_data, True, args.repeat)
+
+    print "Serial:   %.3fs" % serial
+    print "Parallel: %.3fs (%s threads)" % (parallel, args.threads)
+    print "Speedup:  %.2fx" % (serial / parallel)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Compare the memory used by the network returned by get_network, which is
+    built from slotted records, with the same network built from dictobjs,
+    as get_network used to build it.
+
+    For each, this reports the number of objects allocated (as counted by the
+    garbage collector), the growth in the RSS of the process and the size
+    estimated by the network cache. The time for the records is that of
+    get_network as a whole, and for the dictobjs only that of building them
+    from the records. Use an existing network with data, ideally a large
+    one (test_load.py creates one):
+
+        python bench_network_records.py -n <network_id>
+"""
+import argparse
+import gc
+import resource
+import time
+
+from HydraServer.db import connect
+connect()
+
+from HydraServer.db import rollback_transaction, close_session
+from HydraServer.lib import network
+from HydraServer.lib.network import dictobj
+from HydraServer.util.cache import get_size
+
+def get_rss():
+    """
+        The current RSS of this process, in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        #Not Linux. Only the peak is available.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def as_dictobjs(net):
+    """
+        Rebuild the resources and data of a network the way get_network
+        did before records were used, with the three dictobjs per
+        resource scenario and per type.
+    """
+    def _types(types):
+        ret = []
+        for t in types:
+            resourcetype = dictobj({'type_id':t.type_id})
+            resourcetype.templatetype = dictobj(t._asdict())
+            resourcetype.templatetype.template = dictobj({'template_name':t.template_name})
+            ret.append(resourcetype)
+        return ret
+
+    def _resources(resources):
+        ret = []
+        for r in resources:
+            r_obj = dictobj(r._asdict())
+            r_obj.types = _types(r.types)
+            r_obj.attributes = [dictobj(a._asdict()) for a in r.attributes]
+            ret.append(r_obj)
+        return ret
+
+    def _resourcescenarios(all_rs):
+        ret = []
+        for rs in all_rs:
+            rs_obj = dictobj(rs.dataset._asdict())
+            rs_obj.update(rs._asdict())
+            rs_obj.resourceattr = dictobj({'attr_id':rs.attr_id})
+            rs_obj.dataset = dictobj(rs.dataset._asdict())
+            ret.append(rs_obj)
+        return ret
+
+    scenarios = []
+    for s in net.scenarios:
+        s_obj = dictobj(s._asdict())
+        s_obj.resourcescenarios = _resourcescenarios(s.resourcescenarios)
+        scenarios.append(s_obj)
+
+    return [_resources(net.nodes),
+            _resources(net.links),
+            _resources(net.resourcegroups),
+            scenarios]
+
+def measure(build):
+    """
+        Measure the objects allocated by a function, and the memory used by
+        what it returns while it is still held.
+    """
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    rss_before = get_rss()
+
+    x = time.time()
+    result = build()
+    elapsed = time.time() - x
+
+    gc.collect()
+    objects = len(gc.get_objects()) - objects_before
+    rss = get_rss() - rss_before
+    size = get_size(result)
+
+    return result, elapsed, objects, rss, size
+
+def report(name, elapsed, objects, rss, size):
+    print "%-9s %8.3fs %12s objects %10.1f MB RSS %10.1f MB estimated" % \
+        (name, elapsed, objects, rss / 1048576.0, size / 1048576.0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory used by get_network.')
+    parser.add_argument('-n', '--network-id', type=int, required=True,
+                        help='ID of the network to retrieve')
+    parser.add_argument('-u', '--user-id', type=int, default=1,
+                        help='ID of a user who can read the network. Defaults to root.')
+    args = parser.parse_args()
+
+    network.network_cache.clear()
+    try:
+        net, elapsed, objects, rss, size = measure(
+            lambda: network.get_network(args.network_id,
+                                        include_data='Y',
+                                        parallel=False,
+                                        user_id=args.user_id))
+    finally:
+        rollback_transaction()
+        close_session()
+    network.network_cache.clear()
+
+    print "%s nodes, %s links, %s resource scenarios" % \
+        (len(net.nodes), len(net.links), sum([len(s.resourcescenarios) for s in net.scenarios]))
+
+    report("Records", elapsed, objects, rss, size)
+
+    dictobjs, elapsed, objects, rss, size = measure(lambda: as_dictobjs(net))
+    report("dictobjs", elapsed, objects, rss, size)
+
+if __name__ == '__main__':
+    main()
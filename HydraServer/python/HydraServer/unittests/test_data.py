@@ -19,8 +19,10 @@
 import server
 import datetime
 import logging
+import urllib2
 from suds import WebFault
 import json
+from HydraLib import config
 log = logging.getLogger(__name__)
 
 class TimeSeriesTest(server.SoapServerTest):
@@ -228,6 +230,49 @@ class TimeSeriesTest(server.SoapServerTest):
         for val in data:
             assert original_val == val
 
+    def test_multiple_vals_at_single_time(self):
+        """
+            A single time gives a single value per dataset, keyed on the time,
+            or None if the time is before the start of the timeseries.
+        """
+        t1 = datetime.datetime(2010, 01, 01, 06, 00, 00)
+        t2 = t1 + datetime.timedelta(hours=1)
+
+        new_d = self.add_timeseries_dataset({"0": {t1.strftime(self.fmt): 1.5,
+                                                   t2.strftime(self.fmt): 2.25}})
+
+        qry_time = t2 + datetime.timedelta(minutes=30)
+        vals = self.client.service.get_multiple_vals_at_time(new_d.id, [qry_time])
+        return_val = json.loads(vals['dataset_%s'%new_d.id])
+        assert return_val == {str(qry_time): 2.25}
+
+        before_time = t1 - datetime.timedelta(minutes=30)
+        vals = self.client.service.get_multiple_vals_at_time(new_d.id, [before_time, qry_time])
+        return_val = json.loads(vals['dataset_%s'%new_d.id])
+        assert return_val[str(before_time)] is None
+        assert return_val[str(qry_time)] == 2.25
+
+    def test_multiple_vals_at_leap_day(self):
+        """
+            The seasonal year is not a leap year, so 29th February
+            takes the value for the 28th.
+        """
+        new_d = self.add_timeseries_dataset({"0": {'9999-01-01': 1.0,
+                                                   '9999-02-28': 2.0,
+                                                   '9999-03-01': 3.0}})
+
+        qry_times = [
+            datetime.datetime(2004, 02, 27, 12, 00, 00),
+            datetime.datetime(2004, 02, 29, 12, 00, 00),
+            datetime.datetime(2004, 03, 01, 12, 00, 00),
+            ]
+
+        vals = self.client.service.get_multiple_vals_at_time(new_d.id, qry_times)
+        return_val = json.loads(vals['dataset_%s'%new_d.id])
+        assert return_val[str(qry_times[0])] == 1.0
+        assert return_val[str(qry_times[1])] == 2.0
+        assert return_val[str(qry_times[2])] == 3.0
+
     def test_get_data_between_times(self):
         net = self.create_network_with_data()
         scenario = net.scenarios.Scenario[0]
@@ -259,6 +304,150 @@ class TimeSeriesTest(server.SoapServerTest):
             x = val_a
             assert x == val_a
 
+    def test_timeseries_storage(self):
+        """
+            Timeseries of numbers are stored in a binary format, so check
+            they come back as they went in, in full and at a given time.
+        """
+        t1 = datetime.datetime(2010, 01, 01, 06, 00, 00)
+        t2 = t1 + datetime.timedelta(hours=1)
+        t3 = t2 + datetime.timedelta(hours=1)
+
+        ts_val = {"0": {t1.strftime(self.fmt): 1.5,
+                        t2.strftime(self.fmt): 2.25,
+                        t3.strftime(self.fmt): None}}
+
+        dataset = self.client.factory.create('hyd:Dataset')
+        dataset.type = 'timeseries'
+        dataset.name = 'binary timeseries @ %s'%(datetime.datetime.now())
+        dataset.unit = 'm^3'
+        dataset.dimension = 'Volume'
+        dataset.value = json.dumps(ts_val)
+
+        new_d = self.client.service.add_dataset(dataset)
+        retrieved_d = self.client.service.get_dataset(new_d.id)
+
+        retrieved_val = json.loads(retrieved_d.value).values()[0]
+        assert retrieved_val[t1.strftime(self.fmt)] == 1.5
+        assert retrieved_val[t2.strftime(self.fmt)] == 2.25
+        assert retrieved_val[t3.strftime(self.fmt)] is None
+
+        val_at_time = self.client.service.get_val_at_time(new_d.id, t2 + datetime.timedelta(minutes=30))
+        assert json.loads(val_at_time.data) == 2.25
+
+        #The second read is of the cached value, so must give the same answer.
+        stats_before = self.client.service.get_value_cache_stats()
+        val_at_time = self.client.service.get_val_at_time(new_d.id, t2 + datetime.timedelta(minutes=30))
+        stats_after = self.client.service.get_value_cache_stats()
+        assert json.loads(val_at_time.data) == 2.25
+
+        if stats_before.max_bytes > 0:
+            assert stats_after.hits == stats_before.hits + 1
+
+    def test_integer_timeseries_storage(self):
+        """
+            Integer columns are stored as float64s in the binary format,
+            so check they come back as integers.
+        """
+        t1 = datetime.datetime(2010, 01, 01, 06, 00, 00)
+        t2 = t1 + datetime.timedelta(hours=1)
+
+        new_d = self.add_timeseries_dataset({"0": {t1.strftime(self.fmt): 1,
+                                                   t2.strftime(self.fmt): 2}})
+        retrieved_d = self.client.service.get_dataset(new_d.id)
+
+        retrieved_val = json.loads(retrieved_d.value).values()[0]
+        assert retrieved_val[t1.strftime(self.fmt)] == 1
+        assert isinstance(retrieved_val[t2.strftime(self.fmt)], int)
+
+    def test_long_timeseries_range(self):
+        """
+            Read a week of values, and values at single times, from a long
+            hourly timeseries, which is stored in chunks, so only the chunks
+            covering the times are read.
+        """
+        start = datetime.datetime(2010, 01, 01)
+        hours = [start + datetime.timedelta(hours=i) for i in range(24*500)]
+
+        chunk_rows = int(config.get('db', 'timeseries_chunk_rows', 0))
+        if chunk_rows <= 0 or chunk_rows > len(hours):
+            self.skipTest("Set timeseries_chunk_rows in [db] to at most %s "
+                          "for the server to split this timeseries."%len(hours))
+
+        #The values are the number of hours since the start, and its negative.
+        ts_val = {"0": dict((h.strftime(self.fmt), float(i)) for i, h in enumerate(hours)),
+                  "1": dict((h.strftime(self.fmt), float(-i)) for i, h in enumerate(hours))}
+
+        dataset = self.client.factory.create('hyd:Dataset')
+        dataset.type = 'timeseries'
+        dataset.name = 'hourly timeseries @ %s'%(datetime.datetime.now())
+        dataset.unit = 'm^3'
+        dataset.dimension = 'Volume'
+        dataset.value = json.dumps(ts_val)
+
+        new_d = self.client.service.add_dataset(dataset)
+
+        chunks = self.client.service.get_dataset_chunks(new_d.id).DatasetChunk
+        assert len(chunks) > 1
+        assert sum([c.num_rows for c in chunks]) == len(hours)
+        assert min([c.min_val for c in chunks]) == -(len(hours) - 1)
+        assert max([c.max_val for c in chunks]) == len(hours) - 1
+
+        #Reading from the chunks does not decode the whole timeseries, so
+        #the cache of decoded timeseries is not used at all.
+        stats_before = self.client.service.get_value_cache_stats()
+
+        val_at_time = self.client.service.get_val_at_time(new_d.id,
+                                                          hours[5000] + datetime.timedelta(minutes=30))
+        assert sorted(json.loads(val_at_time.data)) == [-5000.0, 5000.0]
+
+        val_at_time = self.client.service.get_val_at_time(new_d.id,
+                                                          start - datetime.timedelta(hours=1))
+        assert json.loads(val_at_time.data) is None
+
+        vals = self.client.service.get_vals_between_times(
+            new_d.id,
+            hours[9000],
+            hours[9000] + datetime.timedelta(days=7),
+            'hours',
+            1,
+            )
+
+        data = json.loads(vals.data)
+        assert len(data) == 24*7 + 1
+        assert [sorted(d) for d in data] == [[float(-i), float(i)] for i in range(9000, 9000 + 24*7 + 1)]
+
+        stats_after = self.client.service.get_value_cache_stats()
+        assert stats_after.hits == stats_before.hits
+        assert stats_after.misses == stats_before.misses
+
+    def test_resample_datasets(self):
+        """
+            Get the monthly mean and sum of a daily timeseries.
+        """
+        start = datetime.datetime(2010, 01, 01)
+        days = [start + datetime.timedelta(days=i) for i in range(59)]
+
+        #1 every day in January, 2 every day in February
+        ts_val = {"0": dict((d.strftime(self.fmt), float(d.month)) for d in days)}
+
+        dataset = self.client.factory.create('hyd:Dataset')
+        dataset.type = 'timeseries'
+        dataset.name = 'daily timeseries @ %s'%(datetime.datetime.now())
+        dataset.unit = 'm^3'
+        dataset.dimension = 'Volume'
+        dataset.value = json.dumps(ts_val)
+
+        new_d = self.client.service.add_dataset(dataset)
+
+        means = self.client.service.resample_datasets([new_d.id], 'M', 'mean')
+        monthly_means = json.loads(means['dataset_%s'%new_d.id])["0"]
+        assert sorted(monthly_means.values()) == [1.0, 2.0]
+
+        sums = self.client.service.resample_datasets([new_d.id], 'M', 'sum')
+        monthly_sums = json.loads(sums['dataset_%s'%new_d.id])["0"]
+        assert sorted(monthly_sums.values()) == [31.0, 56.0]
+
     def test_descriptor_get_data_between_times(self):
         net = self.create_network_with_data()
         scenario = net.scenarios.Scenario[0]
@@ -279,6 +468,19 @@ class TimeSeriesTest(server.SoapServerTest):
 
         assert json.loads(value.data) == ['test']
 
+    def add_timeseries_dataset(self, ts_val):
+        """
+            Add a standalone timeseries dataset with the given value.
+        """
+        dataset = self.client.factory.create('hyd:Dataset')
+        dataset.type = 'timeseries'
+        dataset.name = 'timeseries @ %s'%(datetime.datetime.now())
+        dataset.unit = 'm^3'
+        dataset.dimension = 'Volume'
+        dataset.value = json.dumps(ts_val)
+
+        return self.client.service.add_dataset(dataset)
+
     def create_seasonal_timeseries(self):
         """
             Create a timeseries which has relative timesteps:
@@ -658,6 +860,7 @@ class SharingTest(server.SoapServerTest):
         data = [x.value for x in scenario.resourcescenarios.ResourceScenario]
 
         data_to_hide = data[-1].id
+        hidden_value = data[-1].value
 
         self.client.service.hide_dataset(data_to_hide, ["UserB"], 'Y', 'Y', 'Y')
 
@@ -684,20 +887,40 @@ class SharingTest(server.SoapServerTest):
 
         self.login("UserC", 'password')
         #Check user C cannot see the dataset
-        netB = self.client.service.get_network(network_1.id)
+        netB = self.client.service.get_network(network_1.id, 'Y', 'N', 'Y')
 
         scenario = netB.scenarios.Scenario[0]
 
         data = [x.value for x in scenario.resourcescenarios.ResourceScenario]
 
+        #The hidden dataset is left out. The rest is unhidden, so should be there.
+        assert data_to_hide not in [d.id for d in data]
         for d in data:
-            if d.id == data_to_hide:
-                assert d.hidden == 'Y'
-                assert d.value is None
-            else:
-                #The rest of the data is unhidden, so should be there.
-                assert d.hidden == 'N'
-                assert d.value is not None
+            assert d.hidden == 'N'
+            assert d.value is not None
+
+        #The streamed network, read by the same user, has the same data
+        #as get_network, so the hidden value is not in it.
+        port = config.getint('hydra_server', 'port', '8080')
+        domain = config.get('hydra_server', 'domain', 'localhost')
+        path = config.get('hydra_server', 'stream_path', 'stream')
+        url = 'http://%s:%s/%s?network_id=%s&include_data=Y' % (domain, port, path, network_1.id)
+        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.client.options.transport.cookiejar))
+        streamed_text = opener.open(url).read()
+        streamed_network = json.loads(streamed_text)
+
+        streamed_scenario = [x for x in streamed_network['scenarios'] if x['id'] == scenario.id][0]
+        streamed_data = dict([(rs['value']['id'], rs['value'])
+                              for rs in streamed_scenario['resourcescenarios']])
+        assert data_to_hide not in streamed_data
+        assert sorted(streamed_data.keys()) == sorted([d.id for d in data])
+        for d in data:
+            streamed_d = streamed_data[d.id]
+            assert streamed_d['hidden'] == d.hidden
+            assert streamed_d['value'] == d.value
+
+        if hidden_value not in [d.value for d in data]:
+            assert json.dumps(hidden_value) not in streamed_text
 
         self.client.service.logout("UserC")
 
@@ -923,6 +1146,22 @@ class DataTest(server.SoapServerTest):
         val = json.loads(updated_dataset.value)
         assert val.values()[0][t1] == [110, 210, 310, 410, 510] 
 
+    def test_search_updated_dataset(self):
+        """
+            Check that a renamed dataset is found by its new name only.
+        """
+        new_dataset = self._make_timeseries()
+        old_name = new_dataset.name
+        new_dataset.name = 'renamed timeseries @ %s'%(datetime.datetime.now())
+
+        updated_dataset = self.client.service.update_dataset(new_dataset)
+
+        res = self.client.service.search_datasets(name=new_dataset.name)
+        assert updated_dataset.id in [d.id for d in res.Dataset]
+
+        res = self.client.service.search_datasets(name=old_name)
+        assert res == '' or updated_dataset.id not in [d.id for d in res.Dataset]
+
 class RetrievalTest(server.SoapServerTest):
 
     def _make_timeseries(self):
@@ -958,6 +1197,27 @@ class RetrievalTest(server.SoapServerTest):
 
         self.assertRaises(WebFault, self.client.service.get_dataset, int(dataset_1['id'])+1)
 
+    def test_add_duplicate_dataset(self):
+        """
+            Adding the same data twice should give the same dataset,
+            as identical data has an identical hash.
+        """
+        dataset = self.client.factory.create('hyd:Dataset')
+        dataset.type = 'descriptor'
+        dataset.name = u'Duplicate descriptor \xe9 @ %s'%(datetime.datetime.now())
+        dataset.unit = 'm'
+        dataset.dimension = 'Length'
+        dataset.value = 'duplicate value'
+
+        dataset_1 = self.client.service.add_dataset(dataset)
+        dataset_2 = self.client.service.add_dataset(dataset)
+
+        assert dataset_1.id == dataset_2.id
+
+        dataset.value = 'different value'
+        dataset_3 = self.client.service.add_dataset(dataset)
+        assert dataset_3.id != dataset_1.id
+
     def test_get_datasets(self):
         """
             Test to get a list of datasets by ID.
@@ -1227,6 +1487,11 @@ class RetrievalTest(server.SoapServerTest):
         assert 2.345 in val.values()
         assert 3.456 in val.values()
 
+        #Get the next page using the last dataset ID of the first.
+        res_2 = self.client.service.search_datasets(data_type='timeseries', metadata_val='search', page_size=1, last_dataset_id=res_1.Dataset[0].id)
+        assert len(res_2.Dataset) == 1
+        assert res_2.Dataset[0].id > res_1.Dataset[0].id
+
         res_1 = self.client.service.search_datasets(data_type='timeseries', metadata_val='search', page_start=1000)
         assert res_1 == ''
 
@@ -0,0 +1,121 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import server
+import logging
+import json
+import time
+import datetime
+from suds import WebFault
+log = logging.getLogger(__name__)
+
+class JobTest(server.SoapServerTest):
+    """
+        Test for running requests as jobs in Hydra
+    """
+
+    def wait_for_job(self, job_id, timeout=60):
+        """
+            Poll a job until it has finished or failed.
+        """
+        start = time.time()
+        while time.time() - start < timeout:
+            job = self.client.service.get_job_status(job_id)
+            if job.status in ('FINISHED', 'FAILED'):
+                return job
+            time.sleep(0.5)
+        self.fail("Job %s did not finish in %s seconds"%(job_id, timeout))
+
+    def test_clone_scenario_job(self):
+        net = self.create_network_with_data()
+        scenario = net.scenarios.Scenario[0]
+
+        #Make sure the server has a cached copy of the network, which
+        #must not be returned once the job has finished.
+        self.client.service.get_network(net.id)
+
+        job = self.client.service.queue_clone_scenario(scenario.id)
+        assert job.id is not None
+        assert job.job_type == 'clone_scenario'
+        assert job.status in ('QUEUED', 'RUNNING', 'FINISHED')
+
+        job = self.wait_for_job(job.id)
+        assert job.status == 'FINISHED'
+        assert job.progress == 100
+
+        result = json.loads(self.client.service.get_job_result(job.id))
+
+        updated_net = self.client.service.get_network(net.id)
+        scenario_ids = [s.id for s in updated_net.scenarios.Scenario]
+        assert result['scenario_id'] in scenario_ids
+
+    def test_collect_datasets_job(self):
+        """
+            Datasets which nothing uses should be deleted, unless they were
+            added too recently. Those used by a scenario should be kept.
+        """
+        network = self.create_network_with_data()
+        used_id = network.scenarios.Scenario[0].resourcescenarios.ResourceScenario[0].value.id
+
+        dataset = self.client.factory.create('ns1:Dataset')
+        dataset.type = 'descriptor'
+        dataset.name = 'Unused data'
+        dataset.unit = 'm'
+        dataset.dimension = 'Length'
+        dataset.value = 'unused @ %s'%(datetime.datetime.now())
+        unused = self.client.service.add_dataset(dataset)
+
+        #By default, a dataset added so recently is not deleted.
+        job = self.wait_for_job(self.client.service.queue_collect_datasets('N').id)
+        assert job.status == 'FINISHED'
+        assert self.client.service.get_dataset(unused.id).id == unused.id
+
+        job = self.wait_for_job(self.client.service.queue_collect_datasets('N', 0).id)
+        assert job.status == 'FINISHED'
+        result = json.loads(self.client.service.get_job_result(job.id))
+        assert result['deleted'] > 0
+
+        self.assertRaises(WebFault, self.client.service.get_dataset, unused.id)
+
+        used = self.client.service.get_dataset(used_id)
+        assert used.id == used_id
+
+    def test_failed_job(self):
+        job = self.client.service.queue_purge_network(-1, 'N')
+
+        job = self.wait_for_job(job.id)
+        assert job.status == 'FAILED'
+        assert job.message is not None
+
+        self.assertRaises(WebFault, self.client.service.get_job_result, job.id)
+
+    def test_job_permissions(self):
+        net = self.create_network_with_data()
+        job = self.client.service.queue_clone_scenario(net.scenarios.Scenario[0].id)
+
+        self.logout('root')
+        self.login("UserA", 'password')
+
+        self.assertRaises(WebFault, self.client.service.get_job_status, job.id)
+
+        self.logout("UserA")
+        self.login('root', '')
+        self.wait_for_job(job.id)
+
+if __name__ == '__main__':
+    server.run()
@@ -22,6 +22,8 @@ import logging
 import suds
 import datetime
 import json
+import urllib2
+from HydraLib import config
 log = logging.getLogger(__name__)
 
 class NetworkTest(server.SoapServerTest):
@@ -136,6 +138,193 @@ class NetworkTest(server.SoapServerTest):
         assert net_exists == 'Y'
         assert full_network.projection == 'EPSG:21781'
 
+    def test_stream_network(self):
+        """
+            Test that the streamed JSON network contains the same resources
+            and data as the network returned by get_network.
+        """
+        net = self.create_network_with_data()
+        full_network = self.client.service.get_network(net.id, 'Y')
+
+        port = config.getint('hydra_server', 'port', '8080')
+        domain = config.get('hydra_server', 'domain', 'localhost')
+        path = config.get('hydra_server', 'stream_path', 'stream')
+        url = 'http://%s:%s/%s?network_id=%s&include_data=Y' % (domain, port, path, net.id)
+
+        #Use the session cookie from the SOAP client.
+        cookiejar = self.client.options.transport.cookiejar
+        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookiejar))
+        streamed_network = json.loads(opener.open(url).read())
+
+        assert streamed_network['id'] == full_network.id
+        assert streamed_network['name'] == full_network.name
+        assert len(streamed_network['nodes']) == len(full_network.nodes.Node)
+        assert len(streamed_network['links']) == len(full_network.links.Link)
+        assert len(streamed_network['resourcegroups']) == len(full_network.resourcegroups.ResourceGroup)
+        assert len(streamed_network['scenarios']) == len(full_network.scenarios.Scenario)
+
+        node_attrs = dict([(n.id, len(n.attributes.ResourceAttr)) for n in full_network.nodes.Node])
+        for n in streamed_network['nodes']:
+            assert len(n['attributes']) == node_attrs[n['id']]
+
+        for s in full_network.scenarios.Scenario:
+            streamed_scenario = [x for x in streamed_network['scenarios'] if x['id'] == s.id][0]
+            assert len(streamed_scenario['resourcescenarios']) == len(s.resourcescenarios.ResourceScenario)
+            assert len(streamed_scenario['resourcegroupitems']) == \
+                    len(getattr(s.resourcegroupitems, 'ResourceGroupItem', []))
+
+        opener = urllib2.build_opener()
+        self.assertRaises(urllib2.HTTPError, opener.open, url)
+
+    def test_import_network(self):
+        """
+            Test that a network sent as JSON lines, with its nodes, links
+            and data spread across several chunks, is added in full.
+        """
+        project = self.create_project('Import project %s' % (datetime.datetime.now()))
+        net_attr = self.create_attr("import_net_attr")
+        node_attr = self.create_attr("import_node_attr")
+
+        node_chunks = []
+        for first in (1, 3):
+            node_chunks.append([{'id'         : -i,
+                                 'name'       : 'Imported Node %s' % i,
+                                 'description': 'A node sent in a chunk',
+                                 'x'          : i,
+                                 'y'          : i,
+                                 'attributes' : [{'id':-10-i, 'attr_id':node_attr.id, 'attr_is_var':'N'}]}
+                                for i in (first, first + 1)])
+
+        links = [{'id':-1, 'name':'Imported Link 1', 'node_1_id':-1, 'node_2_id':-2},
+                 {'id':-2, 'name':'Imported Link 2', 'node_1_id':-2, 'node_2_id':-3},
+                 {'id':-3, 'name':'Imported Link 3', 'node_1_id':-3, 'node_2_id':-4}]
+
+        chunks = [
+            {'network': {'project_id' : project.id,
+                         'name'       : 'Imported Network %s' % (datetime.datetime.now()),
+                         'description': 'A network imported in chunks',
+                         'attributes' : [{'id':-1, 'attr_id':net_attr.id, 'attr_is_var':'N'}]}},
+            {'nodes': node_chunks[0]},
+            {'nodes': node_chunks[1]},
+            {'links': links},
+            {'resourcegroups': [{'id':-1, 'name':'Imported Group'}]},
+            {'scenario': {'id':-1, 'name':'Imported Scenario'}},
+            {'resourcescenarios': {'scenario_id':-1,
+                                   'resourcescenarios':[{'resource_attr_id':-10-i,
+                                                         'value':{'type':'scalar', 'value':i * 1.5}}
+                                                        for i in (1, 2)]}},
+            {'resourcescenarios': {'scenario_id':-1,
+                                   'resourcescenarios':[{'resource_attr_id':-10-i,
+                                                         'value':{'type':'scalar', 'value':i * 1.5}}
+                                                        for i in (3, 4)]}},
+            {'resourcegroupitems': {'scenario_id':-1,
+                                    'resourcegroupitems':[{'group_id':-1, 'ref_key':'NODE', 'ref_id':-1},
+                                                          {'group_id':-1, 'ref_key':'LINK', 'ref_id':-2}]}},
+        ]
+
+        port = config.getint('hydra_server', 'port', '8080')
+        domain = config.get('hydra_server', 'domain', 'localhost')
+        path = config.get('hydra_server', 'import_path', 'import')
+        url = 'http://%s:%s/%s?app_name=import_test' % (domain, port, path)
+
+        cookiejar = self.client.options.transport.cookiejar
+        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookiejar))
+        body = "\n".join([json.dumps(c) for c in chunks])
+        result = json.loads(opener.open(url, body).read())
+
+        assert result['nodes'] == 4
+        assert result['links'] == 3
+        assert result['resourcescenarios'] == 4
+        assert result['resourcegroupitems'] == 2
+
+        imported_net = self.client.service.get_network(result['network_id'], 'Y')
+
+        assert len(imported_net.nodes.Node) == 4
+        assert len(imported_net.links.Link) == 3
+        assert len(imported_net.resourcegroups.ResourceGroup) == 1
+        assert imported_net.attributes.ResourceAttr[0].attr_id == net_attr.id
+
+        node_names = dict([(n.id, n.name) for n in imported_net.nodes.Node])
+        link_2 = [l for l in imported_net.links.Link if l.name == 'Imported Link 2'][0]
+        assert node_names[link_2.node_1_id] == 'Imported Node 2'
+        assert node_names[link_2.node_2_id] == 'Imported Node 3'
+
+        node_ras = {}
+        for n in imported_net.nodes.Node:
+            node_ras[n.attributes.ResourceAttr[0].id] = n.name
+
+        scenario = imported_net.scenarios.Scenario[0]
+        assert len(scenario.resourcescenarios.ResourceScenario) == 4
+        for rs in scenario.resourcescenarios.ResourceScenario:
+            i = int(node_ras[rs.resource_attr_id].split(' ')[-1])
+            assert float(rs.value.value) == i * 1.5
+        assert len(scenario.resourcegroupitems.ResourceGroupItem) == 2
+
+        #A link to a node which is not in the import fails the whole import.
+        bad_chunks = [dict(chunks[0]), {'nodes': node_chunks[0]},
+                      {'links': [{'id':-1, 'name':'Bad Link', 'node_1_id':-1, 'node_2_id':-99}]}]
+        bad_chunks[0]['network'] = dict(chunks[0]['network'], name='Bad Import %s' % (datetime.datetime.now()))
+        body = "\n".join([json.dumps(c) for c in bad_chunks])
+        self.assertRaises(urllib2.HTTPError, opener.open, url, body)
+
+        networks = self.client.service.get_networks(project.id, 'N')
+        assert len(networks.Network) == 1
+
+    def test_network_cache(self):
+        """
+            Test that a repeated get_network is served from the cache, and that
+            an edit to the network is seen by the next get_network.
+        """
+        net = self.create_network_with_data()
+
+        self.client.service.get_network(net.id)
+        stats_before = self.client.service.get_network_cache_stats()
+        self.client.service.get_network(net.id)
+        stats_after = self.client.service.get_network_cache_stats()
+
+        if stats_before.max_bytes > 0:
+            assert stats_after.hits == stats_before.hits + 1
+
+        node_to_update = net.nodes.Node[0]
+        node_to_update.name = "Cached Node Name"
+        self.client.service.update_node(node_to_update)
+
+        updated_network = self.client.service.get_network(net.id)
+        updated_node = [n for n in updated_network.nodes.Node if n.id == node_to_update.id][0]
+        assert updated_node.name == "Cached Node Name"
+
+    def test_get_network_changes(self):
+        """
+            Test that the nodes changed or deleted since a version of the
+            network are returned, and nothing else.
+        """
+        net = self.create_network_with_data()
+
+        version = self.client.service.get_network(net.id).version
+
+        no_changes = self.client.service.get_network_changes(net.id, version)
+        assert no_changes.version == version
+        assert no_changes.nodes is None
+
+        node_to_update = net.nodes.Node[0]
+        node_to_update.name = "Changed Node Name"
+        self.client.service.update_node(node_to_update)
+
+        changes = self.client.service.get_network_changes(net.id, version)
+        assert changes.version > version
+        assert [n.id for n in changes.nodes.Node] == [node_to_update.id]
+        assert changes.nodes.Node[0].name == "Changed Node Name"
+        assert changes.links is None
+
+        node_to_delete = net.nodes.Node[1]
+        self.client.service.delete_node(node_to_delete.id)
+
+        later_changes = self.client.service.get_network_changes(net.id, changes.version)
+        assert later_changes.nodes is None
+        deleted_nodes = [d.ref_id for d in later_changes.deleted.NetworkChange
+                         if d.ref_key == 'NODE']
+        assert deleted_nodes == [node_to_delete.id]
+
     def test_get_extents(self):
         """
         Extents test: Test that the min X, max X, min Y and max Y of a
@@ -150,6 +339,28 @@ class NetworkTest(server.SoapServerTest):
         assert extents.min_y == 9
         assert extents.max_y == 99
 
+    def test_get_resources_in_bbox(self):
+        """
+            Test that only the nodes within a bounding box are returned,
+            along with the links connected to them.
+        """
+        net = self.create_network_with_data()
+
+        min_x, min_y, max_x, max_y = 10, 9, 50, 50
+
+        expected_node_ids = [n.id for n in net.nodes.Node
+                             if min_x <= n.x <= max_x and min_y <= n.y <= max_y]
+        expected_link_ids = [l.id for l in net.links.Link
+                             if l.node_1_id in expected_node_ids or l.node_2_id in expected_node_ids]
+
+        resources = self.client.service.get_resources_in_bbox(net.id, min_x, min_y, max_x, max_y)
+
+        assert len(expected_node_ids) > 0
+        assert sorted([n.id for n in resources.nodes.Node]) == sorted(expected_node_ids)
+        assert sorted([l.id for l in resources.links.Link]) == sorted(expected_link_ids)
+
+        self.assertRaises(suds.WebFault, self.client.service.get_resources_in_bbox, net.id, max_x, min_y, min_x, max_y)
+
     def test_update(self):
         project = self.create_project('test')
         network = self.client.factory.create('hyd:Network')
@@ -228,6 +439,95 @@ class NetworkTest(server.SoapServerTest):
        #     'A different network for SOAP unit tests.', \
        #     "Update did not work correctly."
 
+    def test_update_changed_only(self):
+        """
+            Test that update_network only changes the nodes and links which
+            differ from those in the network, and that new nodes can be
+            linked to using their temporary IDs.
+        """
+        net = self.create_network_with_data()
+        net = self.client.service.get_network(net.id)
+        version = net.version
+
+        new_network = copy.deepcopy(net)
+        new_network.scenarios = None
+
+        changed_node = new_network.nodes.Node[0]
+        changed_node.x = changed_node.x + 1
+
+        new_node = self.client.factory.create('hyd:Node')
+        new_node.id = -1
+        new_node.name = 'New node in update'
+        new_node.description = 'A node added by update_network'
+        new_node.x = 1
+        new_node.y = 1
+        new_network.nodes.Node.append(new_node)
+
+        new_link = self.client.factory.create('hyd:Link')
+        new_link.id = -1
+        new_link.name = 'New link in update'
+        new_link.description = 'A link to the new node'
+        new_link.node_1_id = changed_node.id
+        new_link.node_2_id = -1
+        new_network.links.Link.append(new_link)
+
+        self.client.service.update_network(new_network)
+
+        changes = self.client.service.get_network_changes(net.id, version)
+        changed_nodes = dict([(n.name, n) for n in changes.nodes.Node])
+        assert sorted(changed_nodes.keys()) == sorted([changed_node.name, new_node.name])
+        assert changed_nodes[changed_node.name].x == changed_node.x
+
+        assert len(changes.links.Link) == 1
+        assert changes.links.Link[0].name == new_link.name
+        assert changes.links.Link[0].node_2_id == changed_nodes[new_node.name].id
+
+        duplicate_network = self.client.service.get_network(net.id)
+        duplicate_network.scenarios = None
+        duplicate_network.nodes.Node[1].name = duplicate_network.nodes.Node[0].name
+        self.assertRaises(suds.WebFault, self.client.service.update_network, duplicate_network)
+
+    def test_clone_network(self):
+        net = self.create_network_with_data()
+        net = self.client.service.get_network(net.id)
+
+        cloned_net = self.client.service.clone_network(net.id)
+        assert cloned_net.id != net.id
+        assert cloned_net.name == "%s (clone)"%(net.name,)
+        assert cloned_net.project_id == net.project_id
+
+        cloned_net = self.client.service.get_network(cloned_net.id)
+
+        nodes = dict([(n.name, n) for n in net.nodes.Node])
+        cloned_nodes = dict([(n.name, n) for n in cloned_net.nodes.Node])
+        assert sorted(nodes.keys()) == sorted(cloned_nodes.keys())
+        assert len(set(n.id for n in nodes.values()) & set(n.id for n in cloned_nodes.values())) == 0
+
+        node_names = dict([(n.id, n.name) for n in net.nodes.Node])
+        cloned_node_names = dict([(n.id, n.name) for n in cloned_net.nodes.Node])
+        links = sorted([(l.name, node_names[l.node_1_id], node_names[l.node_2_id])
+                        for l in net.links.Link])
+        cloned_links = sorted([(l.name, cloned_node_names[l.node_1_id], cloned_node_names[l.node_2_id])
+                               for l in cloned_net.links.Link])
+        assert links == cloned_links
+
+        assert len(cloned_net.resourcegroups.ResourceGroup) == len(net.resourcegroups.ResourceGroup)
+        assert len(cloned_net.attributes.ResourceAttr) == len(net.attributes.ResourceAttr)
+
+        scenario = net.scenarios.Scenario[0]
+        cloned_scenario = cloned_net.scenarios.Scenario[0]
+        assert cloned_scenario.name == scenario.name
+        assert cloned_scenario.id != scenario.id
+
+        #The data is shared between the two networks, not copied
+        dataset_ids = sorted([rs.value.id for rs in scenario.resourcescenarios.ResourceScenario])
+        cloned_dataset_ids = sorted([rs.value.id for rs in cloned_scenario.resourcescenarios.ResourceScenario])
+        assert dataset_ids == cloned_dataset_ids
+        assert len(cloned_scenario.resourcegroupitems.ResourceGroupItem) == \
+                len(scenario.resourcegroupitems.ResourceGroupItem)
+
+        self.assertRaises(suds.WebFault, self.client.service.clone_network, net.id, cloned_net.name)
+
 ############################################################
     def test_add_links(self):
 
@@ -751,6 +1051,46 @@ class NetworkTest(server.SoapServerTest):
 
         self.assertRaises(suds.WebFault, self.client.service.get_network, network.id)
 
+    def test_purge_with_data(self):
+        net = self.create_network_with_data()
+        scenario = net.scenarios.Scenario[0]
+        node = net.nodes.Node[0]
+
+        #The test data is shared with other networks, so give the network
+        #data of its own: one dataset used only by it, which is deleted,
+        #and one which is also in a collection, which is kept.
+        dataset_ids = []
+        for rs in scenario.resourcescenarios.ResourceScenario[:2]:
+            dataset = self.client.factory.create('ns1:Dataset')
+            dataset.type = 'descriptor'
+            dataset.name = 'Purged data'
+            dataset.unit = 'metres / second'
+            dataset.dimension = 'number of units per time unit'
+            dataset.value = 'purge test %s %s'%(rs.resource_attr_id, datetime.datetime.now())
+            new_rs = self.client.service.add_data_to_attribute(scenario.id,
+                                                               rs.resource_attr_id,
+                                                               dataset)
+            dataset_ids.append(new_rs.value.id)
+        unused_id, collected_id = dataset_ids
+
+        collection = self.client.factory.create('ns1:DatasetCollection')
+        collection_dataset_ids = self.client.factory.create("integerArray")
+        collection_dataset_ids.integer.append(collected_id)
+        collection.dataset_ids = collection_dataset_ids
+        collection.name = 'purge test collection %s'%(datetime.datetime.now())
+        collection = self.client.service.add_dataset_collection(collection)
+
+        self.client.service.purge_network(net.id, 'Y')
+
+        self.assertRaises(suds.WebFault, self.client.service.get_network, net.id)
+        self.assertRaises(suds.WebFault, self.client.service.get_scenario, scenario.id)
+        self.assertRaises(suds.WebFault, self.client.service.get_node, node.id)
+
+        self.assertRaises(suds.WebFault, self.client.service.get_dataset, unused_id)
+        assert self.client.service.get_dataset(collected_id).id == collected_id
+        collection_datasets = self.client.service.get_collection_datasets(collection.id)
+        assert collected_id in [d.id for d in collection_datasets.Dataset]
+
     def test_get_node(self):
         network = self.create_network_with_data()
         n = network.nodes.Node[0]
@@ -172,7 +172,14 @@ class ProjectTest(server.SoapServerTest):
         assert len(test_net.links.Link) > 0
 
         assert len(nets.Network) == 2, "Networks were not retrieved correctly"
-        
+
+        #The networks are read together, so check each has only its own resources.
+        for net in nets.Network:
+            single_net = self.client.service.get_network(net.id)
+            assert sorted([n.id for n in net.nodes.Node]) == sorted([n.id for n in single_net.nodes.Node])
+            assert sorted([l.id for l in net.links.Link]) == sorted([l.id for l in single_net.links.Link])
+            assert sorted([s.id for s in net.scenarios.Scenario]) == sorted([s.id for s in single_net.scenarios.Scenario])
+
         nets = self.client.service.get_networks(proj.id, 'N')
 
         test_scenario = nets[0][0].scenarios.Scenario[0]
@@ -2,13 +2,21 @@ import logging
 log = logging.getLogger(__name__)
 
 from decimal import Decimal
+import numpy as np
 import pandas as pd
 import zlib
 import json
+import hashlib
+import struct
 from HydraLib import config
+from HydraServer.util.dataformat import read_timeseries, canonical_value
+from HydraServer.util.cache import LRUCache
 
 from collections import namedtuple
 
+#Cache of decoded timeseries values, shared by everything which uses get_val.
+value_cache = LRUCache(int(config.get('cache', 'value_cache_size', 128)) * 0x100000)
+
 def to_named_tuple(keys, values):
     """
         Convert a sqlalchemy object into a named tuple
@@ -24,27 +32,130 @@ def to_named_tuple(keys, values):
 
     
 
+def _update_hash(data_hash, val):
+    """
+        Add one field to a hash. Each field is preceded by its length, so
+        that the boundaries between fields are part of what is hashed.
+    """
+    if val is None:
+        data_hash.update('\xff')
+        return
+
+    if isinstance(val, unicode):
+        val = val.encode('utf-8')
+    elif not isinstance(val, str):
+        val = unicode(val).encode('utf-8')
+
+    data_hash.update(struct.pack('<Q', len(val)))
+    data_hash.update(val)
+
 def generate_data_hash(dataset_dict):
+    """
+        Generate the hash used to identify identical datasets.
 
+        The fields are fed into the hash one at a time, so large values
+        are not copied, and the result is the same on every platform and
+        in every process. It is the first 64 bits of a SHA-256 digest,
+        as a signed integer, to fit in tDataset.data_hash. The value is
+        hashed uncompressed, so the hash does not depend on the
+        compression_threshold of the server which stored it.
+    """
     d = dataset_dict
     if d.get('metadata') is None:
         d['metadata'] = {}
 
-    hash_string = "%s %s %s %s %s %s"%(
-                                str(d['data_name'].encode('utf-8')),
-                                str(d['data_units'].encode('utf-8')),
-                                str(d['data_dimen'].encode('utf-8')),
-                                str(d['data_type']),
-                                d['value'],
-                                d['metadata'])
+    data_hash = hashlib.sha256()
+
+    for field in ('data_name', 'data_units', 'data_dimen', 'data_type'):
+        _update_hash(data_hash, d.get(field))
+    _update_hash(data_hash, canonical_value(d.get('data_type'), d.get('value')))
+
+    metadata = d['metadata']
+    if isinstance(metadata, basestring):
+        metadata = json.loads(metadata)
+    for k in sorted(metadata.keys()):
+        _update_hash(data_hash, k)
+        _update_hash(data_hash, metadata[k])
 
-    log.debug("Generating data hash from: %s", hash_string)
+    hash_val = struct.unpack('<q', data_hash.digest()[:8])[0]
 
-    data_hash  = hash(hash_string)
+    log.debug("Data hash: %s", hash_val)
 
-    log.debug("Data hash: %s", data_hash)
+    return hash_val
+
+def get_trigrams(text):
+    """
+        Get the set of three-character substrings of a piece of text,
+        ignoring case, as used to index datasets for searching.
+        Each is packed into an integer, as the character codes can be stored
+        and compared that way whatever the database's collation.
+    """
+    if text is None:
+        return set()
+
+    if not isinstance(text, unicode):
+        text = str(text).decode('utf-8', 'replace')
+    text = text.lower()
+
+    trigrams = set()
+    for i in range(len(text) - 2):
+        trigrams.add((ord(text[i]) << 42) | (ord(text[i+1]) << 21) | ord(text[i+2]))
+
+    return trigrams
+
+def get_dataset_trigrams(data_name, metadata):
+    """
+        Get the (field, trigram) pairs by which a dataset with the given
+        name and metadata dictionary is found in tDatasetTrigram.
+    """
+    dataset_trigrams = set()
+    for trigram in get_trigrams(data_name):
+        dataset_trigrams.add(('name', trigram))
+
+    for metadata_name, metadata_val in metadata.items():
+        for trigram in get_trigrams(metadata_name):
+            dataset_trigrams.add(('metadata_name', trigram))
+        for trigram in get_trigrams(metadata_val):
+            dataset_trigrams.add(('metadata_val', trigram))
+
+    return dataset_trigrams
+
+def _get_timeseries(dataset):
+    """
+        Get the value of a timeseries dataset as a pandas dataframe, from
+        value_cache if it has already been decoded.
+
+        The cache is keyed on the dataset's ID and hash, so an edited dataset,
+        which has a new hash, is decoded afresh. A copy is returned, so the
+        caller is free to change it. The value of a dataset from the DB is
+        deferred, so it is only read from the DB if it is not in the cache.
+        Returns None if there is no value, as for a hidden dataset.
+    """
+    dataset_id = getattr(dataset, 'dataset_id', None)
+    data_hash  = getattr(dataset, 'data_hash', None)
 
-    return data_hash
+    #A value set to None is a hidden dataset the user cannot see,
+    #so must not be served from the cache. An unread deferred value
+    #is not in __dict__, so checking it here does not read it.
+    loaded = getattr(dataset, '__dict__', {})
+    if 'value' in loaded and loaded['value'] is None:
+        return None
+
+    if dataset_id is None or data_hash is None:
+        if dataset.value is None:
+            return None
+        return read_timeseries(dataset.value)
+
+    key = (dataset_id, data_hash)
+    timeseries = value_cache.get(key)
+    if timeseries is None:
+        if dataset.value is None:
+            return None
+        timeseries = read_timeseries(dataset.value)
+        value_cache.put(key, timeseries,
+                        size=int(timeseries.memory_usage(index=True, deep=True).sum()))
+
+    return timeseries.copy()
 
 def get_val(dataset, timestamp=None):
     """
@@ -76,17 +187,12 @@ def get_val(dataset, timestamp=None):
         return Decimal(str(dataset.value))
     elif dataset.data_type == 'timeseries':
 
-        try:
-            #The data might be compressed.
-            val = zlib.decompress(dataset.value)
-        except Exception as e:
-            val = dataset.value
-
         seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
-        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
-        val = dataset.value.replace(seasonal_key, seasonal_year)
-        
-        timeseries = pd.read_json(val)
+
+        timeseries = _get_timeseries(dataset)
+
+        if timeseries is None:
+            return None
 
         if timestamp is None:
             return timeseries
@@ -140,3 +246,62 @@ def get_val(dataset, timestamp=None):
             except Exception as e:
                 log.critical("Unable to retrive data. Check timestamps.")
                 log.critical(e)
+
+def get_seasonal_times(times):
+    """
+        Move an array of times into the year in which seasonal timeseries
+        are stored. 29th February becomes the 28th, as the seasonal year
+        is not a leap year.
+    """
+    seasonal_year = int(config.get('DEFAULT','seasonal_year', '1678'))
+
+    times = pd.DatetimeIndex(times)
+    days = np.where((times.month == 2) & (times.day == 29), 28, times.day)
+    seasonal_dates = pd.to_datetime(pd.DataFrame({'year'  : seasonal_year,
+                                                  'month' : times.month,
+                                                  'day'   : days}))
+
+    return (pd.DatetimeIndex(seasonal_dates) + (times - times.normalize())).values
+
+def get_vals_at_times(timeseries, times, seasonal_times=None):
+    """
+        Look up an array of times (numpy datetime64[ns]) in a timeseries
+        using a single binary search, rather than reindexing it.
+
+        As with get_val, each time takes the value at or before it, or None
+        if it is before the start of the timeseries. If the timeseries is
+        seasonal, seasonal_times, the same times moved into the seasonal year
+        by get_seasonal_times, are looked up instead.
+
+        Returns a list with a value per time (a list of values if the
+        timeseries has more than one column), or None if there are no
+        values at all.
+    """
+    idx = timeseries.index
+    if type(idx) != pd.DatetimeIndex or len(idx) == 0:
+        return None
+
+    if not idx.is_monotonic_increasing:
+        timeseries = timeseries.sort_index()
+        idx = timeseries.index
+
+    if seasonal_times is not None:
+        seasonal_year = int(config.get('DEFAULT','seasonal_year', '1678'))
+        if idx[0].year == seasonal_year and idx[-1].year == seasonal_year:
+            times = seasonal_times
+
+    positions = idx.values.searchsorted(times, side='right') - 1
+    before_start = positions < 0
+    positions[before_start] = 0
+
+    vals = timeseries.values[positions].astype(object)
+    vals[before_start] = np.nan
+
+    is_null = pd.isnull(vals)
+    if is_null.all():
+        return None
+    vals[is_null] = None
+
+    if vals.shape[1] == 1:
+        return vals[:, 0].tolist()
+    return vals.tolist()
@@ -0,0 +1,150 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    In-process caches.
+
+    The caches live in the server process. What is cached is keyed on the
+    versions in HydraServer.util.changelog, which are stored in the DB, so an
+    edit made by another process invalidates the cached copies once it is
+    committed, as does an edit made by this one.
+"""
+import sys
+import threading
+import logging
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+def get_size(obj, seen=None):
+    """
+        Estimate the number of bytes used by an object, including
+        the objects it contains.
+    """
+    if seen is None:
+        seen = set()
+
+    obj_id = id(obj)
+    if obj_id in seen:
+        return 0
+    seen.add(obj_id)
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, (basestring, int, long, float, bool)) or obj is None:
+        return size
+
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += get_size(k, seen)
+            size += get_size(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += get_size(v, seen)
+    elif hasattr(obj, 'keys') and hasattr(obj, '__getitem__'):
+        #SQLAlchemy result rows
+        for k in obj.keys():
+            size += get_size(obj[k], seen)
+    elif hasattr(obj, '__dict__'):
+        size += get_size(obj.__dict__, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            size += get_size(getattr(obj, name, None), seen)
+
+    return size
+
+class LRUCache(object):
+    """
+        A thread-safe least-recently-used cache, bounded by the total
+        estimated size of its values, in bytes.
+
+        A max_bytes of 0 disables the cache.
+    """
+    def __init__(self, max_bytes, sizeof=get_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        #Only a check, so it counts as neither a hit nor a use.
+        with self._lock:
+            return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return default
+            #Re-insert at the end, to mark it as the most recently used.
+            self._items[key] = item
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size=None):
+        if self.max_bytes <= 0:
+            return
+
+        if size is None:
+            size = self.sizeof(value)
+
+        if size > self.max_bytes:
+            log.debug("Not caching %s. Too large (%s bytes)", key, size)
+            return
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+            self._items[key] = (value, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                k, (v, s) = self._items.popitem(last=False)
+                self.current_bytes -= s
+                self.evictions += 1
+
+    def remove_where(self, fn):
+        """
+            Remove all the entries whose key matches the given function.
+        """
+        with self._lock:
+            for key in [k for k in self._items if fn(k)]:
+                v, s = self._items.pop(key)
+                self.current_bytes -= s
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries'   : len(self._items),
+                'bytes'     : self.current_bytes,
+                'max_bytes' : self.max_bytes,
+                'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions,
+                'hit_rate'  : float(self.hits) / requests if requests > 0 else 0.0,
+            }
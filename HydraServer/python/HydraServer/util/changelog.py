@@ -0,0 +1,243 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    The log of changes made to the resources, attributes and data of each
+    network, so a client holding a copy of a network can find out what has
+    changed since, rather than retrieving the whole network again.
+
+    Each change made to a network is given the next version of that network.
+    The entries record which things changed, not what they changed to, as the
+    client only needs to know what to retrieve again.
+
+    The ref_keys recorded are:
+        NODE, LINK, GROUP: The ref_id is the node, link or group ID
+        RESOURCEATTR:      The ref_id is the resource attribute ID
+        SCENARIO:          The scenario changed as a whole, or its group items
+                           changed. The ref_id is the scenario ID
+        RESOURCESCENARIO:  The ref_id is the resource attribute ID, in the scenario
+                           given by scenario_id.
+        NETWORK:           Not a change, but a marker left by
+                           HydraServer.db.prune_changes, which removes old
+                           entries. Its version is the latest removed, so a
+                           client with an earlier version must retrieve the
+                           whole network again.
+
+    The log grows with every change, so should be pruned periodically.
+
+    The version of a network is also changed by edits which are not logged,
+    such as to who can see it, and is used to invalidate the cached copies of
+    the network (see HydraServer.util.cache). The templates and the datasets
+    as a whole have versions of their own, in tCacheVersion, as an edit to
+    either can change any network which uses them.
+"""
+import logging
+
+from sqlalchemy import func
+
+from HydraServer.db import DBSession
+from HydraServer.db.model import Network, NetworkChange, CacheVersion
+
+log = logging.getLogger(__name__)
+
+def _mark_changed(key):
+    DBSession.info.setdefault('changed_versions', set()).add(key)
+
+def is_changed(key):
+    """
+        Check whether the version of something has been changed by the
+        current transaction. The new version is not yet committed, and is
+        given again if the transaction is rolled back, so nothing read by
+        the transaction should be cached under it.
+    """
+    return key in DBSession.info.get('changed_versions', ())
+
+def get_version(key):
+    """
+        Get the current version of something other than a network which
+        can be cached. The version changes each time the thing is edited.
+    """
+    version = DBSession.query(CacheVersion.version).filter(
+                                CacheVersion.version_key==key).scalar()
+    return version if version is not None else 0
+
+def bump_version(key):
+    """
+        Mark something other than a network as having been changed.
+        The new version is seen by other transactions once the current
+        transaction commits.
+    """
+    version_tbl = CacheVersion.__table__
+    res = DBSession.execute(version_tbl.update().where(
+                                version_tbl.c.version_key==key).values(
+                                version=version_tbl.c.version + 1))
+    if res.rowcount == 0:
+        #The versions are normally added when the server starts.
+        #See HydraServer.util.hdb.create_default_cache_versions
+        DBSession.execute(version_tbl.insert(), {'version_key':key, 'version':1})
+
+    _mark_changed(key)
+
+def get_data_version():
+    """
+        Get the current version of the datasets as a whole. This changes
+        when a dataset is edited in place or its visibility changes, as this
+        can affect any network which uses the dataset.
+    """
+    return get_version('DATA')
+
+def bump_data_version():
+    bump_version('DATA')
+
+def get_template_version():
+    """
+        Get the current version of the templates as a whole. This changes when
+        a template or template type is edited, as this can change the types
+        shown on any network which uses the template.
+    """
+    return get_version('TEMPLATE')
+
+def bump_template_version():
+    bump_version('TEMPLATE')
+
+def get_change_version(network_id):
+    """
+        Get the version of the most recent change to a network.
+        This is 0 if the network has not been changed since it was added.
+    """
+    version = DBSession.query(Network.version).filter(
+                                Network.network_id==network_id).scalar()
+    return version if version is not None else 0
+
+def get_change_versions(network_ids):
+    """
+        Get the version of the most recent change to each of several
+        networks, as a dictionary keyed on network ID.
+    """
+    versions = dict([(network_id, 0) for network_id in network_ids])
+
+    qry = DBSession.query(Network.network_id,
+                          Network.version).filter(
+                              Network.network_id.in_(network_ids))
+
+    for network_id, version in qry.all():
+        versions[network_id] = version
+
+    return versions
+
+def bump_network_version(network_id):
+    """
+        Mark a network as having been changed, and return its new version.
+    """
+    if network_id is None:
+        return None
+
+    #Incrementing the counter locks the network until the transaction ends,
+    #so changes to the same network are given versions in the order in which
+    #they are committed. Otherwise a client could see a later version before
+    #an earlier one had been committed, and miss the earlier change. The
+    #update is made to the latest committed row, not the transaction's
+    #snapshot, so two transactions can't be given the same version.
+    network_tbl = Network.__table__
+    DBSession.execute(network_tbl.update().where(
+                        network_tbl.c.network_id==network_id).values(
+                        version=network_tbl.c.version + 1))
+
+    _mark_changed(('NETWORK', network_id))
+
+    return get_change_version(network_id)
+
+def is_network_changed(network_id):
+    return is_changed(('NETWORK', network_id))
+
+def record_changes(network_id, ref_key, ref_ids, change_type='UPDATE', scenario_id=None):
+    """
+        Record that some things in a network have changed.
+
+        ref_key:     NODE, LINK, GROUP, RESOURCEATTR, SCENARIO or RESOURCESCENARIO
+        ref_ids:     A list of IDs, or a single ID
+        change_type: INSERT, UPDATE or DELETE
+        scenario_id: The scenario containing the resource scenarios,
+                     for RESOURCESCENARIO changes.
+
+        The entries are inserted as part of the current transaction, so
+        disappear along with the change itself if it is rolled back.
+    """
+    if network_id is None:
+        return
+
+    if not isinstance(ref_ids, (list, tuple, set)):
+        ref_ids = [ref_ids]
+
+    ref_ids = set([ref_id for ref_id in ref_ids if ref_id is not None])
+    if len(ref_ids) == 0:
+        return
+
+    version = bump_network_version(network_id)
+
+    changes = []
+    for ref_id in ref_ids:
+        changes.append({
+            'network_id'  : network_id,
+            'version'     : version,
+            'ref_key'     : ref_key,
+            'ref_id'      : ref_id,
+            'scenario_id' : scenario_id,
+            'change_type' : change_type,
+        })
+
+    DBSession.execute(NetworkChange.__table__.insert(), changes)
+
+    log.debug("%s %s changes recorded in network %s at version %s",
+              len(changes), ref_key, network_id, version)
+
+def get_changes(network_id, since_version):
+    """
+        Get the entries in the log made after the specified version of a
+        network. Where something has changed more than once, only the
+        latest entry is returned.
+    """
+    qry = DBSession.query(NetworkChange.version,
+                          NetworkChange.ref_key,
+                          NetworkChange.ref_id,
+                          NetworkChange.scenario_id,
+                          NetworkChange.change_type).filter(
+                              NetworkChange.network_id==network_id,
+                              NetworkChange.ref_key != 'NETWORK',
+                              NetworkChange.version > since_version).order_by(
+                              NetworkChange.version)
+
+    latest = {}
+    for change in DBSession.execute(qry.statement).fetchall():
+        latest[(change.ref_key, change.ref_id, change.scenario_id)] = change
+
+    return sorted(latest.values(), key=lambda c: c.version)
+
+def get_pruned_version(network_id):
+    """
+        Get the latest version of a network whose changes have been removed
+        from the log, or 0 if none have been.
+    """
+    version = DBSession.query(func.max(NetworkChange.version)).filter(
+                                NetworkChange.network_id==network_id,
+                                NetworkChange.ref_key=='NETWORK').scalar()
+    return version if version is not None else 0
+
+def delete_changes(network_id):
+    """
+        Remove the log of a network, when the network itself is being deleted.
+    """
+    DBSession.query(NetworkChange).filter(
+        NetworkChange.network_id==network_id).delete(synchronize_session=False)
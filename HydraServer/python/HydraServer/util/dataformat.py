@@ -0,0 +1,327 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    The formats in which dataset values are stored in tDataset.value.
+
+    Descriptors, scalars and arrays are stored as text, arrays being JSON
+    which is zlib-compressed when it is large. Timeseries used to be stored
+    the same way, as the JSON written by pandas' to_json, which is slow to
+    parse. They are now stored in a binary format, read straight into numpy:
+
+        byte 0      0x00, marking a binary value. Neither JSON text nor
+                    a zlib stream can start with it.
+        byte 1      The format type. FORMAT_TIMESERIES is the only one.
+        byte 2      Flags. FLAG_COMPRESSED means the body is zlib-compressed.
+                    FLAG_DTYPES means not every column is float64.
+        body        The number of rows, the number of columns and the length
+                    of the column names, as little-endian uint32s, then the
+                    column names, as JSON, then, with FLAG_DTYPES, the length
+                    of the column types, as a uint32, and the numpy types of
+                    the columns, as JSON, then the index as int64 nanoseconds
+                    since the epoch, then each column in turn as float64s.
+                    Columns of other types are converted back on reading.
+
+    Timeseries which cannot be stored this way, such as those with relative
+    or seasonal times or non-numeric values, are still stored as JSON.
+    Existing JSON values can be converted using
+    HydraServer.db.migrate_timeseries.
+
+    Large binary timeseries are also stored split into windows of time in
+    tDatasetChunk, each window in the same binary format, so a range of
+    times can be read without decoding the whole timeseries. Existing
+    timeseries can be split using HydraServer.db.chunk_timeseries.
+"""
+import struct
+import zlib
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from HydraLib import config
+
+log = logging.getLogger(__name__)
+
+BINARY_MARKER = '\x00'
+
+FORMAT_TIMESERIES = 1
+
+FLAG_COMPRESSED = 1
+FLAG_DTYPES = 2
+
+_header = struct.Struct('<ccB')
+_timeseries_header = struct.Struct('<III')
+_dtypes_header = struct.Struct('<I')
+
+#Integers beyond this are not stored exactly as float64s.
+_max_exact_int = 2**53
+
+def _compression_threshold():
+    return int(config.get('db', 'compression_threshold', 1000))
+
+def is_binary(value):
+    """
+        Is a stored value in one of the binary formats?
+    """
+    return value is not None and len(value) >= _header.size and value[0] == BINARY_MARKER
+
+def _can_encode_timeseries(timeseries):
+    if len(timeseries) == 0:
+        return False
+
+    if not isinstance(timeseries.index, pd.DatetimeIndex) or timeseries.index.tz is not None:
+        return False
+
+    for col_idx, dtype in enumerate(timeseries.dtypes):
+        if np.issubdtype(dtype, np.floating) or np.issubdtype(dtype, np.bool_):
+            continue
+        if not np.issubdtype(dtype, np.integer):
+            return False
+        col_values = timeseries.iloc[:, col_idx].values
+        if col_values.max() > _max_exact_int or col_values.min() < -_max_exact_int:
+            return False
+
+    return True
+
+def encode_timeseries(timeseries):
+    """
+        Turn a pandas dataframe into the value stored in tDataset.
+        This is the binary format if the timeseries allows it, and JSON
+        (compressed if it is large) otherwise.
+    """
+    column_names = None
+    if _can_encode_timeseries(timeseries):
+        try:
+            column_names = json.dumps(list(timeseries.columns))
+        except (TypeError, ValueError):
+            pass
+
+    if column_names is None:
+        #Epoch doesn't work here because dates before 1970 are not supported
+        #in read_json.
+        json_value = timeseries.to_json(date_format='iso', date_unit='ns')
+        if len(json_value) > _compression_threshold():
+            return zlib.compress(json_value)
+        return json_value
+
+    num_rows, num_cols = timeseries.shape
+
+    index = timeseries.index.asi8.astype('<i8')
+    values = np.ascontiguousarray(timeseries.values.astype('<f8').T)
+
+    flags = 0
+    dtypes = ''
+    if any([dtype != np.float64 for dtype in timeseries.dtypes]):
+        dtypes = json.dumps([dtype.name for dtype in timeseries.dtypes])
+        dtypes = _dtypes_header.pack(len(dtypes)) + dtypes
+        flags = flags | FLAG_DTYPES
+
+    body = ''.join([_timeseries_header.pack(num_rows, num_cols, len(column_names)),
+                    column_names,
+                    dtypes,
+                    index.tobytes(),
+                    values.tobytes()])
+
+    if len(body) > _compression_threshold():
+        body = zlib.compress(body)
+        flags = flags | FLAG_COMPRESSED
+
+    return _header.pack(BINARY_MARKER, chr(FORMAT_TIMESERIES), flags) + body
+
+def _chunk_threshold():
+    return int(config.get('db', 'timeseries_chunk_rows', 0))
+
+def _chunk_window():
+    days = int(config.get('db', 'timeseries_chunk_days', 30))
+    return np.timedelta64(days, 'D').astype('timedelta64[ns]').astype('int64')
+
+def split_timeseries(value):
+    """
+        Split a timeseries stored in the binary format into the windows of
+        time stored in tDatasetChunk. Only timeseries with at least
+        timeseries_chunk_rows rows are split.
+
+        Returns a dictionary per window which contains any rows, with the
+        start of the window, the first and last times in it (as nanoseconds
+        since the epoch), the number of rows, the smallest and largest
+        values and the rows themselves, in the binary format. The list is
+        empty if the timeseries is not to be split.
+    """
+    threshold = _chunk_threshold()
+    if threshold <= 0 or not is_binary(value):
+        return []
+
+    timeseries = decode_timeseries(value)
+    if len(timeseries) < threshold:
+        return []
+
+    if not timeseries.index.is_monotonic_increasing:
+        timeseries = timeseries.sort_index()
+
+    times = timeseries.index.asi8
+    window_starts = times - times % _chunk_window()
+    edges = [0] + (np.flatnonzero(np.diff(window_starts)) + 1).tolist() + [len(times)]
+
+    chunks = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        chunk = timeseries.iloc[start:end]
+
+        vals = chunk.values.astype('float64')
+        vals = vals[~np.isnan(vals)]
+
+        chunks.append(dict(chunk_start = int(window_starts[start]),
+                           first_time  = int(times[start]),
+                           last_time   = int(times[end-1]),
+                           num_rows    = end - start,
+                           min_val     = float(vals.min()) if len(vals) > 0 else None,
+                           max_val     = float(vals.max()) if len(vals) > 0 else None,
+                           value       = encode_timeseries(chunk)))
+
+    return chunks
+
+def decode_timeseries(value):
+    """
+        Turn a timeseries stored in the binary format into a pandas dataframe.
+    """
+    marker, format_type, flags = _header.unpack_from(value)
+    if ord(format_type) != FORMAT_TIMESERIES:
+        raise ValueError("Unknown value format %s"%(ord(format_type),))
+
+    body = value[_header.size:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+
+    num_rows, num_cols, names_len = _timeseries_header.unpack_from(body)
+    offset = _timeseries_header.size
+
+    column_names = json.loads(body[offset:offset+names_len])
+    offset = offset + names_len
+
+    dtypes = None
+    if flags & FLAG_DTYPES:
+        dtypes_len, = _dtypes_header.unpack_from(body, offset)
+        offset = offset + _dtypes_header.size
+        dtypes = json.loads(body[offset:offset+dtypes_len])
+        offset = offset + dtypes_len
+
+    index = np.frombuffer(body, dtype='<i8', count=num_rows, offset=offset)
+    offset = offset + index.nbytes
+
+    values = np.frombuffer(body, dtype='<f8', count=num_rows*num_cols, offset=offset)
+    values = values.reshape(num_cols, num_rows)
+
+    index = pd.to_datetime(index, unit='ns')
+    if dtypes is None:
+        return pd.DataFrame(values.T, index=index, columns=column_names)
+
+    #Built column by column, as the columns are of different types.
+    timeseries = pd.concat([pd.Series(col_values.astype(dtype), index=index)
+                            for col_values, dtype in zip(values, dtypes)], axis=1)
+    timeseries.columns = column_names
+    return timeseries
+
+def read_timeseries(value):
+    """
+        Turn a stored timeseries, in any of the formats it may be stored in,
+        into a pandas dataframe.
+    """
+    if is_binary(value):
+        return decode_timeseries(value)
+
+    try:
+        #The data might be compressed.
+        value = zlib.decompress(value)
+    except Exception:
+        pass
+
+    seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+    seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+    value = value.replace(seasonal_key, seasonal_year)
+
+    return pd.read_json(value)
+
+def parse_value(data_type, value):
+    """
+        Turn the value of an incoming dataset, as sent by a client, into
+        the value stored in tDataset.
+    """
+    if value is None:
+        log.warn("Cannot parse dataset. No value specified.")
+        return None
+
+    data = str(value)
+
+    if data == 'NULL':
+        return 'NULL'
+
+    if len(data) > 100:
+        log.debug("Parsing %s", data[0:100])
+    else:
+        log.debug("Parsing %s", data)
+
+    if data_type == 'descriptor':
+        return data
+    elif data_type == 'scalar':
+        return data
+    elif data_type == 'timeseries':
+        return encode_timeseries(pd.read_json(data))
+    elif data_type == 'array':
+        # check to make sure this is valid json
+        json.loads(data)
+        if len(data) > _compression_threshold():
+            return zlib.compress(data)
+        else:
+            return data
+
+def canonical_value(data_type, value):
+    """
+        Get the form of a stored value from which its hash is made: the
+        value uncompressed. Whether a value is compressed depends on
+        compression_threshold, rather than on the data, so identical data
+        must hash the same whether it has been compressed or not.
+    """
+    if value is None or data_type not in ('array', 'timeseries'):
+        return value
+
+    if is_binary(value):
+        marker, format_type, flags = _header.unpack_from(value)
+        if not flags & FLAG_COMPRESSED:
+            return value
+        return (_header.pack(marker, format_type, flags & ~FLAG_COMPRESSED) +
+                zlib.decompress(value[_header.size:]))
+
+    try:
+        return zlib.decompress(value)
+    except Exception:
+        return value
+
+def decode_value(value):
+    """
+        Turn a stored value into the text which is sent to clients:
+        binary timeseries are converted to JSON and compressed values
+        are decompressed.
+    """
+    if value is None:
+        return None
+
+    if is_binary(value):
+        return decode_timeseries(value).to_json(date_format='iso', date_unit='ns')
+
+    try:
+        return zlib.decompress(value)
+    except Exception:
+        return value
@@ -1,4 +1,5 @@
-from HydraServer.db.model import Network, Scenario, Project, User, Role, Perm, RolePerm, RoleUser, ResourceAttr, ResourceType
+from HydraServer.db.model import Network, Scenario, Project, User, Role, Perm, RolePerm, RoleUser, ResourceAttr, ResourceType, CacheVersion, Dataset, Metadata
+from sqlalchemy import select
 from sqlalchemy.orm.exc import NoResultFound
 from HydraServer.db import DBSession
 import datetime
@@ -115,6 +116,46 @@ def create_default_net():
     return net
 
 
+def get_dataset_metadata(conn, dataset_ids):
+    """
+        Get the metadata of a list of datasets, as a dictionary of metadata
+        dictionaries keyed on dataset ID, using a connection rather than
+        DBSession. Used by the scripts in HydraServer.db which work through
+        tDataset a batch at a time.
+    """
+    metadata_tbl = Metadata.__table__
+    metadata = {}
+    rows = conn.execute(select([metadata_tbl.c.dataset_id,
+                                metadata_tbl.c.metadata_name,
+                                metadata_tbl.c.metadata_val]).where(
+                                    metadata_tbl.c.dataset_id.in_(dataset_ids)))
+    for dataset_id, name, val in rows:
+        metadata.setdefault(dataset_id, {})[name] = val
+    return metadata
+
+def create_default_cache_versions():
+    """
+        Add the versions of the templates and datasets as a whole, so
+        that requests only ever update them, rather than inserting them.
+        See HydraServer.util.changelog
+
+        A new DB has no datasets, so its search index is already populated.
+        An existing one needs HydraServer.db.index_datasets to be run.
+    """
+    for version_key in ('TEMPLATE', 'DATA'):
+        version_i = DBSession.query(CacheVersion).filter(
+                                CacheVersion.version_key==version_key).first()
+        if version_i is None:
+            DBSession.add(CacheVersion(version_key=version_key))
+
+    index_i = DBSession.query(CacheVersion).filter(
+                                CacheVersion.version_key=='TRIGRAM_INDEX').first()
+    if index_i is None:
+        has_datasets = DBSession.query(Dataset.dataset_id).first() is not None
+        DBSession.add(CacheVersion(version_key='TRIGRAM_INDEX',
+                                   version=0 if has_datasets else 1))
+    DBSession.flush()
+
 def create_default_users_and_perms():
 
     perms = DBSession.query(Perm).all()
@@ -143,7 +184,9 @@ def create_default_users_and_perms():
                     ("view_data", "View network data"),
 
                     ("add_template", "Add Template"),
-                    ("edit_template", "Edit Template"))
+                    ("edit_template", "Edit Template"),
+
+                    ("collect_data", "Delete unused data"))
 
     default_roles = (
                     ("admin",    "Administrator"),
@@ -175,6 +218,7 @@ def create_default_users_and_perms():
             ('admin', "view_data"),
             ('admin', "add_template"),
             ('admin', "edit_template"),
+            ('admin', "collect_data"),
 
             ("developer", "add_network"),
             ("developer", "edit_network"),
@@ -69,6 +69,8 @@ from HydraServer.soap_server.hydra_base import AuthenticationService,\
     HydraServiceError,\
     HydraDocument
 from HydraServer.soap_server.sharing import SharingService
+from HydraServer.soap_server.jobs import JobService
+from HydraServer.soap_server.stream import NetworkStreamApplication, NetworkImportApplication
 from spyne.util.wsgi_wrapper import WsgiMounter
 import socket
 
@@ -100,6 +102,7 @@ applications = [
     UnitService,
     RuleService,
     NoteService,
+    JobService,
 ]
 applications.extend(HydraServer.plugins.services)
 
@@ -107,6 +110,7 @@ from HydraLib.HydraException import HydraError
 
 from HydraLib import config
 from HydraServer.util import hdb
+from HydraServer.lib import jobs, data
 
 import datetime
 import traceback
@@ -198,6 +202,7 @@ class HydraServer():
 
         hdb.create_default_users_and_perms()
         hdb.create_default_net()
+        hdb.create_default_cache_versions()
         make_root_user()
 
     def create_soap_application(self):
@@ -252,6 +257,11 @@ class HydraServer():
 
         check_port_available(domain, port)
 
+        #Start the job workers and ingest processes before the server
+        #threads, so they are not forked from a process with threads running.
+        jobs.init_job_pool()
+        data.init_ingest_pool()
+
         spyne.const.xml_ns.DEFAULT_NS = 'soap_server.hydra_complexmodels'
         cp_wsgi_application = Server((domain,port), application, numthreads=10)
 
@@ -287,6 +297,8 @@ apps = {
         config.get('hydra_server', 'json_path', 'json'): json_application,
         'jsonp': jsonp_application,
         config.get('hydra_server', 'http_path', 'http'): http_application,
+        config.get('hydra_server', 'stream_path', 'stream'): NetworkStreamApplication(),
+        config.get('hydra_server', 'import_path', 'import'): NetworkImportApplication(),
 }
 
 if ui_app is not None: